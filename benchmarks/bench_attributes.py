@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure attribute-heavy workloads on documents: method lookups, connection
+attributes and the property probing done by `serialize()`.
+"""
+
+from common import bench, report
+
+from mongolite import Connection, Document
+
+def main():
+    con = Connection(_connect=False)
+
+    @con.register
+    class MyDoc(Document):
+        __database__ = 'test'
+        __collection__ = 'mydocs'
+        skeleton = {
+            'foo': unicode,
+            'bar': int,
+            'spam': {'egg': unicode, 'ham': int},
+        }
+
+    doc = con.MyDoc()
+    raw = dict(doc)
+    keys = ['foo', 'bar', 'spam', 'egg', 'ham', 'spam__egg', 'spam__ham']
+
+    def probe_doc():
+        for k in keys:
+            hasattr(doc, k)
+
+    def probe_raw():
+        for k in keys:
+            hasattr(raw, k)
+
+    report("document attribute access", [
+        ("dict: raw.get", bench(lambda: raw.get)),
+        ("mongolite: doc.save", bench(lambda: doc.save)),
+        ("mongolite: doc.serialize", bench(lambda: doc.serialize)),
+        ("mongolite: doc.collection", bench(lambda: doc.collection)),
+        ("mongolite: doc.type_field", bench(lambda: doc.type_field)),
+    ], baseline="dict: raw.get")
+    report("document attribute probing", [
+        ("dict: hasattr x %s" % len(keys), bench(probe_raw)),
+        ("mongolite: hasattr x %s" % len(keys), bench(probe_doc)),
+    ], baseline="dict: hasattr x %s" % len(keys))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure the creation of a large synthetic hierarchy of Document classes,
+which is what happens when the models of an application are imported.
+"""
+
+from common import report
+
+import time
+import datetime
+from mongolite import Document, Connection, INDEX_DESCENDING
+
+def build_models(num_models=400, depth=4):
+    """
+    build `num_models` Document classes grouped in inheritance chains of
+    `depth` classes. Each class adds fields, default values and indexes.
+    """
+    models = []
+    for i in xrange(num_models // depth):
+        parent = Document
+        for level in xrange(depth):
+            name = "Model%s_%s" % (i, level)
+            prefix = "f%s" % level
+            attrs = {
+                '__collection__': 'model%s' % i,
+                'skeleton': {
+                    prefix + '_title': unicode,
+                    prefix + '_count': int,
+                    prefix + '_date': datetime.datetime,
+                    prefix + '_tags': [unicode],
+                    prefix + '_meta': {
+                        'author': unicode,
+                        'scores': {unicode: float},
+                        'history': [{'date': datetime.datetime, 'value': int}],
+                    },
+                },
+                'optional': {
+                    prefix + '_extra': {'a': int, 'b': {'c': unicode}},
+                },
+                'default_values': {
+                    prefix + '_count': 0,
+                    prefix + '_date': datetime.datetime.utcnow,
+                    prefix + '_meta.author': u'me',
+                },
+                'indexes': [
+                    {'fields': prefix + '_title'},
+                    {'fields': [(prefix + '_count', INDEX_DESCENDING),
+                      (prefix + '_date', INDEX_DESCENDING)]},
+                ],
+            }
+            parent = type(parent)(name, (parent,), attrs)
+            models.append(parent)
+    return models
+
+def main():
+    timings = []
+    for num_models in (100, 400):
+        start = time.time()
+        models = build_models(num_models)
+        timings.append(("build %s models" % num_models, (time.time() - start) * 1e6))
+        con = Connection(_connect=False)
+        start = time.time()
+        con.register(models)
+        timings.append(("register %s models" % num_models, (time.time() - start) * 1e6))
+    report("class creation", timings)
+
+if __name__ == '__main__':
+    main()
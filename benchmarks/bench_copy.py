@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure the copy of a document: generic deepcopy of its content,
+`deepcopy(doc)` alone and followed by the mutation of one field.
+"""
+
+import datetime
+from copy import deepcopy
+
+from common import bench, report
+
+from mongolite import Connection, Document, ObjectId
+
+def main():
+    con = Connection(_connect=False)
+
+    @con.register
+    class BlogPost(Document):
+        __database__ = 'test'
+        __collection__ = 'blogposts'
+        skeleton = {
+            'title': unicode,
+            'body': unicode,
+            'author': {'name': unicode, 'email': unicode},
+            'created_at': datetime.datetime,
+            'tags': [unicode],
+            'comments': [{'author': unicode, 'body': unicode}],
+        }
+
+    doc = con.BlogPost()
+    doc['_id'] = ObjectId()
+    doc['title'] = u'title'
+    doc['body'] = u'body ' * 100
+    doc['author'] = {'name': u'me', 'email': u'me@example.org'}
+    doc['created_at'] = datetime.datetime(2012, 1, 1)
+    doc['tags'] = [u'tag%s' % i for i in range(10)]
+    doc['comments'] = [{'author': u'you', 'body': u'comment'} for i in range(10)]
+    raw = dict(doc)
+
+    def deepcopy_and_mutate():
+        obj = deepcopy(doc)
+        obj['tags'].append(u'new')
+
+    report("document copy", [
+        ("copy.deepcopy(dict)", bench(lambda: deepcopy(raw), number=10000)),
+        ("mongolite: deepcopy(doc)", bench(lambda: deepcopy(doc), number=10000)),
+        ("mongolite: deepcopy(doc) + mutation", bench(deepcopy_and_mutate, number=10000)),
+    ], baseline="copy.deepcopy(dict)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure the iteration of cursors over a batch of 100 pre-decoded documents:
+raw pymongo dicts against plain, wrapped, polymorphic (`_type`) and
+profiled mongolite cursors. The batch is loaded in the cursor so nothing is
+sent to the server.
+"""
+
+import datetime
+from collections import deque
+
+from common import bench, report
+
+import pymongo
+from pymongo.cursor import Cursor as PymongoCursor
+from mongolite import Connection, Document, ObjectId
+
+def drain(cursor, batch):
+    """
+    load `batch` as the only batch of `cursor` and return its documents
+    """
+    cursor._Cursor__data = deque(batch)
+    cursor._Cursor__killed = True
+    return list(cursor)
+
+def main():
+    con = Connection(_connect=False)
+    raw_col = pymongo.Connection(_connect=False).test.blogposts
+
+    @con.register
+    class BlogPost(Document):
+        __database__ = 'test'
+        __collection__ = 'blogposts'
+        skeleton = {
+            '_type': unicode,
+            'title': unicode,
+            'author': {'name': unicode, 'email': unicode},
+            'created_at': datetime.datetime,
+            'tags': [unicode],
+        }
+
+    @con.register
+    class Article(BlogPost):
+        skeleton = {
+            'summary': unicode,
+        }
+
+    @con.register
+    class Review(BlogPost):
+        skeleton = {
+            'rating': int,
+        }
+
+    def make_batch(types):
+        return [{
+            '_id': ObjectId(),
+            '_type': types[i % len(types)],
+            'title': u'title %s' % i,
+            'author': {'name': u'me', 'email': u'me@example.org'},
+            'created_at': datetime.datetime(2012, 1, 1),
+            'tags': [u'foo', u'bar'],
+        } for i in xrange(100)]
+
+    batch = make_batch([u'BlogPost'])
+    mixed_batch = make_batch([u'BlogPost', u'Article', u'Review'])
+    plain_batch = [dict((k, v) for k, v in doc.iteritems() if k != '_type') for doc in batch]
+    col = con.test.blogposts
+
+    report("cursor over 100 documents", [
+        ("pymongo: list(cursor)", bench(lambda: drain(PymongoCursor(raw_col), plain_batch), 2000)),
+        ("mongolite: collection.find()", bench(lambda: drain(col.find(), plain_batch), 2000)),
+        ("mongolite: Document.find()",
+          bench(lambda: drain(con.BlogPost.find(), plain_batch), 2000)),
+        ("mongolite: Document.find() (_type)",
+          bench(lambda: drain(con.BlogPost.find(), batch), 2000)),
+        ("mongolite: Document.find() (3 _type classes)",
+          bench(lambda: drain(con.BlogPost.find(), mixed_batch), 2000)),
+        ("mongolite: Document.find(profile=True)",
+          bench(lambda: drain(con.BlogPost.find(profile=True), plain_batch), 2000)),
+    ], baseline="pymongo: list(cursor)")
+
+if __name__ == '__main__':
+    main()
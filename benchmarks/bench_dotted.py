@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure DotCollapsedDict and DotExpandedDict on deep and wide documents and
+on skeletons with type keys, against a plain recursive flattening of the
+dicts.
+"""
+
+from common import bench, report
+
+from mongolite.helpers import DotCollapsedDict, DotExpandedDict
+
+def make_doc(width, depth):
+    """
+    return a dict with `width` keys per level nested `depth` times
+    """
+    if not depth:
+        return 1
+    return dict((u'key%s' % i, make_doc(width, depth - 1)) for i in range(width))
+
+def flatten(doc, prefix=''):
+    """
+    return the dotted keys of `doc` with a plain recursion
+    """
+    result = {}
+    for key, value in doc.iteritems():
+        if isinstance(value, dict):
+            result.update(flatten(value, prefix + key + '.'))
+        else:
+            result[prefix + key] = value
+    return result
+
+def main():
+    wide = make_doc(50, 2)
+    deep = make_doc(3, 6)
+    skeleton = {
+        'title': unicode,
+        'stats': {unicode: {'views': int, 'likes': int}},
+        'author': {'name': unicode, 'tags': {int: [unicode]}},
+    }
+    wide_collapsed = DotCollapsedDict(wide)
+    deep_collapsed = DotCollapsedDict(deep)
+    skeleton_collapsed = DotCollapsedDict(skeleton)
+
+    report("dotted dicts: wide (50x50 keys)", [
+        ("dict: recursive flatten", bench(lambda: flatten(wide), number=500)),
+        ("DotCollapsedDict", bench(lambda: DotCollapsedDict(wide), number=500)),
+        ("DotExpandedDict", bench(lambda: DotExpandedDict(wide_collapsed), number=500)),
+    ], baseline="dict: recursive flatten")
+    report("dotted dicts: deep (3**6 keys)", [
+        ("dict: recursive flatten", bench(lambda: flatten(deep), number=500)),
+        ("DotCollapsedDict", bench(lambda: DotCollapsedDict(deep), number=500)),
+        ("DotExpandedDict", bench(lambda: DotExpandedDict(deep_collapsed), number=500)),
+    ], baseline="dict: recursive flatten")
+    report("dotted dicts: skeleton", [
+        ("DotCollapsedDict(remove_under_type=True)", bench(
+          lambda: DotCollapsedDict(skeleton, remove_under_type=True), number=20000)),
+        ("DotExpandedDict ($type keys)", bench(
+          lambda: DotExpandedDict(skeleton_collapsed), number=20000)),
+    ])
+
+if __name__ == '__main__':
+    main()
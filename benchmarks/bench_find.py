@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure the creation of cursors by `Collection.find()` and
+`Document.find()`. Nothing is sent to the server until the cursor is
+iterated.
+"""
+
+from common import bench, report
+
+import pymongo
+from pymongo import ReadPreference
+from mongolite import Connection, Document
+
+def main():
+    con = Connection(_connect=False)
+
+    @con.register
+    class BlogPost(Document):
+        __database__ = 'test'
+        __collection__ = 'blogposts'
+        skeleton = {
+            'title': unicode,
+        }
+
+    @con.register
+    class Comment(Document):
+        __database__ = 'test'
+        __collection__ = 'comments'
+        __read_preference__ = ReadPreference.SECONDARY_PREFERRED
+        skeleton = {
+            'body': unicode,
+        }
+
+    raw_col = pymongo.Connection(_connect=False).test.blogposts
+    col = con.test.blogposts
+    BlogPost = con.BlogPost
+    Comment = con.Comment
+    spec = {'title': u'foo'}
+
+    report("find", [
+        ("pymongo: collection.find(spec)", bench(lambda: raw_col.find(spec))),
+        ("collection.find()", bench(lambda: col.find())),
+        ("collection.find(spec)", bench(lambda: col.find(spec))),
+        ("collection.find(spec, limit=10)", bench(lambda: col.find(spec, limit=10))),
+        ("Document.find(spec)", bench(lambda: BlogPost.find(spec))),
+        ("Document.find(spec) (__read_preference__)", bench(lambda: Comment.find(spec))),
+    ], baseline="pymongo: collection.find(spec)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure the extended json encoding and decoding of a document with
+datetimes and ObjectIds: the generic `json_util` hooks against
+`Document.to_json()` and `Document.from_json()`.
+"""
+
+import datetime
+import json
+
+from common import bench, report
+
+from mongolite import Connection, Document, ObjectId
+from mongolite.helpers import json_util_default, json_util_object_hook
+
+def main():
+    con = Connection(_connect=False)
+
+    @con.register
+    class Event(Document):
+        __database__ = 'test'
+        __collection__ = 'events'
+        skeleton = {
+            'user': ObjectId,
+            'created_at': datetime.datetime,
+            'name': unicode,
+            'hits': [{'date': datetime.datetime, 'ref': ObjectId, 'count': int}],
+        }
+
+    event = con.Event()
+    event['_id'] = ObjectId()
+    event['user'] = ObjectId()
+    event['created_at'] = datetime.datetime(2012, 1, 1, 10, 30)
+    event['name'] = u'event'
+    event['hits'] = [{'date': datetime.datetime(2012, 1, i + 1), 'ref': ObjectId(), 'count': i}
+      for i in range(20)]
+    json_event = event.to_json()
+
+    report("extended json encoding", [
+        ("json.dumps(default=json_util.default)",
+          bench(lambda: json.dumps(event, default=json_util_default), number=5000)),
+        ("mongolite: event.to_json()", bench(event.to_json, number=5000)),
+    ], baseline="json.dumps(default=json_util.default)")
+    report("extended json decoding", [
+        ("Event(json.loads(object_hook=...))",
+          bench(lambda: con.Event(json.loads(json_event, object_hook=json_util_object_hook)),
+          number=5000)),
+        ("mongolite: Event.from_json()",
+          bench(lambda: con.Event.from_json(json_event), number=5000)),
+    ], baseline="Event(json.loads(object_hook=...))")
+
+if __name__ == '__main__':
+    main()
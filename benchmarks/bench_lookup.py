@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure the cost of getting a registered document bound to its collection.
+"""
+
+from common import bench, report
+
+import pymongo
+from mongolite import Connection, Document
+
+def main():
+    con = Connection(_connect=False)
+    raw = pymongo.Connection(_connect=False)
+
+    @con.register
+    class MyDoc(Document):
+        __database__ = 'test'
+        __collection__ = 'mydocs'
+        skeleton = {
+            'foo': unicode,
+        }
+
+    bound = con.document(MyDoc)
+    report("registry lookups", [
+        ("pymongo: raw['test']['mydocs']", bench(lambda: raw['test']['mydocs'])),
+        ("pymongo: raw.test.mydocs", bench(lambda: raw.test.mydocs)),
+        ("mongolite: con.test.mydocs.MyDoc", bench(lambda: con.test.mydocs.MyDoc)),
+        ("mongolite: con['test']['mydocs'].MyDoc", bench(lambda: con['test']['mydocs'].MyDoc)),
+        ("mongolite: con.MyDoc", bench(lambda: con.MyDoc)),
+        ("mongolite: con.document(MyDoc)", bench(lambda: con.document(MyDoc))),
+        ("mongolite: prebuilt handle", bench(lambda: bound)),
+    ], baseline="pymongo: raw.test.mydocs")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure the memory used by each document instance. Only the containers
+allocated while building the documents are counted (the field values are
+shared between the documents).
+"""
+
+import gc
+import sys
+
+from common import report
+
+from mongolite import Connection, Document
+
+def bytes_per_document(factory, number=10000):
+    """
+    return the number of bytes of the objects allocated by one call of
+    `factory`
+    """
+    gc.collect()
+    known = set(id(obj) for obj in gc.get_objects())
+    docs = [factory() for i in xrange(number)]
+    size = 0
+    for obj in gc.get_objects():
+        if id(obj) not in known and obj is not docs and obj is not known:
+            size += sys.getsizeof(obj)
+    return float(size) / number
+
+def main():
+    con = Connection(_connect=False)
+
+    @con.register
+    class BlogPost(Document):
+        __database__ = 'test'
+        __collection__ = 'blogposts'
+        skeleton = {
+            'title': unicode,
+            'body': unicode,
+            'author': unicode,
+            'tags': [unicode],
+        }
+
+    @con.register
+    class LeanBlogPost(Document):
+        __database__ = 'test'
+        __collection__ = 'blogposts'
+        use_slots = True
+        skeleton = {
+            'title': unicode,
+            'body': unicode,
+            'author': unicode,
+            'tags': [unicode],
+        }
+
+    report("memory per document", [(name, bytes_per_document(factory)) for name, factory in [
+      ("dict", lambda: {'title': None, 'body': None, 'author': None, 'tags': []}),
+      ("mongolite: unbound document", BlogPost),
+      ("mongolite: bound document", con.BlogPost),
+      ("mongolite: bound document (use_slots)", con.LeanBlogPost)]],
+      baseline="dict", unit="bytes")
+
+if __name__ == '__main__':
+    main()
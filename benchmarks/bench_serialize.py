@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure `Document.serialize()` on a flat document and on a nested document
+with properties, against a deepcopy of the raw dict.
+"""
+
+import datetime
+from copy import deepcopy
+
+from common import bench, report
+
+from mongolite import Connection, Document, ObjectId
+
+def main():
+    con = Connection(_connect=False)
+
+    @con.register
+    class Flat(Document):
+        __database__ = 'test'
+        __collection__ = 'flat'
+        skeleton = dict(('field%s' % i, int) for i in range(10))
+
+    @con.register
+    class BlogPost(Document):
+        __database__ = 'test'
+        __collection__ = 'blogposts'
+        skeleton = {
+            'title': unicode,
+            'body': unicode,
+            'author': {'name': unicode, 'email': unicode, 'id': ObjectId},
+            'created_at': datetime.datetime,
+            'stats': {'views': int, 'likes': int, 'shares': {'mail': int, 'web': int}},
+            'tags': [unicode],
+        }
+        serialize_mapping = {'author.id': 'author_url'}
+
+        @property
+        def author_url(self):
+            return u'/users/%s' % self['author']['id']
+
+        @property
+        def created_at(self):
+            return self['created_at'].isoformat()
+
+    flat = con.Flat()
+    for i in range(10):
+        flat['field%s' % i] = i
+    post = con.BlogPost()
+    post['title'] = u'title'
+    post['author'] = {'name': u'me', 'email': u'me@example.org', 'id': ObjectId()}
+    post['created_at'] = datetime.datetime(2012, 1, 1)
+    post['stats'] = {'views': 1, 'likes': 2, 'shares': {'mail': 3, 'web': 4}}
+    post['tags'] = [u'foo', u'bar']
+
+    raw_flat = dict(flat)
+    raw_post = dict(post)
+
+    report("serialize flat document", [
+        ("copy.deepcopy(dict)", bench(lambda: deepcopy(raw_flat), number=20000)),
+        ("mongolite: flat.serialize()", bench(flat.serialize, number=20000)),
+    ], baseline="copy.deepcopy(dict)")
+    report("serialize nested document", [
+        ("copy.deepcopy(dict)", bench(lambda: deepcopy(raw_post), number=20000)),
+        ("mongolite: post.serialize()", bench(post.serialize, number=20000)),
+    ], baseline="copy.deepcopy(dict)")
+
+if __name__ == '__main__':
+    main()
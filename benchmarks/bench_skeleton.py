@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure the creation of new documents from their skeleton and their
+default values.
+"""
+
+from common import bench, report
+
+from copy import deepcopy
+import datetime
+from mongolite import Document
+
+class NestedDoc(Document):
+    skeleton = {
+        "1":{
+            "2":{
+                "3":{
+                    "4":{
+                        "5":{
+                            "6":{
+                                "7":int,
+                                "8":{
+                                    unicode:{int:int}
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+class BlogPost(Document):
+    skeleton = {
+        'title': unicode,
+        'body': unicode,
+        'author': {'name': unicode, 'email': unicode},
+        'date_creation': datetime.datetime,
+        'rank': int,
+        'tags': [unicode],
+        'comments': [{'author': unicode, 'body': unicode}],
+        'stats': {'views': int, 'likes': int, 'by_day': {unicode: int}},
+    }
+    optional = {
+        'location': (float, float),
+    }
+
+class DefaultsDoc(BlogPost):
+    default_values = {
+        'title': u'untitled',
+        'author.name': u'anonymous',
+        'date_creation': datetime.datetime.utcnow,
+        'rank': 0,
+        'tags': [u'new'],
+        'stats.views': 0,
+        'stats.likes': 0,
+        'stats.by_day': {},
+    }
+
+def _walk(doc_class):
+    doc = doc_class(gen_skel=False)
+    doc.generate_skeleton()
+    return doc
+
+def main():
+    for doc_class in (NestedDoc, BlogPost, DefaultsDoc):
+        template = dict(doc_class())
+        report("new %s" % doc_class.__name__, [
+            ("dict: deepcopy(template)", bench(lambda: deepcopy(template), 20000)),
+            ("mongolite: recursive generate_skeleton()", bench(lambda: _walk(doc_class), 20000)),
+            ("mongolite: %s()" % doc_class.__name__, bench(lambda: doc_class(), 20000)),
+            ("mongolite: %s(gen_skel=False)" % doc_class.__name__,
+              bench(lambda: doc_class(gen_skel=False), 20000)),
+        ], baseline="dict: deepcopy(template)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure the conversion of 100000 dates to and from milliseconds since epoch,
+one value at a time and in one batch (as a list and as a numpy array when
+numpy is installed).
+"""
+
+import calendar
+import datetime
+
+from common import bench, report
+
+from mongolite.helpers import totimestamps, fromtimestamps
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def old_totimestamp(value):
+    return int(calendar.timegm(value.timetuple()) * 1000 + value.microsecond / 1000)
+
+def old_fromtimestamp(epoch_date):
+    return datetime.datetime.utcfromtimestamp(float(epoch_date) / 1000.0)
+
+def main():
+    start = datetime.datetime(2012, 1, 1)
+    dates = [start + datetime.timedelta(seconds=i * 37, microseconds=i * 1000)
+      for i in xrange(100000)]
+    millis = totimestamps(dates)
+
+    results = [
+        ("totimestamp() per value", bench(
+          lambda: [old_totimestamp(date) for date in dates], number=5)),
+        ("totimestamps(list)", bench(lambda: totimestamps(dates), number=5)),
+        ("fromtimestamp() per value", bench(
+          lambda: [old_fromtimestamp(epoch_date) for epoch_date in millis], number=5)),
+        ("fromtimestamps(list)", bench(lambda: fromtimestamps(millis), number=5)),
+    ]
+    if numpy is not None:
+        dates_array = numpy.array(dates, dtype='datetime64[us]')
+        millis_array = numpy.array(millis, dtype='int64')
+        results += [
+            ("totimestamps(numpy datetime64 array)", bench(
+              lambda: totimestamps(dates_array), number=5)),
+            ("fromtimestamps(numpy int64 array)", bench(
+              lambda: fromtimestamps(millis_array), number=5)),
+        ]
+    report("100000 timestamps (usec per batch)", results)
+
+if __name__ == '__main__':
+    main()
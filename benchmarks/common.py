@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Helpers shared by the benchmark scripts. The benchmarks don't need a running
+mongod: connections are created with `_connect=False`.
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def bench(func, number=100000, repeat=3):
+    """
+    return the best time of `repeat` runs for one call of `func`
+    (in microseconds)
+    """
+    timer = timeit.Timer(func)
+    return min(timer.repeat(repeat, number)) / number * 1e6
+
+# results of all the reports of the process, see `run.py`
+all_results = []
+
+def report(title, results, baseline=None, unit='usec'):
+    """
+    print the results of a benchmark. `results` is a list of
+    (name, value) tuples. When `baseline` is the name of one of the results
+    (a raw dict or raw pymongo equivalent), the ratio of each result to the
+    baseline is printed too.
+
+    The results are also collected in `all_results` to be dumped by
+    `run.py`
+    """
+    reference = dict(results).get(baseline)
+    print title
+    print "-" * len(title)
+    for name, value in results:
+        ratio = None
+        if reference:
+            ratio = value / reference
+        if ratio is None or name == baseline:
+            print "  %-45s %10.3f %s" % (name, value, unit)
+        else:
+            print "  %-45s %10.3f %-5s x%.2f" % (name, value, unit, ratio)
+        all_results.append({
+            'group': title,
+            'name': name,
+            'value': value,
+            'unit': unit,
+            'baseline': baseline,
+            'ratio': ratio,
+        })
+    print
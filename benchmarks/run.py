@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Run the benchmarks and optionally dump their results as json to track the
+overhead of mongolite across releases::
+
+    python benchmarks/run.py                      # all the benchmarks
+    python benchmarks/run.py cursor find          # bench_cursor and bench_find
+    python benchmarks/run.py --json results.json
+
+Each result records its group, name, value, unit and, when the group has a
+raw dict or raw pymongo baseline, the ratio to that baseline.
+"""
+
+import datetime
+import glob
+import json
+import os
+import platform
+import sys
+from optparse import OptionParser
+
+import common
+
+import pymongo
+import mongolite
+
+def find_benchmarks(names=None):
+    """
+    return the names of the benchmark modules. `names` filters them (with or
+    without the `bench_` prefix)
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    modules = sorted(os.path.basename(path)[:-3]
+      for path in glob.glob(os.path.join(directory, 'bench_*.py')))
+    if names:
+        wanted = set(name if name.startswith('bench_') else 'bench_' + name for name in names)
+        unknown = wanted.difference(modules)
+        if unknown:
+            raise ValueError("unknown benchmarks: %s" % ', '.join(sorted(unknown)))
+        modules = [module for module in modules if module in wanted]
+    return modules
+
+def run(modules):
+    """
+    run the `main()` of each benchmark module and return the results
+    """
+    results = []
+    for module_name in modules:
+        start = len(common.all_results)
+        __import__(module_name).main()
+        for result in common.all_results[start:]:
+            result = dict(result, benchmark=module_name[len('bench_'):])
+            results.append(result)
+    return results
+
+def main(argv=None):
+    parser = OptionParser(usage="%prog [options] [benchmark ...]")
+    parser.add_option('--json', dest='json', metavar='FILE',
+      help="write the results as json to FILE ('-' for stdout)")
+    options, names = parser.parse_args(argv)
+    try:
+        modules = find_benchmarks(names)
+    except ValueError, e:
+        parser.error(str(e))
+    if options.json == '-':
+        # keep stdout for the json
+        stdout, sys.stdout = sys.stdout, sys.stderr
+        try:
+            results = run(modules)
+        finally:
+            sys.stdout = stdout
+    else:
+        results = run(modules)
+    if options.json:
+        data = {
+            'mongolite': mongolite.__version__,
+            'pymongo': pymongo.version,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'date': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'results': results,
+        }
+        if options.json == '-':
+            json.dump(data, sys.stdout, indent=2, sort_keys=True)
+            print
+        else:
+            with open(options.json, 'w') as fp:
+                json.dump(data, fp, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
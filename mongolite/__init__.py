@@ -35,6 +35,7 @@ from pymongo import ASCENDING as INDEX_ASCENDING,\
     OFF as INDEX_OFF,\
     ALL as INDEX_ALL
 from connection import Connection, MongoClient
-from document import Document, ObjectId
+from grid import GridFSCache
+from document import Document, ObjectId, related_property
 from mongo_exceptions import *
 from bson import json_util
@@ -27,25 +27,64 @@
 
 from pymongo.collection import Collection as PymongoCollection
 from cursor import Cursor
+from helpers import _cache_attribute
+import metrics
+
+class DocumentContext(object):
+    """
+    the collection, database and connection of a document. One context is
+    shared by all the documents bound to the same collection.
+    """
+    __slots__ = ('collection', 'db', 'connection')
+
+    def __init__(self, collection=None, db=None, connection=None):
+        if collection is not None and db is None:
+            db = collection.database
+        if db is not None and connection is None:
+            connection = db.connection
+        self.collection = collection
+        self.db = db
+        self.connection = connection
+
+_READ_OPTIONS = ('slave_okay', 'read_preference', 'tag_sets',
+  'secondary_acceptable_latency_ms')
+
+def _read_option_property(name):
+    """
+    return the property `name` of pymongo's collection which clears the
+    cached read options when it is set
+    """
+    base = getattr(PymongoCollection, name)
+    def fset(self, value):
+        base.fset(self, value)
+        self._read_options.clear()
+    return property(base.fget, fset, doc=base.__doc__)
 
 class Collection(PymongoCollection):
 
+    slave_okay = _read_option_property('slave_okay')
+    read_preference = _read_option_property('read_preference')
+    tag_sets = _read_option_property('tag_sets')
+    secondary_acceptable_latency_ms = _read_option_property('secondary_acceptable_latency_ms')
+
     def __init__(self, *args, **kwargs):
         self._documents = {}
         self._collections = {}
+        self._read_options = {}
         super(Collection, self).__init__(*args, **kwargs)
         self._registered_documents = self.database.connection._registered_documents
+        self._document_context = DocumentContext(self)
 
     def __getattr__(self, key):
         if key in self._registered_documents:
             if not key in self._documents:
                 self._documents[key] = self._registered_documents[key](collection=self)
-            return self._documents[key]
+            return _cache_attribute(self, key, self._documents[key])
         else:
             newkey = u"%s.%s" % (self.name, key)
             if not newkey in self._collections:
                 self._collections[newkey] = Collection(self.database, newkey)
-            return self._collections[newkey]
+            return _cache_attribute(self, key, self._collections[newkey])
 
     def __call__(self, *args, **kwargs):
         if "." not in self._Collection__name:
@@ -61,30 +100,72 @@ class Collection(PymongoCollection):
           "If '%s' is a Document then you may have forgotten to "
           "register it to the connection." % (name, name))
 
+    def get_read_options(self, document_class=None):
+        """
+        return the read options (`slave_okay`, `read_preference`, `tag_sets`
+        and `secondary_acceptable_latency_ms`) used by the queries on the
+        collection. The options of the collection are overridden by the read
+        attributes of `document_class` (`__read_preference__`...). The result
+        is cached until a read option of the collection is changed.
+        """
+        options = self._read_options.get(document_class)
+        if options is None:
+            options = dict((name, getattr(self, name)) for name in _READ_OPTIONS)
+            # `wrap` may be any class
+            document_options = getattr(document_class, '_read_options', None)
+            if document_options:
+                options.update(document_options)
+            self._read_options[document_class] = options
+        return options
+
     def find(self, *args, **kwargs):
-        if not 'slave_okay' in kwargs and hasattr(self, 'slave_okay'):
-            kwargs['slave_okay'] = self.slave_okay
-        if not 'read_preference' in kwargs and hasattr(self, 'read_preference'):
-            kwargs['read_preference'] = self.read_preference
-        if not 'tag_sets' in kwargs and hasattr(self, 'tag_sets'):
-            kwargs['tag_sets'] = self.tag_sets
-        if not 'secondary_acceptable_latency_ms' in kwargs and\
-                hasattr(self, 'secondary_acceptable_latency_ms'):
-            kwargs['secondary_acceptable_latency_ms'] = (
-                self.secondary_acceptable_latency_ms
-            )
-        return Cursor(self, *args, **kwargs)
+        options = self._read_options.get(kwargs.get('wrap'))
+        if options is None:
+            options = self.get_read_options(kwargs.get('wrap'))
+        if kwargs:
+            options = dict(options, **kwargs)
+        return Cursor(self, *args, **options)
     find.__doc__ = PymongoCollection.find.__doc__ + """
         added by mongolite::
             - `wrap` (optional): a class object used to wrap
             documents in the query result
     """
 
+    def find_one(self, spec_or_id=None, *args, **kwargs):
+        if spec_or_id is not None and not isinstance(spec_or_id, dict):
+            spec_or_id = {"_id": spec_or_id}
+        cursor = self.find(spec_or_id, *args, **kwargs).limit(-1)
+        cursor._operation = 'find_one'
+        for result in cursor:
+            if cursor.stats is not None:
+                cursor.close()
+            return result
+        return None
+    find_one.__doc__ = PymongoCollection.find_one.__doc__
+
+    def save(self, to_save, *args, **kwargs):
+        if metrics.registry is None:
+            return super(Collection, self).save(to_save, *args, **kwargs)
+        return metrics.call(self.full_name, metrics.document_name(to_save), 'save',
+          super(Collection, self).save, to_save, *args, **kwargs)
+    save.__doc__ = PymongoCollection.save.__doc__
+
+    def remove(self, *args, **kwargs):
+        if metrics.registry is None:
+            return super(Collection, self).remove(*args, **kwargs)
+        return metrics.call(self.full_name, None, 'remove',
+          super(Collection, self).remove, *args, **kwargs)
+    remove.__doc__ = PymongoCollection.remove.__doc__
+
     def find_and_modify(self, *args, **kwargs):
         obj_class = kwargs.pop('wrap', None)
-        doc = super(Collection, self).find_and_modify(*args, **kwargs)
-        if obj_class:
-            return self.collection[obj_class.__name__](doc)
+        if metrics.registry is None:
+            doc = super(Collection, self).find_and_modify(*args, **kwargs)
+        else:
+            doc = metrics.call(self.full_name, metrics.document_name(obj_class),
+              'find_and_modify', super(Collection, self).find_and_modify, *args, **kwargs)
+        if obj_class and doc is not None:
+            return getattr(self, obj_class.__name__)(doc)
         return doc
     find_and_modify.__doc__ = PymongoCollection.find_and_modify.__doc__ + """
         added by mongolite::
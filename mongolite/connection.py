@@ -30,6 +30,7 @@ try:
 except ImportError:
     from pymongo import MongoClient as PymongoConnection
 from database import Database
+from helpers import _cache_attribute
 
 class CallableMixin(object):
     """
@@ -45,11 +46,35 @@ class CallableMixin(object):
 
 _iterables = (list, tuple, set, frozenset)
 
+def _clear_registered_documents(connection, obj_list):
+    """
+    remove all cached documents and accessors related to the documents in
+    `obj_list` from the databases and the collections of the connection
+    """
+    obj_names = [obj.__name__ for obj in obj_list]
+    def clear_collections(collections):
+        for colname, col in collections.items():
+            for docname, doc in col._documents.items():
+                del col._documents[docname]
+                col.__dict__.pop(docname, None)
+            for obj_name in obj_names:
+                col.__dict__.pop(obj_name, None)
+                if obj_name in col._registered_documents:
+                    del col._registered_documents[obj_name]
+            clear_collections(col._collections)
+    for obj_name in obj_names:
+        connection.__dict__.pop(obj_name, None)
+    for dbname, db in connection._databases.items():
+        for obj_name in obj_names:
+            db.__dict__.pop(obj_name, None)
+        clear_collections(db._collections)
+
 class Connection(PymongoConnection):
 
     def __init__(self, *args, **kwargs):
         self._databases = {} 
         self._registered_documents = {}
+        self._bound_documents = {}
         super(Connection, self).__init__(*args, **kwargs)
     
     def register(self, obj_list):
@@ -61,13 +86,8 @@ class Connection(PymongoConnection):
             decorator = obj_list
             obj_list = [obj_list]
         # cleanup
-        for dbname, db in self._databases.items():
-            for colname, col in db._collections.items():
-                for docname, doc in col._documents.items():
-                    del col._documents[docname]
-                for obj_name in [obj.__name__ for obj in obj_list]:
-                    if obj_name in col._registered_documents:
-                        del col._registered_documents[obj_name]
+        _clear_registered_documents(self, obj_list)
+        self._bound_documents.clear()
         # register
         for obj in obj_list:
             CallableDocument = type(
@@ -81,18 +101,47 @@ class Connection(PymongoConnection):
         if decorator is not None:
             return decorator
 
+    def document(self, obj, database=None, collection=None):
+        """
+        return the registered document `obj` bound to its collection.
+
+        `database` and `collection` default to the `__database__` and
+        `__collection__` attributes of the document. The lookup is resolved
+        once and cached so the returned handle can be used in hot loops:
+
+        >>> BlogPost = con.document(BlogPost)
+        >>> blogpost = BlogPost()
+        """
+        key = (obj.__name__, database, collection)
+        if key in self._bound_documents:
+            return self._bound_documents[key]
+        if obj.__name__ not in self._registered_documents:
+            raise TypeError("%s is not registered to the connection" % obj.__name__)
+        if database is None:
+            database = getattr(obj, '__database__', None)
+        if collection is None:
+            collection = getattr(obj, '__collection__', None)
+        if database is None or collection is None:
+            raise AttributeError("%s: __database__ and __collection__ attributes "
+              "not found. You must specify them in the document or pass them "
+              "as arguments" % obj.__name__)
+        document = getattr(self[database][collection], obj.__name__)
+        self._bound_documents[key] = document
+        return document
+
     def __getattr__(self, key):
         if key in self._registered_documents:
             document = self._registered_documents[key]
             try:
-                return getattr(self[document.__database__][document.__collection__], key)
+                value = getattr(self[document.__database__][document.__collection__], key)
             except AttributeError:
                 raise AttributeError("%s: __collection__ attribute not found. "
                   "You cannot specify the `__database__` attribute without "
                   "the `__collection__` attribute" % key)
+            return _cache_attribute(self, key, value)
         else:
             if key not in self._databases:
                 self._databases[key] = Database(self, key)
-            return self._databases[key]
+            return _cache_attribute(self, key, self._databases[key])
 
 MongoClient = Connection
@@ -25,18 +25,146 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import threading
+import time
+
+from pymongo import helpers as pymongo_helpers
 from pymongo.cursor import Cursor as PymongoCursor
+from pymongo.errors import AutoReconnect
 from mongolite.mongo_exceptions import StructureError
+from mongolite.helpers import to_json
+from mongolite import metrics, slow_queries
 from collections import deque
 
+# size of the fields of a reply before the documents (flags, cursor id,
+# starting from and number returned)
+_REPLY_FIELDS_SIZE = 20
+
+class CursorStats(object):
+    """
+    the time spent by profiled cursors waiting for the batches of documents
+    (`wire_seconds`), decoding them (`decode_seconds`) and building the
+    documents (`wrap_seconds`: son manipulators, document instantiation and
+    `_type` dispatch)
+    """
+
+    def __init__(self):
+        self.cursors = 0
+        self.batches = 0
+        self.documents = 0
+        self.bytes = 0
+        self.wire_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.wrap_seconds = 0.0
+
+    @property
+    def avg_document_size(self):
+        if not self.documents:
+            return None
+        return float(self.bytes) / self.documents
+
+    def add(self, other):
+        for name in ('cursors', 'batches', 'documents', 'bytes', 'wire_seconds',
+          'decode_seconds', 'wrap_seconds'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def as_dict(self):
+        return {
+            'cursors': self.cursors,
+            'batches': self.batches,
+            'documents': self.documents,
+            'bytes': self.bytes,
+            'avg_document_size': self.avg_document_size,
+            'wire_seconds': self.wire_seconds,
+            'decode_seconds': self.decode_seconds,
+            'wrap_seconds': self.wrap_seconds,
+        }
+
+    def __repr__(self):
+        return "<CursorStats %s documents, wire %.3fs, decode %.3fs, wrap %.3fs>" % (
+          self.documents, self.wire_seconds, self.decode_seconds, self.wrap_seconds)
+
+_document_stats = {}
+_document_stats_lock = threading.Lock()
+
+def get_cursor_stats():
+    """
+    return the stats of the profiled cursors aggregated by document class
+    name (None for the cursors returning dicts). A cursor is added once
+    exhausted or closed.
+    """
+    with _document_stats_lock:
+        return dict((name, stats.as_dict()) for name, stats in _document_stats.iteritems())
+
+def reset_cursor_stats():
+    with _document_stats_lock:
+        _document_stats.clear()
+
 class Cursor(PymongoCursor):
+
+    # label of the first batch in the metrics, the next ones are `getmore`
+    _operation = 'find'
+
+    # CursorStats of a profiled cursor
+    stats = None
+
     def __init__(self, *args, **kwargs):
         self.__wrap = None
         if kwargs:
             self.__wrap = kwargs.pop('wrap', None)
+            profile = kwargs.pop('profile', None)
+            if profile is None:
+                profile = getattr(self.__wrap, '__profile_cursors__', False)
+            if profile:
+                self.profile()
         super(Cursor, self).__init__(*args, **kwargs)
 
+    def profile(self):
+        """
+        profile the cursor: the time spent waiting for the batches, decoding
+        and wrapping the documents is accumulated in `cursor.stats` (a
+        CursorStats) and added to the stats of the document class (see
+        `get_cursor_stats()`) once the cursor is exhausted. Return the cursor.
+
+        Documents can enable it for all their queries with
+        `__profile_cursors__ = True`
+        """
+        if self.stats is None:
+            self.stats = CursorStats()
+            self.stats.cursors = 1
+            self.__stats_added = False
+        return self
+
+    def __add_stats(self):
+        if not self.__stats_added:
+            self.__stats_added = True
+            name = metrics.document_name(self.__wrap)
+            with _document_stats_lock:
+                if name not in _document_stats:
+                    _document_stats[name] = CursorStats()
+                _document_stats[name].add(self.stats)
+
+    def close(self):
+        if self.stats is not None:
+            self.__add_stats()
+        super(Cursor, self).close()
+
     def next(self):
+        if self.stats is None:
+            return self.__next_document()
+        stats = self.stats
+        fetched = stats.wire_seconds + stats.decode_seconds
+        start = time.time()
+        try:
+            return self.__next_document()
+        except StopIteration:
+            self.__add_stats()
+            raise
+        finally:
+            stats.wrap_seconds += time.time() - start -\
+              (stats.wire_seconds + stats.decode_seconds - fetched)
+
+    def __next_document(self):
         if self._Cursor__empty:
             raise StopIteration
         db = self._Cursor__collection.database
@@ -60,6 +188,125 @@ class Cursor(PymongoCursor):
         else:
             raise StopIteration
 
+    def iter_json(self, chunk_size=65536):
+        """
+        iterate over the extended json array of the documents of the cursor
+        in chunks of about `chunk_size` bytes so it can be streamed into a
+        http response. The documents are not wrapped: their json is the json
+        of their raw data.
+        """
+        wrap = self.__wrap
+        self.__wrap = None
+        try:
+            chunk = ['[']
+            size = 1
+            separator = ''
+            for doc in self:
+                data = to_json(doc)
+                chunk.append(separator)
+                chunk.append(data)
+                separator = ', '
+                size += len(data) + 2
+                if size >= chunk_size:
+                    yield ''.join(chunk)
+                    chunk = []
+                    size = 0
+            chunk.append(']')
+            yield ''.join(chunk)
+        finally:
+            self.__wrap = wrap
+
+    def __send_message(self, message):
+        # overrides pymongo's Cursor.__send_message (same mangled name)
+        registry = metrics.registry
+        query_log = slow_queries.query_log
+        stats = self.stats
+        if registry is None and query_log is None and stats is None:
+            return PymongoCursor._Cursor__send_message(self, message)
+        first_batch = self.__id is None
+        if first_batch:
+            operation = self._operation
+        else:
+            operation = 'getmore'
+        collection = self.__collection.full_name
+        document = metrics.document_name(self.__wrap)
+        start = time.time()
+        try:
+            size, count, wire_seconds, decode_seconds = self.__send_message_and_unpack(message)
+        except Exception:
+            if registry is not None:
+                registry.record(collection, document, operation, time.time() - start, error=True)
+            raise
+        seconds = time.time() - start
+        if stats is not None:
+            stats.batches += 1
+            stats.documents += count
+            stats.bytes += size - _REPLY_FIELDS_SIZE
+            stats.wire_seconds += wire_seconds
+            stats.decode_seconds += decode_seconds
+        if registry is not None:
+            registry.record(collection, document, operation, seconds, count, size)
+        if query_log is not None and first_batch:
+            query_log.record(collection, document, self.__spec, self.__ordering,
+              self.__fields, seconds, self.explain)
+
+    def __send_message_and_unpack(self, message):
+        """
+        pymongo's Cursor.__send_message which returns the size of the
+        response, the number of documents and the time spent waiting for
+        the response and decoding it
+        """
+        db = self.__collection.database
+        kwargs = {"_must_use_master": self.__must_use_master}
+        kwargs["read_preference"] = self.__read_preference
+        kwargs["tag_sets"] = self.__tag_sets
+        kwargs["secondary_acceptable_latency_ms"] = (
+            self.__secondary_acceptable_latency_ms)
+        if self.__connection_id is not None:
+            kwargs["_connection_to_use"] = self.__connection_id
+        kwargs.update(self.__kwargs)
+
+        start = time.time()
+        try:
+            response = db.connection._send_message_with_response(message,
+                                                                 **kwargs)
+        except AutoReconnect:
+            self.__killed = True
+            raise
+
+        if isinstance(response, tuple):
+            (connection_id, response) = response
+        else:
+            connection_id = None
+        self.__connection_id = connection_id
+        size = len(response)
+
+        decode_start = time.time()
+        wire_seconds = decode_start - start
+        try:
+            response = pymongo_helpers._unpack_response(response, self.__id,
+                                                        self.__as_class,
+                                                        self.__tz_aware,
+                                                        self.__uuid_subtype)
+        except AutoReconnect:
+            self.__killed = True
+            db.connection.disconnect()
+            raise
+        self.__id = response["cursor_id"]
+
+        if not self.__tailable:
+            assert response["starting_from"] == self.__retrieved, (
+                "Result batch started from %s, expected %s" % (
+                    response['starting_from'], self.__retrieved))
+
+        self.__retrieved += response["number_returned"]
+        self.__data = deque(response["data"])
+        decode_seconds = time.time() - decode_start
+
+        if self.__limit and self.__id and self.__limit <= self.__retrieved:
+            self.__die()
+        return size, response["number_returned"], wire_seconds, decode_seconds
+
     def __getitem__(self, index):
         obj = super(Cursor, self).__getitem__(index)
         if (self.__wrap is not None) and isinstance(obj, dict):
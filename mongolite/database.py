@@ -29,21 +29,38 @@ from pymongo.database import Database as PymongoDatabase
 from bson.dbref import DBRef
 from mongolite.document import Document
 from collection import Collection
+from grid import GridFS
+from helpers import _cache_attribute
 
 class Database(PymongoDatabase):
 
     def __init__(self, *args, **kwargs):
         self._collections = {}
+        self._gridfs = {}
         super(Database, self).__init__(*args, **kwargs)
 
     def __getattr__(self, key):
         if key in self.connection._registered_documents:
             document = self.connection._registered_documents[key]
-            return getattr(self[document.__collection__], key)
+            return _cache_attribute(self, key, getattr(self[document.__collection__], key))
         else:
             if not key in self._collections:
                 self._collections[key] = Collection(self, key) 
-            return self._collections[key]
+            return _cache_attribute(self, key, self._collections[key])
+
+    def get_gridfs(self, collection='fs', cache=None):
+        """
+        return the GridFS instance which uses the `collection` root
+        collection. The instance is created once and shared by all the
+        documents of the database. `cache` is an optional GridFSCache used
+        by the `get_cached()` and `open_cached()` methods.
+        """
+        if collection not in self._gridfs:
+            self._gridfs[collection] = GridFS(database=self, collection=collection)
+        fs = self._gridfs[collection]
+        if cache is not None and fs.cache is None:
+            fs.cache = cache
+        return fs
 
     def dereference(self, dbref, model = None):
         if model is None:
@@ -25,18 +25,20 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from mongolite.schema_document import SchemaProperties, SchemaDocument, STRUCTURE_KEYWORDS
+from mongolite.schema_document import SchemaProperties, SchemaDocument, STRUCTURE_KEYWORDS,\
+  _ClassCache
 from mongolite.helpers import DotedDict
 from cursor import Cursor
-from helpers import DotCollapsedDict, DotExpandedDict
+from helpers import _compile_json_plan, _to_json_with_plan, _from_json_with_plan
+from collection import Collection, DocumentContext
 from bson import BSON
 from bson.binary import Binary
 from bson.code import Code
 from bson.dbref import DBRef
 from bson.objectid import ObjectId
 import pymongo
-from gridfs import GridFS
 import re
+import datetime
 from copy import deepcopy
 from uuid import UUID
 import logging
@@ -48,19 +50,108 @@ log = logging.getLogger(__name__)
 
 from mongo_exceptions import ConnectionError, OperationFailure, BadIndexError
 
+def _index_key(index):
+    """
+    return a hashable version of the index description `index` so equal
+    indexes can be found with a set lookup
+    """
+    return frozenset((key, _freeze(value)) for key, value in index.iteritems())
+
+def _freeze(value):
+    if isinstance(value, list):
+        return tuple([_freeze(v) for v in value])
+    elif isinstance(value, dict):
+        return frozenset((k, _freeze(v)) for k, v in value.iteritems())
+    return value
+
+_UNBOUND_CONTEXT = DocumentContext()
+
+# values which are shared between a document and its copies
+_IMMUTABLE_TYPES = frozenset([
+  type(None),
+  bool,
+  int,
+  long,
+  float,
+  unicode,
+  str,
+  datetime.datetime,
+  Binary,
+  ObjectId,
+  UUID,
+])
+
+def _fast_deepcopy(value, memo):
+    """
+    deepcopy `value`. Immutable scalars are not copied and dicts and lists
+    are copied without going through the copy module
+    """
+    value_type = type(value)
+    if value_type in _IMMUTABLE_TYPES:
+        return value
+    if value_type is not dict and value_type is not list:
+        return deepcopy(value, memo)
+    value_id = id(value)
+    if value_id in memo:
+        return memo[value_id]
+    if value_type is dict:
+        result = {}
+        memo[value_id] = result
+        for key, item in value.iteritems():
+            if type(item) in _IMMUTABLE_TYPES:
+                result[key] = item
+            else:
+                result[key] = _fast_deepcopy(item, memo)
+    else:
+        result = []
+        memo[value_id] = result
+        for item in value:
+            if type(item) in _IMMUTABLE_TYPES:
+                result.append(item)
+            else:
+                result.append(_fast_deepcopy(item, memo))
+    return result
+
 class DocumentProperties(SchemaProperties):
     def __new__(cls, name, bases, attrs):
+        if '__slots__' not in attrs:
+            use_slots = attrs.get('use_slots')
+            if use_slots is None:
+                use_slots = [b for b in bases if getattr(b, 'use_slots', False)]
+            if use_slots:
+                attrs['__slots__'] = ()
+                # the instances can't hold a skeleton attribute
+                if attrs.get('skeleton') is None and\
+                  not [b for b in bases if getattr(b, 'skeleton', None) is not None]:
+                    attrs['skeleton'] = {}
         for base in bases:
             parent = base.__mro__[0]
             if getattr(parent, 'skeleton', None) or getattr(parent, 'optional', None):
                 if parent.indexes:
                     if 'indexes' not in attrs:
                         attrs['indexes'] = []
-                    for index in attrs['indexes']+parent.indexes:
-                        if index not in attrs['indexes']:
+                    known_indexes = set(_index_key(index) for index in attrs['indexes'])
+                    for index in parent.indexes:
+                        frozen_index = _index_key(index)
+                        if frozen_index not in known_indexes:
+                            known_indexes.add(frozen_index)
                             attrs['indexes'].append(index)
+        attrs['_serialize_plan'] = _ClassCache('_serialize_plan', '_compile_serialize_plan')
+        attrs['_related_properties'] = _ClassCache('_related_properties',
+          '_compile_related_properties')
+        attrs['_read_options'] = _ClassCache('_read_options', '_compile_read_options')
+        attrs['_json_plan'] = _ClassCache('_json_plan', '_compile_json_plan')
         return SchemaProperties.__new__(cls, name, bases, attrs)
 
+    def _schema_changed(cls, name):
+        # the plans are compiled again on their next use
+        type.__setattr__(cls, '_serialize_plan',
+          _ClassCache('_serialize_plan', '_compile_serialize_plan'))
+        type.__setattr__(cls, '_related_properties',
+          _ClassCache('_related_properties', '_compile_related_properties'))
+        type.__setattr__(cls, '_json_plan', _ClassCache('_json_plan', '_compile_json_plan'))
+        SchemaProperties._schema_changed(cls, name)
+
     @classmethod
     def _validate_descriptors(cls, attrs):
         SchemaProperties._validate_descriptors(attrs)
@@ -74,14 +165,14 @@ class DocumentProperties(SchemaProperties):
                 for key, value in index.iteritems():
                     if key == "fields":
                         if isinstance(value, basestring):
-                            if value not in attrs['_namespaces'] and value not in STRUCTURE_KEYWORDS:
+                            if value not in attrs['_namespaces_set'] and value not in STRUCTURE_KEYWORDS:
                                 raise ValueError(
                                   "Error in indexes: can't find %s in skeleton or optional" % value )
                         elif isinstance(value, list):
                             for val in value:
                                 if isinstance(val, tuple):
                                     field, direction = val
-                                    if field not in attrs['_namespaces'] and field not in STRUCTURE_KEYWORDS:
+                                    if field not in attrs['_namespaces_set'] and field not in STRUCTURE_KEYWORDS:
                                         raise ValueError(
                                           "Error in indexes: can't find %s in skeleton or optional" % field )
                                     if not direction in [pymongo.DESCENDING, pymongo.ASCENDING, pymongo.OFF, pymongo.ALL, pymongo.GEO2D]:
@@ -94,10 +185,242 @@ class DocumentProperties(SchemaProperties):
                             raise BadIndexError(
                               "fields must be a string or a list of tuples (got %s instead)" % type(value))
 
+def _serialize_dict(doc, value, plan, path, instance_dict, overrides):
+    """
+    serialize the dict `value` found at `path` in `doc` following the
+    serialization plan `plan`. The entries of the keys which are not in the
+    plan (the keys which are not declared in the skeleton) are compiled on
+    the fly and not stored, so the plan doesn't grow with dynamic keys.
+    `overrides` maps attribute names to values already fetched.
+    """
+    result = {}
+    for key, item in value.iteritems():
+        entry = plan.get(key)
+        if entry is None:
+            entry = doc._compile_serialize_entry(path + (key,))
+        name, mapped, on_class, children = entry
+        if isinstance(item, dict) and item:
+            result[key] = _serialize_dict(doc, item, children, path + (key,),
+              instance_dict, overrides)
+            continue
+        if name in overrides:
+            item = overrides[name]
+        elif mapped:
+            item = getattr(doc, name)
+        elif name is not None and (on_class or name in instance_dict):
+            try:
+                item = getattr(doc, name)
+            except Exception:
+                # the value is kept as is, like when hasattr() fails
+                pass
+        if isinstance(item, Cursor):
+            item = list(item)
+        result[key] = item
+    return result
+
+def _get_dotted_value(doc, key):
+    """
+    return the value of the dotted `key` in `doc` or None if not found
+    """
+    value = doc
+    for bit in key.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(bit)
+    return value
+
+def _prefetch_related(db, prop, name, docs):
+    """
+    fetch the values of the related property `prop` for all the `docs` of
+    `db` with one query. Each value is stored into the overrides dict given
+    with each document.
+
+    The values are the same as the ones of the property of each document:
+    the related documents are listed once, in the order the database
+    returns them for the `$in` query, and each document gets its own
+    copies of the related documents.
+    """
+    local_values = [(_get_dotted_value(doc, prop.key), overrides)
+      for doc, overrides in docs]
+    ids = set()
+    for local_value, overrides in local_values:
+        if isinstance(local_value, list):
+            ids.update(local_value)
+        elif local_value is not None:
+            ids.add(local_value)
+    results = []
+    positions = {}
+    if ids:
+        spec = {prop.foreign_key: {'$in': list(ids)}}
+        for obj in getattr(db, prop.document).find(spec):
+            foreign_value = _get_dotted_value(obj, prop.foreign_key)
+            if not isinstance(foreign_value, list):
+                foreign_value = [foreign_value]
+            for value in foreign_value:
+                positions.setdefault(value, []).append(len(results))
+            results.append(obj)
+    used = set()
+    for local_value, overrides in local_values:
+        many = prop.many
+        if many is None:
+            many = isinstance(local_value, list)
+        if not isinstance(local_value, list):
+            local_value = [] if local_value is None else [local_value]
+        matched = set()
+        for value in local_value:
+            matched.update(positions.get(value, ()))
+        matched = sorted(matched)
+        if not many:
+            matched = matched[:1]
+        objs = []
+        for position in matched:
+            obj = results[position]
+            if position in used:
+                obj = deepcopy(obj)
+            else:
+                used.add(position)
+            objs.append(obj)
+        if many:
+            overrides[name] = objs
+        elif objs:
+            overrides[name] = objs[0]
+        else:
+            overrides[name] = None
+
+class RelatedProperty(property):
+    """
+    property which queries the documents of `document` (a registered
+    document or a collection name) whose `foreign_key` matches the value of
+    `key`. `Document.serialize_many` uses this information to fetch the
+    property for a whole list of documents with one query. See
+    `related_property`.
+    """
+    def __init__(self, fget, document, key, foreign_key='_id', many=None):
+        super(RelatedProperty, self).__init__(fget, doc=fget.__doc__)
+        self.document = document
+        self.key = key
+        self.foreign_key = foreign_key
+        self.many = many
+
+def related_property(document, key, foreign_key='_id', many=None):
+    """
+    decorator which declares a property returning the documents of
+    `document` whose `foreign_key` matches the value of `key` (a single
+    value or a list). The property serializes to a list of documents if
+    `many` is True or, when `many` is None, if the value of `key` is a list.
+
+    >>> class BlogPost(Document):
+    ...     skeleton = {'author':ObjectId, 'tags':[ObjectId]}
+    ...     @related_property('User', 'author')
+    ...     def author(self):
+    ...         return self.db.User.get_from_id(self['author'])
+    ...     @related_property('Tag', 'tags')
+    ...     def tags(self):
+    ...         return self.db.Tag.find({'_id':{'$in':self['tags']}})
+    """
+    def decorator(fget):
+        return RelatedProperty(fget, document, key, foreign_key, many)
+    return decorator
+
+def _collection_context(collection):
+    """
+    return the context shared by the documents of `collection`. A plain
+    pymongo collection has no shared context so a new one is built for it.
+    """
+    if isinstance(collection, Collection):
+        return collection._document_context
+    if not isinstance(collection, pymongo.collection.Collection):
+        raise TypeError('collection must be a Collection, not %s' %
+          type(collection).__name__)
+    return DocumentContext(collection)
+
+class ConnectionAttribute(object):
+    """
+    data descriptor used for the `collection`, `db` and `connection`
+    attributes. The values are read from the context shared by all the
+    documents of the collection. Raise a ConnectionError if the document is
+    not bound to a collection.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = getattr(obj._context, self.name)
+        if value is None:
+            raise ConnectionError('No collection found')
+        return value
+
+    def __set__(self, obj, value):
+        if self.name == 'collection':
+            if value is None:
+                obj._context = _UNBOUND_CONTEXT
+            else:
+                obj._context = _collection_context(value)
+        else:
+            context = obj._context
+            values = {'collection': context.collection, 'db': context.db,
+              'connection': context.connection}
+            values[self.name] = value
+            obj._context = DocumentContext(**values)
+
+class GridFSAttribute(object):
+    """
+    non-data descriptor used for the `fs` attribute. The GridFS instance is
+    fetched on first access from the database which shares one instance per
+    gridfs collection, then stored into the document (unless the document
+    uses slots).
+    """
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        collection = obj._context.collection
+        if collection is None:
+            return None
+        if not obj.use_gridfs:
+            raise AttributeError("'%s' object has no attribute 'fs'" % objtype.__name__)
+        gridcol = obj.__gridfs_collection__
+        if not gridcol:
+            gridcol = collection.name+'fs'
+        fs = collection.database.get_gridfs(gridcol, obj.__gridfs_cache__)
+        instance_dict = getattr(obj, '__dict__', None)
+        if instance_dict is not None:
+            instance_dict['fs'] = fs
+        return fs
+
+class CollectionClassMethod(object):
+    """
+    decorator of the class methods taking a `collection` argument. When the
+    method is called from a document bound to a collection (`con.MyDoc` or
+    an instance), `collection` defaults to the collection of the document.
+    """
+    def __init__(self, func):
+        self.func = func
+
+    def __get__(self, obj, objtype=None):
+        func = self.func
+        collection = None
+        if obj is not None:
+            collection = obj._context.collection
+        def method(*args, **kwargs):
+            kwargs.setdefault('collection', collection)
+            return func(objtype, *args, **kwargs)
+        method.__name__ = func.__name__
+        method.__doc__ = func.__doc__
+        return method
+
 class Document(SchemaDocument):
 
     __metaclass__ = DocumentProperties
 
+    __slots__ = ('_context',)
+
+    collection = ConnectionAttribute('collection')
+    db = ConnectionAttribute('db')
+    connection = ConnectionAttribute('connection')
+    fs = GridFSAttribute()
+
     type_field = '_type'
 
     serialize_mapping = {}
@@ -105,7 +428,13 @@ class Document(SchemaDocument):
     indexes = None
 
     use_gridfs = False
+    use_slots = False
     __gridfs_collection__ = None
+    __gridfs_cache__ = None
+    __read_preference__ = None
+    __tag_sets__ = None
+    __secondary_acceptable_latency_ms__ = None
+    __profile_cursors__ = False
 
     authorized_types = SchemaDocument.authorized_types + [
       Binary,
@@ -117,23 +446,14 @@ class Document(SchemaDocument):
     ]
 
     def __init__(self, doc=None, gen_skel=True, collection=None):
-        self._authorized_types = self.authorized_types[:]
         super(Document, self).__init__(doc=doc, gen_skel=gen_skel, gen_auth_types=False)
         if self.type_field in self:
             self[self.type_field] = self.__class__.__name__
         # collection
-        self.collection = collection
-        if collection:
-            self.db = collection.database
-            self.connection = self.db.connection
-            # gridfs
-            if self.use_gridfs:
-                gridcol = self.collection.name+'fs'
-                if self.__gridfs_collection__:
-                    gridcol = self.__gridfs_collection__
-                self.fs = GridFS(database=self.db, collection=gridcol)
+        if collection is None:
+            self._context = _UNBOUND_CONTEXT
         else:
-            self.fs = None
+            self._context = _collection_context(collection)
 
     def get_son_object(self):
         return BSON.encode(self)
@@ -242,21 +562,66 @@ class Document(SchemaDocument):
                 self.collection.ensure_index(fields, **kwargs)
 
     def serialize(self):
-        doc = {}
-        for k, v in DotCollapsedDict(self).iteritems():
-            if "." in k:
-                if self.serialize_mapping.get(k):
-                    v = getattr(self, self.serialize_mapping[k])
-                else:
-                    default_property_key = '__'.join(k.split('.'))
-                    if hasattr(self, default_property_key):
-                        v = getattr(self, default_property_key)
-            elif hasattr(self, k):
-                v = getattr(self, k)
-            if isinstance(v, Cursor):
-                v = list(v)
-            doc[k] = v
-        return DotExpandedDict(doc)
+        """
+        return the document as a dict where each value is replaced by the
+        property related to its key (if any) so the result can be sent as
+        is to a client. The property of `foo.bar` is found in
+        `serialize_mapping` or defaults to `foo__bar`. Cursors are turned
+        into lists.
+        """
+        instance_dict = getattr(self, '__dict__', None) or ()
+        return _serialize_dict(self, self, self._serialize_plan, (), instance_dict, {})
+
+    def to_json(self):
+        """
+        return the extended json of the document (ObjectIds and datetimes
+        are written `{"$oid": ...}` and `{"$date": ...}`). The values of the
+        declared fields are encoded following a plan compiled per class from
+        the skeleton.
+        """
+        return _to_json_with_plan(self, self._json_plan)
+
+    @CollectionClassMethod
+    def from_json(cls, json_doc, collection=None):
+        """
+        return a new document of the class built from the extended json
+        `json_doc`. The document is bound to `collection`, which defaults to
+        the collection of the document the method is called from:
+
+        >>> mydoc = MyDoc.from_json(json_doc)
+        >>> mydoc = con.MyDoc.from_json(json_doc)
+        """
+        klass = getattr(cls, '_obj_class', None) or cls
+        return klass(doc=_from_json_with_plan(json_doc, klass._json_plan),
+          collection=collection)
+
+    @classmethod
+    def serialize_many(cls, docs):
+        """
+        serialize a list (or a cursor) of documents. The related properties
+        (see `related_property`) are fetched with one query per property
+        for all the documents instead of one query per document, and the
+        result is the same as serializing each document.
+        """
+        docs = [(doc, {}) for doc in docs]
+        groups = {}
+        for doc, overrides in docs:
+            db = doc._context.db
+            if db is None:
+                continue
+            for name, prop in doc._related_properties.iteritems():
+                key = (id(db), id(prop), name)
+                if key not in groups:
+                    groups[key] = (db, prop, name, [])
+                groups[key][3].append((doc, overrides))
+        for db, prop, name, group in groups.itervalues():
+            _prefetch_related(db, prop, name, group)
+        results = []
+        for doc, overrides in docs:
+            instance_dict = getattr(doc, '__dict__', None) or ()
+            results.append(_serialize_dict(doc, doc, doc._serialize_plan, (),
+              instance_dict, overrides))
+        return results
 
     #
     # End of public API
@@ -269,14 +634,112 @@ class Document(SchemaDocument):
         else:
             raise TypeError("A Document is not hashable if it is not saved. Save the document before hashing it")
 
-    def __deepcopy__(self, memo={}):
-        obj = self.__class__(doc=deepcopy(dict(self), memo), gen_skel=False, collection=self.collection)
-        obj.__dict__ = self.__dict__.copy()
+    def __deepcopy__(self, memo=None):
+        if memo is None:
+            memo = {}
+        klass = self.__class__
+        obj = klass(gen_skel=False)
+        obj._context = self._context
+        for key, value in dict.iteritems(self):
+            if type(value) in _IMMUTABLE_TYPES:
+                dict.__setitem__(obj, key, value)
+            else:
+                dict.__setitem__(obj, key, _fast_deepcopy(value, memo))
+        if obj.type_field in obj:
+            obj[obj.type_field] = klass.__name__
+        instance_dict = getattr(self, '__dict__', None)
+        if instance_dict:
+            obj.__dict__.update(instance_dict)
         return obj
 
-    def __getattribute__(self, key):
-        # XXX remove ?
-        if key in ['collection', 'db', 'connection']:
-            if self.__dict__.get(key) is None:
-                raise ConnectionError('No collection found') 
-        return super(Document, self).__getattribute__(key)
+    @classmethod
+    def _compile_serialize_plan(cls):
+        """
+        compile the serialization plan of the skeleton and the optional
+        fields. A plan maps each key to a tuple (attribute name, mapped,
+        on_class, children plan)
+        """
+        plan = {}
+        for key in ['_id', cls.type_field]:
+            if key:
+                plan[key] = cls._compile_serialize_entry((key,))
+        if cls.skeleton:
+            cls.__compile_serialize_fields(plan, cls.skeleton, ())
+        if cls.optional:
+            cls.__compile_serialize_fields(plan, cls.optional, ())
+        return plan
+
+    @classmethod
+    def __compile_serialize_fields(cls, plan, struct, path):
+        for key, value in struct.iteritems():
+            if type(key) is type:
+                continue
+            entry = plan[key] = cls._compile_serialize_entry(path + (key,))
+            if isinstance(value, dict):
+                cls.__compile_serialize_fields(entry[3], value, path + (key,))
+
+    @classmethod
+    def _compile_serialize_entry(cls, path):
+        """
+        return the plan entry of the value found at `path` (a tuple of keys)
+        """
+        if len(path) > 1:
+            name = cls.serialize_mapping.get(".".join(["%s" % i for i in path]))
+            if name:
+                return (name, True, True, {})
+            name = '__'.join(["%s" % i for i in path])
+        else:
+            name = path[0]
+        if not isinstance(name, basestring):
+            return (None, False, False, {})
+        return (name, False, hasattr(cls, name), {})
+
+    @classmethod
+    def _compile_json_plan(cls):
+        """
+        compile the json plan of the skeleton and the optional fields (see
+        `helpers._compile_json_plan()`)
+        """
+        struct = {}
+        if cls.optional:
+            struct.update(cls.optional)
+        if cls.skeleton:
+            struct.update(cls.skeleton)
+        return _compile_json_plan(struct)
+
+    @classmethod
+    def _compile_read_options(cls):
+        """
+        return the read options set on the class, they override the options
+        of the collection (see `Collection.get_read_options()`)
+        """
+        options = {}
+        if cls.__read_preference__ is not None:
+            options['read_preference'] = cls.__read_preference__
+        if cls.__tag_sets__ is not None:
+            options['tag_sets'] = cls.__tag_sets__
+        if cls.__secondary_acceptable_latency_ms__ is not None:
+            options['secondary_acceptable_latency_ms'] = cls.__secondary_acceptable_latency_ms__
+        return options
+
+    @classmethod
+    def _compile_related_properties(cls):
+        """
+        return the related properties used to serialize the skeleton and
+        the optional fields
+        """
+        used_names = set()
+        plans = [cls._serialize_plan]
+        while plans:
+            for name, mapped, on_class, children in plans.pop().itervalues():
+                used_names.add(name)
+                plans.append(children)
+        related = {}
+        names = set()
+        for klass in cls.__mro__:
+            for name, value in vars(klass).iteritems():
+                if name not in names:
+                    names.add(name)
+                    if name in used_names and isinstance(value, RelatedProperty):
+                        related[name] = value
+        return related
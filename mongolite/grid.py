@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import mmap
+import hashlib
+import tempfile
+import threading
+import calendar
+from collections import OrderedDict
+
+from gridfs import GridFS as PymongoGridFS
+from gridfs.errors import CorruptGridFile, NoFile
+
+# fields needed to validate a cached file without reading its chunks
+_METADATA_FIELDS = ['_id', 'filename', 'length', 'chunkSize', 'md5',
+  'uploadDate', 'contentType', 'metadata']
+
+class GridFS(PymongoGridFS):
+    """
+    GridFS with streaming helpers. This is the class of the `fs` attribute
+    of documents which use gridfs.
+    """
+
+    # number of chunks fetched in advance by the readers returned by open()
+    read_ahead = 1
+
+    def __init__(self, database, collection="fs", cache=None):
+        super(GridFS, self).__init__(database, collection)
+        self._root_collection = database[collection]
+        self.cache = cache
+
+    def put_stream(self, filename, fileobj, **kwargs):
+        """
+        store the content of the file-like object `fileobj` as a new file
+        named `filename`. The data is read and written in chunk-size pieces
+        so the whole file is never loaded into memory. Any keyword arguments
+        will be passed through to the created file (`chunkSize`,
+        `content_type`, metadata...). Return the `_id` of the file.
+        """
+        kwargs['filename'] = filename
+        grid_file = self.new_file(**kwargs)
+        request = self._root_collection.database.connection.start_request()
+        try:
+            try:
+                chunk_size = grid_file.chunk_size
+                data = fileobj.read(chunk_size)
+                while data:
+                    grid_file.write(data)
+                    data = fileobj.read(chunk_size)
+            finally:
+                grid_file.close()
+        finally:
+            request.end()
+        return grid_file._id
+
+    def open(self, filename=None, version=-1, read_ahead=None, **kwargs):
+        """
+        return a seekable GridReader on a version of the file `filename`
+        (the last one by default, see `get_version()`). Only the chunks
+        covering the requested bytes are fetched, plus `read_ahead` chunks
+        in advance (defaults to `GridFS.read_ahead`).
+        """
+        file_document = self._find_version(filename, version, kwargs)
+        return self._reader(file_document, read_ahead)
+
+    def get_cached(self, file_id):
+        """
+        like `get()` but serve the file from the disk cache (see
+        GridFSCache) if the gridfs has one. Otherwise, return a GridReader.
+        """
+        file_document = self._root_collection.files.find_one(
+          {'_id': file_id}, fields=_METADATA_FIELDS)
+        if file_document is None:
+            raise NoFile("no file in gridfs collection %r with _id %r" % (
+              self._root_collection.files, file_id))
+        return self._cached_reader(file_document)
+
+    def open_cached(self, filename=None, version=-1, **kwargs):
+        """
+        like `open()` but serve the file from the disk cache (see
+        GridFSCache) if the gridfs has one.
+        """
+        file_document = self._find_version(filename, version, kwargs,
+          fields=_METADATA_FIELDS)
+        return self._cached_reader(file_document)
+
+    def _find_version(self, filename, version, query, fields=None):
+        if filename is not None:
+            query['filename'] = filename
+        cursor = self._root_collection.files.find(query, fields=fields)
+        if version < 0:
+            cursor.limit(-1).skip(abs(version) - 1).sort("uploadDate", -1)
+        else:
+            cursor.limit(-1).skip(version).sort("uploadDate", 1)
+        try:
+            return cursor.next()
+        except StopIteration:
+            raise NoFile("no version %d for filename %r" % (version, filename))
+
+    def _reader(self, file_document, read_ahead=None):
+        if read_ahead is None:
+            read_ahead = self.read_ahead
+        return GridReader(self._root_collection, file_document, read_ahead)
+
+    def _cached_reader(self, file_document):
+        if self.cache is None:
+            return self._reader(file_document)
+        return self.cache.get(self, file_document)
+
+class GridReader(object):
+    """
+    file-like object reading a GridFS file by ranges. The chunks are fetched
+    on demand: a read only queries the chunks which cover the requested
+    bytes, plus `read_ahead` following chunks in the same query. Only the
+    chunks of the current window are kept in memory.
+    """
+    def __init__(self, root_collection, file_document, read_ahead=1):
+        self._file = file_document
+        self._chunks = root_collection.chunks
+        self._read_ahead = read_ahead
+        self._position = 0
+        self._window = {}
+        self.length = int(file_document['length'])
+        self.chunk_size = int(file_document['chunkSize'])
+        if self.length:
+            self.num_chunks = (self.length - 1) // self.chunk_size + 1
+        else:
+            self.num_chunks = 0
+
+    _id = property(lambda self: self._file['_id'])
+    filename = name = property(lambda self: self._file.get('filename'))
+    content_type = property(lambda self: self._file.get('contentType'))
+    upload_date = property(lambda self: self._file.get('uploadDate'))
+    md5 = property(lambda self: self._file.get('md5'))
+    metadata = property(lambda self: self._file.get('metadata'))
+
+    def __getattr__(self, key):
+        if key in self._file:
+            return self._file[key]
+        raise AttributeError("GridReader object has no attribute '%s'" % key)
+
+    def _get_chunk(self, n):
+        if n not in self._window:
+            last = min(n + 1 + self._read_ahead, self.num_chunks)
+            self._window = {}
+            for chunk in self._chunks.find({'files_id': self._id,
+              'n': {'$gte': n, '$lt': last}}).sort('n', 1):
+                self._window[chunk['n']] = str(chunk['data'])
+            if n not in self._window:
+                raise CorruptGridFile("no chunk #%d" % n)
+        return self._window[n]
+
+    def read(self, size=-1):
+        """
+        read at most `size` bytes from the current position (all the
+        remaining bytes if `size` is negative or omitted)
+        """
+        end = self.length
+        if size >= 0:
+            end = min(self._position + size, end)
+        if end <= self._position:
+            return ''
+        data = []
+        position = self._position
+        while position < end:
+            n, offset = divmod(position, self.chunk_size)
+            chunk = self._get_chunk(n)
+            piece = chunk[offset:offset + end - position]
+            data.append(piece)
+            position += len(piece)
+        self._position = position
+        return ''.join(data)
+
+    def read_range(self, start, stop):
+        """
+        return the bytes between `start` (included) and `stop` (excluded)
+        """
+        self.seek(start)
+        return self.read(max(stop - start, 0))
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            new_pos = pos
+        elif whence == os.SEEK_CUR:
+            new_pos = self._position + pos
+        elif whence == os.SEEK_END:
+            new_pos = self.length + pos
+        else:
+            raise IOError(22, "Invalid value for `whence`")
+        if new_pos < 0:
+            raise IOError(22, "Invalid value for `pos` - must be positive")
+        self._position = new_pos
+
+    def tell(self):
+        return self._position
+
+    def __iter__(self):
+        """
+        iterate over the remaining data, chunk by chunk
+        """
+        while self._position < self.length:
+            n, offset = divmod(self._position, self.chunk_size)
+            data = self._get_chunk(n)[offset:]
+            self._position += len(data)
+            yield data
+
+    def close(self):
+        self._window = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+class CachedFile(object):
+    """
+    read-only file-like object on a memory-mapped file of the GridFSCache.
+    It has the same interface as GridReader.
+    """
+    def __init__(self, file_document, path):
+        self._file = file_document
+        self.length = int(file_document['length'])
+        self.chunk_size = int(file_document['chunkSize'])
+        self.path = path
+        self._map = None
+        if self.length:
+            fileobj = open(path, 'rb')
+            try:
+                self._map = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+            finally:
+                fileobj.close()
+        self._position = 0
+
+    _id = property(lambda self: self._file['_id'])
+    filename = name = property(lambda self: self._file.get('filename'))
+    content_type = property(lambda self: self._file.get('contentType'))
+    upload_date = property(lambda self: self._file.get('uploadDate'))
+    md5 = property(lambda self: self._file.get('md5'))
+    metadata = property(lambda self: self._file.get('metadata'))
+
+    def __getattr__(self, key):
+        if key in self._file:
+            return self._file[key]
+        raise AttributeError("CachedFile object has no attribute '%s'" % key)
+
+    def read(self, size=-1):
+        end = self.length
+        if size >= 0:
+            end = min(self._position + size, end)
+        if end <= self._position:
+            return ''
+        data = self._map[self._position:end]
+        self._position = end
+        return data
+
+    def read_range(self, start, stop):
+        self.seek(start)
+        return self.read(max(stop - start, 0))
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            new_pos = pos
+        elif whence == os.SEEK_CUR:
+            new_pos = self._position + pos
+        elif whence == os.SEEK_END:
+            new_pos = self.length + pos
+        else:
+            raise IOError(22, "Invalid value for `whence`")
+        if new_pos < 0:
+            raise IOError(22, "Invalid value for `pos` - must be positive")
+        self._position = new_pos
+
+    def tell(self):
+        return self._position
+
+    def __iter__(self):
+        while self._position < self.length:
+            yield self.read(self.chunk_size)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+class GridFSCache(object):
+    """
+    local disk cache for gridfs files, bounded to `max_size` bytes with LRU
+    eviction. Use it by setting the `__gridfs_cache__` attribute of a
+    document and reading files with `doc.fs.get_cached()` or
+    `doc.fs.open_cached()`:
+
+    >>> cache = GridFSCache('/var/cache/myapp', max_size=512*1024*1024)
+    >>> class Template(Document):
+    ...     use_gridfs = True
+    ...     __gridfs_cache__ = cache
+
+    A cached file is identified by its `_id` and its version (`md5`, or
+    `uploadDate` if the md5 is missing). Only the file document is queried
+    to validate a cached copy, the chunks are downloaded when the file is
+    not in the cache or has changed. Cached files are served through
+    memory-mapped files. Files bigger than `max_size` and files with neither
+    md5 nor uploadDate are not cached.
+    """
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._load()
+
+    def _load(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.tmp') or '-' not in name:
+                continue
+            stat = os.stat(os.path.join(self.path, name))
+            entries.append((stat.st_atime, name, stat.st_size))
+        for atime, name, size in sorted(entries):
+            self._add(name, size)
+        self._evict()
+
+    def _entry_name(self, file_document):
+        """
+        return the name of the cached copy of the file or None if the file
+        has no version (a replaced file couldn't be told from the cached one)
+        """
+        version = file_document.get('md5')
+        if not version:
+            upload_date = file_document.get('uploadDate')
+            if upload_date is None:
+                return None
+            version = "%d%06d" % (
+              calendar.timegm(upload_date.timetuple()), upload_date.microsecond)
+        file_key = hashlib.sha1(repr(file_document['_id'])).hexdigest()
+        return "%s-%s" % (file_key, version)
+
+    def _add(self, name, size):
+        file_key = name.split('-', 1)[0]
+        old_name = self._versions.get(file_key)
+        if old_name is not None and old_name != name:
+            self._remove(old_name)
+        self._versions[file_key] = name
+        self._entries[name] = size
+        self.size += size
+
+    def _remove(self, name):
+        self.size -= self._entries.pop(name)
+        file_key = name.split('-', 1)[0]
+        if self._versions.get(file_key) == name:
+            del self._versions[file_key]
+        try:
+            os.remove(os.path.join(self.path, name))
+        except OSError:
+            pass
+
+    def _evict(self, keep=None):
+        for name in list(self._entries):
+            if self.size <= self.max_size:
+                break
+            if name != keep:
+                self._remove(name)
+
+    def get(self, fs, file_document):
+        """
+        return a CachedFile for the file described by `file_document`,
+        downloading it from the gridfs `fs` if needed
+        """
+        length = int(file_document['length'])
+        if length > self.max_size:
+            return fs._reader(file_document)
+        name = self._entry_name(file_document)
+        if name is None:
+            return fs._reader(file_document)
+        path = os.path.join(self.path, name)
+        with self._lock:
+            if name in self._entries and os.path.exists(path):
+                self._entries[name] = self._entries.pop(name)
+                self.hits += 1
+                return CachedFile(file_document, path)
+            self.misses += 1
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            fileobj = os.fdopen(fd, 'wb')
+            try:
+                for data in fs._reader(file_document):
+                    fileobj.write(data)
+            finally:
+                fileobj.close()
+        except:
+            os.remove(tmp_path)
+            raise
+        # the file is moved into place, registered and opened under the lock
+        # so that another thread can't evict it in between
+        with self._lock:
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                os.remove(tmp_path)
+                raise
+            if name in self._entries:
+                self.size -= self._entries.pop(name)
+            self._add(name, length)
+            self._evict(keep=name)
+            return CachedFile(file_document, path)
+
+    def clear(self):
+        """
+        remove all the cached files
+        """
+        with self._lock:
+            for name in list(self._entries):
+                self._remove(name)
@@ -25,29 +25,335 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import __builtin__
 import datetime
 import logging
 log = logging.getLogger(__name__)
 
+import json
+from binascii import hexlify, unhexlify
+from bson.objectid import ObjectId
 from bson.json_util import default as json_util_default
 from bson.json_util import object_hook as json_util_object_hook
+from bson.json_util import EPOCH_AWARE
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+def _naive_utc(value):
+    offset = value.utcoffset()
+    if offset is not None:
+        value = (value - offset).replace(tzinfo=None)
+    return value
+
+def _is_numpy_array(values):
+    # numpy is only imported (lazily) by the caller when an array is given,
+    # so that it doesn't slow down the import of mongolite
+    return type(values).__module__ == 'numpy' and type(values).__name__ == 'ndarray'
+
+def totimestamps(values):
+    """
+    convert a sequence of datetimes into milliseconds since epoch. A numpy
+    array (of datetime64 or datetime objects) is converted in one pass and an
+    int64 array is returned, other sequences return a list
+    """
+    if _is_numpy_array(values):
+        import numpy
+        return numpy.asarray(values, dtype='datetime64[us]').view('int64') // 1000
+    epoch = _EPOCH
+    try:
+        deltas = [value - epoch for value in values]
+    except TypeError:
+        # timezone aware datetimes
+        deltas = [_naive_utc(value) - epoch for value in values]
+    return [(delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+      for delta in deltas]
+
+def fromtimestamps(epoch_dates):
+    """
+    convert a sequence of milliseconds since epoch into naive utc datetimes.
+    A numpy array is converted in one pass and a datetime64 array is returned
+    (use `tolist()` to get datetime objects), other sequences return a list
+    """
+    if _is_numpy_array(epoch_dates):
+        import numpy
+        if epoch_dates.dtype.kind in 'iu':
+            return epoch_dates.astype('datetime64[ms]')
+        micros = numpy.round(numpy.asarray(epoch_dates, dtype='float64') * 1000)
+        return micros.astype('int64').astype('datetime64[us]')
+    epoch = _EPOCH
+    timedelta = datetime.timedelta
+    # float() keeps accepting numeric strings
+    return [epoch + timedelta(milliseconds=float(epoch_date)) for epoch_date in epoch_dates]
 
 def totimestamp(value):
     """
-    convert a datetime into a float since epoch
+    convert a datetime into milliseconds since epoch
     """
-    import calendar
-    return int(calendar.timegm(value.timetuple()) * 1000 + value.microsecond / 1000)
+    return totimestamps((value,))[0]
 
 def fromtimestamp(epoch_date):
     """
-    convert a float since epoch to a datetime object
+    convert milliseconds since epoch to a datetime object
+    """
+    return fromtimestamps((epoch_date,))[0]
+
+def _json_encode_datetime(value):
+    offset = value.utcoffset()
+    if offset is not None:
+        value = (value - offset).replace(tzinfo=None)
+    delta = value - _EPOCH
+    return {"$date": (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000}
+
+def _json_encode_objectid(value):
+    # str(value) goes through a unicode decoding
+    return {"$oid": hexlify(value.binary)}
+
+def _json_decode_datetime(value):
+    return EPOCH_AWARE + datetime.timedelta(seconds=float(value) / 1000.0)
+
+_new_object = object.__new__
+
+def _json_decode_objectid(value):
+    if len(value) == 24:
+        try:
+            binary = unhexlify(value)
+        except (TypeError, ValueError):
+            pass
+        else:
+            # ObjectId() validates the value again
+            oid = _new_object(ObjectId)
+            oid.__setstate__(binary)
+            return oid
+    # same value (or error) as json_util
+    return ObjectId(str(value))
+
+# encoders of the most common types, the other types are handled by
+# json_util.default
+_JSON_ENCODERS = {
+    datetime.datetime: _json_encode_datetime,
+    ObjectId: _json_encode_objectid,
+}
+
+def _json_default(value):
+    encoder = _JSON_ENCODERS.get(type(value))
+    if encoder is None:
+        return json_util_default(value)
+    return encoder(value)
+
+def _json_object_hook(dct):
+    # the extended json objects have at most 3 keys ($ref, $id and $db)
+    if len(dct) <= 3:
+        if "$oid" in dct:
+            return _json_decode_objectid(dct["$oid"])
+        if "$date" in dct:
+            return _json_decode_datetime(dct["$date"])
+        for key in dct:
+            if key[:1] == '$':
+                return json_util_object_hook(dct)
+    return dct
+
+_json_encoder = json.JSONEncoder(default=_json_default)
+_json_decoder = json.JSONDecoder(object_hook=_json_object_hook)
+_plain_json_decoder = json.JSONDecoder()
+
+def to_json(value):
+    """
+    return the extended json (`$oid`, `$date`...) of `value`. Same as
+    `json.dumps(value, default=json_util.default)` but faster
+    """
+    return _json_encoder.encode(value)
+
+def from_json(json_doc):
+    """
+    parse the extended json `json_doc`. Same as
+    `json.loads(json_doc, object_hook=json_util.object_hook)` but faster
+    """
+    return _json_decoder.decode(json_doc)
+
+# kinds of the values of a json plan
+_JSON_SCALAR = 0  # plain json value, left as is
+_JSON_ANY = 1     # converted by the generic hooks
+_JSON_DATETIME = 2
+_JSON_OBJECTID = 3
+_JSON_DICT = 4    # the argument is the plan of the dict
+_JSON_LIST = 5    # the argument is the (kind, argument) of the items
+
+# the declared types whose json values are never extended json objects
+_JSON_SCALAR_TYPES = frozenset([unicode, str, basestring, int, long, float, bool])
+
+def _compile_json_plan(struct):
+    """
+    compile the json plan of the skeleton `struct`: a tuple (declared keys,
+    decoded entries, encoded entries). An entry is a tuple (key, kind,
+    argument) and only the values which may hold extended json have one.
+    The values which don't have the declared type and the keys which are
+    not declared go through the generic hooks.
+    """
+    declared = set()
+    decoded = []
+    encoded = []
+    for key, value in struct.iteritems():
+        # the dynamic keys (types) are converted by the generic hooks
+        if not isinstance(key, basestring):
+            continue
+        declared.add(key)
+        kind, argument = _compile_json_value(value)
+        if kind != _JSON_SCALAR:
+            decoded.append((key, kind, argument))
+            if _json_plan_encodes(kind, argument):
+                encoded.append((key, kind, argument))
+    return frozenset(declared), tuple(decoded), tuple(encoded)
+
+def _compile_json_value(value):
+    if isinstance(value, dict):
+        return _JSON_DICT, _compile_json_plan(value)
+    if isinstance(value, list):
+        if len(value) != 1:
+            return _JSON_ANY, None
+        item = _compile_json_value(value[0])
+        if item[0] in (_JSON_SCALAR, _JSON_ANY):
+            return item
+        return _JSON_LIST, item
+    if value in _JSON_SCALAR_TYPES:
+        return _JSON_SCALAR, None
+    if value is datetime.datetime:
+        return _JSON_DATETIME, None
+    if value is ObjectId:
+        return _JSON_OBJECTID, None
+    return _JSON_ANY, None
+
+def _json_plan_encodes(kind, argument):
+    """
+    return True if the values of the `kind` declared with `argument` are
+    encoded by the plan (the generic hook encodes the others)
+    """
+    if kind == _JSON_LIST:
+        kind, argument = argument
+    if kind == _JSON_DICT:
+        return bool(argument[2])
+    return kind in (_JSON_DATETIME, _JSON_OBJECTID)
+
+def _encode_json_plan(value, plan):
+    """
+    return a copy of the dict `value` where the declared values are encoded
+    following `plan`. The values which don't have the declared type are
+    left to the generic hook
+    """
+    result = dict(value)
+    for key, kind, argument in plan[2]:
+        if key not in result:
+            continue
+        item = result[key]
+        item_type = type(item)
+        if kind == _JSON_DATETIME:
+            if item_type is datetime.datetime:
+                result[key] = _json_encode_datetime(item)
+        elif kind == _JSON_OBJECTID:
+            if item_type is ObjectId:
+                result[key] = {"$oid": hexlify(item.binary)}
+        elif kind == _JSON_DICT:
+            if item_type is dict:
+                result[key] = _encode_json_plan(item, argument)
+        elif item_type is list:
+            item_kind, item_argument = argument
+            if item_kind == _JSON_DICT:
+                result[key] = [_encode_json_plan(element, item_argument)
+                  if type(element) is dict else element for element in item]
+            elif item_kind == _JSON_DATETIME:
+                result[key] = [_json_encode_datetime(element)
+                  if type(element) is datetime.datetime else element for element in item]
+            else:
+                result[key] = [{"$oid": hexlify(element.binary)}
+                  if type(element) is ObjectId else element for element in item]
+    return result
+
+def _json_convert(value):
+    """
+    convert the extended json objects found in the plain json `value` like
+    the object hook of `from_json()`
+    """
+    if isinstance(value, dict):
+        for key, item in value.iteritems():
+            if isinstance(item, (dict, list)):
+                value[key] = _json_convert(item)
+        return _json_object_hook(value)
+    if isinstance(value, list):
+        return [_json_convert(item) if isinstance(item, (dict, list)) else item
+          for item in value]
+    return value
+
+def _decode_json_value(value, kind, argument):
+    value_type = type(value)
+    if value_type is dict:
+        if kind == _JSON_DATETIME and "$date" in value:
+            return _json_decode_datetime(value["$date"])
+        if kind == _JSON_OBJECTID and "$oid" in value:
+            return _json_decode_objectid(value["$oid"])
+        if kind == _JSON_DICT:
+            return _decode_json_plan(value, argument)
+    elif value_type is list:
+        if kind == _JSON_LIST:
+            item_kind, item_argument = argument
+            if item_kind == _JSON_DICT:
+                return [_decode_json_plan(item, item_argument) if type(item) is dict
+                  else _json_convert(item) for item in value]
+            return [_decode_json_value(item, item_kind, item_argument) for item in value]
+    else:
+        return value
+    return _json_convert(value)
+
+def _decode_json_plan(value, plan):
+    """
+    decode in place the plain json dict `value` following `plan`
+    """
+    declared, decoded, encoded = plan
+    if len(value) > len(declared) or not declared.issuperset(value):
+        for key in value.viewkeys() - declared:
+            item = value[key]
+            if isinstance(item, (dict, list)):
+                value[key] = _json_convert(item)
+    for key, kind, argument in decoded:
+        if key not in value:
+            continue
+        item = value[key]
+        # the most common values are decoded inline
+        if type(item) is dict:
+            if kind == _JSON_DATETIME and "$date" in item:
+                value[key] = _json_decode_datetime(item["$date"])
+                continue
+            if kind == _JSON_OBJECTID and "$oid" in item:
+                value[key] = _json_decode_objectid(item["$oid"])
+                continue
+        value[key] = _decode_json_value(item, kind, argument)
+    return value
+
+def _to_json_with_plan(value, plan):
+    """
+    return the extended json of the dict `value`, the declared values are
+    encoded following `plan` (see `_compile_json_plan()`)
     """
-    seconds = float(epoch_date) / 1000.0
-    return datetime.datetime.utcfromtimestamp(seconds)
+    if plan[2]:
+        value = _encode_json_plan(value, plan)
+    return _json_encoder.encode(value)
+
+def _from_json_with_plan(json_doc, plan):
+    """
+    parse the extended json object `json_doc`, the declared values are
+    decoded following `plan` (see `_compile_json_plan()`)
+    """
+    return _decode_json_plan(_plain_json_decoder.decode(json_doc), plan)
 
 from copy import deepcopy
 
+def _cache_attribute(obj, key, value):
+    """
+    store `value` into the instance dict of `obj` so the next lookup of `key`
+    is a plain attribute access which doesn't go through `__getattr__`
+    """
+    if not key.startswith('__'):
+        obj.__dict__[key] = value
+    return value
+
 class i18nDotedDict(dict):
     """
     Dot notation dictionnary access with i18n support
@@ -110,6 +416,40 @@ class DotedDict(dict):
 
 class EvalException(Exception):pass
 
+# the types which can be found in the `$type` segments of the dotted keys
+_TYPES_BY_NAME = dict((name, obj) for name, obj in vars(__builtin__).iteritems()
+  if isinstance(obj, type))
+_TYPES_BY_NAME['datetime'] = datetime.datetime
+
+def register_type_name(type_, name=None):
+    """
+    allow DotExpandedDict to turn the `$name` segments of the dotted keys
+    into `type_`. `name` defaults to `type_.__name__`
+    """
+    _TYPES_BY_NAME[name or type_.__name__] = type_
+    for paths in _EXPANDED_PATHS:
+        paths.clear()
+
+# the dotted keys already split by DotExpandedDict. The unicode keys and the
+# str keys are cached apart so the keys of the expanded dicts keep the type
+# of the dotted keys
+_EXPANDED_PATHS = ({}, {})
+_EXPANDED_PATHS_MAX_SIZE = 10000
+
+def _split_dotted_key(key):
+    """
+    return the segments of the dotted `key`. `$type` segments are replaced
+    by the type they refer to
+    """
+    bits = key.split('.')
+    for i, bit in enumerate(bits):
+        if bit.startswith('$'):
+            try:
+                bits[i] = _TYPES_BY_NAME[bit[1:]]
+            except KeyError:
+                raise EvalException('%s is not a python type' % bit)
+    return tuple(bits)
+
 class DotExpandedDict(dict): 
     """ 
     A special dictionary constructor that takes a dictionary in which the keys 
@@ -134,26 +474,26 @@ class DotExpandedDict(dict):
     # code taken from Django source code http://code.djangoproject.com/
     def __init__(self, key_to_list_mapping): 
         for k, v in key_to_list_mapping.items(): 
+            paths = _EXPANDED_PATHS[type(k) is str]
+            bits = paths.get(k)
+            if bits is None:
+                if len(paths) >= _EXPANDED_PATHS_MAX_SIZE:
+                    paths.clear()
+                bits = paths[k] = _split_dotted_key(k)
             current = self 
-            bits = k.split('.') 
             for bit in bits[:-1]: 
-               if bit.startswith('$'):
-                   try:
-                        bit = eval(bit[1:])
-                   except:
-                        raise EvalException('%s is not a python type' % bit[:1])
                current = current.setdefault(bit, {}) 
             # Now assign value to current position 
-            last_bit = bits[-1]
-            if last_bit.startswith('$'):
-               try:
-                    last_bit = eval(last_bit[1:])
-               except:
-                    raise EvalException('%s is not a python type' % last_bit)
             try: 
-                current[last_bit] = v 
+                current[bits[-1]] = v 
             except TypeError: # Special-case if current isn't a dict. 
-                current = {last_bit: v} 
+                current = {bits[-1]: v} 
+
+def _has_type_key(doc):
+    for key in doc:
+        if isinstance(key, type):
+            return True
+    return False
 
 class DotCollapsedDict(dict):
     """
@@ -177,41 +517,40 @@ class DotCollapsedDict(dict):
     def __init__(self, passed_dict, remove_under_type=False, reference=None):
         self._remove_under_type = remove_under_type
         assert isinstance(passed_dict, dict), "you must pass a dict instance"
-        final_dict = {}
         self._reference = reference
-        self._make_dotation(passed_dict, final_dict)
-        self.update(final_dict)
+        self._make_dotation(passed_dict, self)
 
     def _make_dotation(self, d, final_dict, key=""):
-        for k,v in d.iteritems():
-            if isinstance(k, type):
-                k = "$%s" % k.__name__
-            if isinstance(v, dict) and v != {}:
-                if key:
-                    _key = "%s.%s" % (key, k)
+        remove_under_type = self._remove_under_type
+        reference = self._reference
+        _isinstance, _basestring, _type, _dict = isinstance, basestring, type, dict
+        # the nested dicts are walked with a stack of (items iterator,
+        # prefix of their keys)
+        if key:
+            key = "%s." % key
+        stack = [(d.iteritems(), key)]
+        while stack:
+            items, prefix = stack[-1]
+            for k, v in items:
+                if _isinstance(k, _basestring):
+                    path = prefix + k
+                elif _isinstance(k, _type):
+                    k = path = "$%s" % k.__name__
+                    if prefix:
+                        path = prefix + k
+                elif prefix:
+                    path = "%s%s" % (prefix, k)
                 else:
-                    _key = k
-                if self._reference and _key in self._reference:
-                    final_dict[_key]=v
-                if self._remove_under_type:
-                    if [1 for i in v.keys() if isinstance(i, type)]:
-                        v = v.__class__()
-                        if not key:
-                            final_dict[k] = v
-                        else:
-                            final_dict["%s.%s" % (key, k)] = v
+                    path = k
+                if _isinstance(v, _dict) and v:
+                    if reference and path in reference:
+                        final_dict[path] = v
+                    if remove_under_type and _has_type_key(v):
+                        final_dict[path] = v.__class__()
                     else:
-                        self._make_dotation(v, final_dict, _key)
-                else: 
-                    self._make_dotation(v, final_dict, _key)
+                        stack.append((v.iteritems(), "%s." % path))
+                        break
+                elif not prefix or not reference or path in reference:
+                    final_dict[path] = v
             else:
-                if not key:
-                    final_dict[k] = v
-                else:
-                    if not self._reference:
-                        final_dict["%s.%s" % (key, k)] = v
-                    elif "%s.%s" % (key, k) in self._reference:
-                        final_dict["%s.%s" % (key, k)] = v
-                    #else:
-                    #    final_dict[key] = {k: v}
-                    #    print "+++", {k:v}
+                stack.pop()
@@ -0,0 +1,589 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Load generator driven by the skeletons of registered documents. The
+documents are synthesized from the `skeleton` and `optional` declarations
+and a mix of inserts, finds, updates and deletes is sent at a target rate to
+capacity-test schema and index changes before shipping them::
+
+    python -m mongolite.loadgen myapp.models:BlogPost myapp.models:Comment \\
+      --host localhost --rate 500 --duration 30 \\
+      --mix insert=1,find=4,update=2,delete=1 --ensure-indexes
+
+A module name instead of `module:Document` loads all the documents of the
+module which declare a `__collection__`. The throughput and the latency
+percentiles are reported by operation. The finds query the fields of a
+random declared index (or the `_id`) with the values of a previously
+inserted document.
+
+It can be used from python too:
+
+>>> generator = LoadGenerator([con.document(BlogPost)], rate=200, duration=10)
+>>> print generator.run().format()
+"""
+
+import datetime
+import json
+import math
+import random
+import string
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from optparse import OptionParser
+
+from bson.binary import Binary
+from bson.objectid import ObjectId
+
+from mongolite.connection import MongoClient
+from mongolite.document import Document
+
+OPERATIONS = ('insert', 'find', 'update', 'delete')
+
+DEFAULT_MIX = {'insert': 1, 'find': 4, 'update': 2, 'delete': 1}
+
+_WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+  'tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam quis '
+  'nostrud exercitation ullamco laboris nisi aliquip ex ea commodo consequat').split()
+
+def _merge(target, value):
+    """
+    merge the dict `value` into the dict `target`, recursively
+    """
+    for key, item in value.iteritems():
+        if isinstance(item, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], item)
+        else:
+            target[key] = item
+
+class DocumentFactory(object):
+    """
+    synthesize documents from the `skeleton` and `optional` of
+    `document_class`. Each optional field is filled with the probability
+    `optional_ratio`, the lists and the dicts with type keys get up to
+    `max_items` items. `_id` is left to the server
+    """
+
+    def __init__(self, document_class, max_items=5, optional_ratio=0.5, seed=None):
+        self.document_class = document_class
+        self.max_items = max_items
+        self.optional_ratio = optional_ratio
+        self.random = random.Random(seed)
+        self.skeleton = document_class.skeleton or {}
+        self.optional = document_class.optional or {}
+        self.leaves = []
+        for struct in (self.skeleton, self.optional):
+            self._collect_leaves(struct, ())
+
+    def _collect_leaves(self, struct, path):
+        for key, value in struct.iteritems():
+            if not path and key in ('_id', self.document_class.type_field):
+                continue
+            if isinstance(value, dict) and value and\
+              all(isinstance(k, basestring) for k in value):
+                self._collect_leaves(value, path + (key,))
+            else:
+                self.leaves.append(('.'.join(path + (key,)), value))
+
+    def make(self):
+        """
+        return a new random document (a dict)
+        """
+        doc = self.make_value(self.skeleton)
+        doc.pop('_id', None)
+        for key, struct in self.optional.iteritems():
+            if self.random.random() < self.optional_ratio:
+                value = self.make_value(struct)
+                if isinstance(value, dict) and isinstance(doc.get(key), dict):
+                    # the optional fields extend the skeleton ones
+                    _merge(doc[key], value)
+                else:
+                    doc[key] = value
+        type_field = self.document_class.type_field
+        if type_field in doc:
+            doc[type_field] = unicode(self.document_class.__name__)
+        return doc
+
+    def make_update(self):
+        """
+        return a random `$set` of one field of the skeleton
+        """
+        path, struct = self.random.choice(self.leaves)
+        return {'$set': {path: self.make_value(struct)}}
+
+    def make_value(self, struct):
+        """
+        return a random value matching the skeleton declaration `struct`
+        """
+        if isinstance(struct, dict):
+            value = {}
+            for key, item in struct.iteritems():
+                if isinstance(key, basestring):
+                    value[key] = self.make_value(item)
+                else:
+                    # type keys: bson keys must be strings
+                    for i in xrange(self.random.randint(1, self.max_items)):
+                        value[unicode(self.make_value(key))] = self.make_value(item)
+            return value
+        if isinstance(struct, list):
+            if not struct:
+                return []
+            return [self.make_value(self.random.choice(struct))
+              for i in xrange(self.random.randint(0, self.max_items))]
+        if isinstance(struct, tuple):
+            return tuple(self.make_value(item) for item in struct)
+        if isinstance(struct, type) and issubclass(struct, Document):
+            return self.make_value(struct.skeleton or {})
+        return self.make_scalar(struct)
+
+    def make_scalar(self, type_):
+        """
+        return a random value of `type_` (None for the unsupported types)
+        """
+        rand = self.random
+        if type_ is bool:
+            return rand.random() < 0.5
+        if type_ in (int, long):
+            return type_(rand.randint(0, 100000))
+        if type_ is float:
+            return round(rand.uniform(0, 1000), 3)
+        if type_ in (unicode, basestring):
+            return u' '.join(rand.choice(_WORDS) for i in xrange(rand.randint(1, 8)))
+        if type_ is str:
+            return ''.join(rand.choice(string.ascii_lowercase) for i in xrange(8))
+        if type_ is datetime.datetime:
+            # mongodb stores milliseconds
+            return datetime.datetime(2012, 1, 1) + datetime.timedelta(
+              milliseconds=rand.randint(0, 365 * 24 * 3600 * 1000))
+        if type_ is ObjectId:
+            return ObjectId()
+        if type_ is uuid.UUID:
+            return uuid.UUID(int=rand.getrandbits(128))
+        if type_ is Binary:
+            return Binary(''.join(chr(rand.randint(0, 255)) for i in xrange(16)))
+        if type_ is list:
+            return []
+        if type_ is dict:
+            return {}
+        return None
+
+def _get_path(doc, path):
+    for key in path.split('.'):
+        if not isinstance(doc, dict) or key not in doc:
+            raise KeyError(path)
+        doc = doc[key]
+    return doc
+
+def _index_fields(index):
+    fields = index['fields']
+    if isinstance(fields, basestring):
+        return [fields]
+    return [field if isinstance(field, basestring) else field[0] for field in fields]
+
+class _Target(object):
+    """
+    a bound document, its factory and the ids and the samples of the
+    documents inserted so far. The ids are a reservoir sample of at most
+    `max_ids` ids so the memory used doesn't depend on the length of the run
+    """
+
+    def __init__(self, document, factory, max_samples=1000, max_ids=100000):
+        self.document = document
+        self.collection = document.collection
+        self.factory = factory
+        self.indexes = [_index_fields(index) for index in document.indexes or ()]
+        self.ids = []
+        self.max_ids = max_ids
+        self.added = 0
+        self.samples = deque(maxlen=max_samples)
+        self.lock = threading.Lock()
+
+    def add(self, doc):
+        with self.lock:
+            self.added += 1
+            if len(self.ids) < self.max_ids:
+                self.ids.append(doc['_id'])
+            else:
+                position = self.factory.random.randrange(self.added)
+                if position < self.max_ids:
+                    self.ids[position] = doc['_id']
+            self.samples.append(doc)
+
+    def pop_id(self):
+        with self.lock:
+            if not self.ids:
+                return None
+            position = self.factory.random.randrange(len(self.ids))
+            self.ids[position], self.ids[-1] = self.ids[-1], self.ids[position]
+            return self.ids.pop()
+
+    def random_id(self):
+        with self.lock:
+            if not self.ids:
+                return None
+            return self.factory.random.choice(self.ids)
+
+    def query(self):
+        """
+        return the spec of a find: the fields of a random index with the
+        values of a sample, or the `_id` of a sample
+        """
+        with self.lock:
+            if not self.samples:
+                return {'_id': None}
+            sample = self.factory.random.choice(self.samples)
+            fields = self.indexes and self.factory.random.choice(self.indexes)
+        if fields:
+            try:
+                return dict((field, _get_path(sample, field)) for field in fields)
+            except KeyError:
+                pass
+        return {'_id': sample['_id']}
+
+class OperationStats(object):
+    """
+    the count, errors, skipped operations (update or delete without a
+    document to target) and latencies (in seconds) of one operation. The
+    latencies are kept in a histogram of logarithmic buckets so the memory
+    used doesn't depend on the length of the run: the percentiles are
+    exact within `precision` (1%)
+    """
+
+    precision = 0.01
+    # shortest latency told apart
+    resolution = 1e-6
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.skipped = 0
+        self.max = None
+        self.buckets = {}
+
+    def record(self, latency, error=False):
+        self.count += 1
+        if error:
+            self.errors += 1
+        if self.max is None or latency > self.max:
+            self.max = latency
+        if latency > self.resolution:
+            bucket = int(math.log(latency / self.resolution) / math.log1p(self.precision))
+        else:
+            bucket = 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, percent):
+        """
+        return the `percent` percentile of the latencies (nearest rank) or
+        None if there is none
+        """
+        total = sum(self.buckets.itervalues())
+        if not total:
+            return None
+        rank = min(max(int(round(total * percent / 100.0)), 1), total)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                break
+        # the upper bound of the bucket
+        return min(self.resolution * (1 + self.precision) ** (bucket + 1), self.max)
+
+class LoadReport(object):
+    """
+    the OperationStats by operation of a run of `seconds`
+    """
+
+    def __init__(self, operations):
+        self.seconds = 0.0
+        self.operations = dict((operation, OperationStats()) for operation in operations)
+
+    def as_dict(self):
+        result = {'seconds': self.seconds, 'operations': {}}
+        total = 0
+        for operation, stats in self.operations.iteritems():
+            total += stats.count
+            result['operations'][operation] = {
+                'count': stats.count,
+                'errors': stats.errors,
+                'skipped': stats.skipped,
+                'throughput': stats.count / self.seconds if self.seconds else 0.0,
+                'p50': stats.percentile(50),
+                'p90': stats.percentile(90),
+                'p99': stats.percentile(99),
+                'max': stats.max,
+            }
+        result['count'] = total
+        result['throughput'] = total / self.seconds if self.seconds else 0.0
+        return result
+
+    def format(self):
+        """
+        return the report as a text table (latencies in milliseconds)
+        """
+        data = self.as_dict()
+        lines = ["%-8s %8s %7s %7s %9s %9s %9s %9s %9s" % (
+          'op', 'count', 'errors', 'skipped', 'ops/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms')]
+        def ms(value):
+            if value is None:
+                return '-'
+            return '%.2f' % (value * 1000)
+        for operation in OPERATIONS:
+            if operation not in data['operations']:
+                continue
+            stats = data['operations'][operation]
+            lines.append("%-8s %8d %7d %7d %9.1f %9s %9s %9s %9s" % (
+              operation, stats['count'], stats['errors'], stats['skipped'], stats['throughput'],
+              ms(stats['p50']), ms(stats['p90']), ms(stats['p99']), ms(stats['max'])))
+        lines.append("%-8s %8d %7s %7s %9.1f" % ('total', data['count'], '', '', data['throughput']))
+        return '\n'.join(lines)
+
+def parse_mix(mix):
+    """
+    parse 'insert=1,find=4' into {'insert': 1, 'find': 4}
+    """
+    result = {}
+    for item in mix.split(','):
+        operation, sep, weight = item.partition('=')
+        operation = operation.strip()
+        if operation not in OPERATIONS:
+            raise ValueError("unknown operation %r (expected one of %s)" % (
+              operation, ', '.join(OPERATIONS)))
+        try:
+            result[operation] = float(weight) if sep else 1.0
+        except ValueError:
+            raise ValueError("bad weight %r for %s" % (weight, operation))
+        if result[operation] < 0:
+            raise ValueError("bad weight %r for %s" % (weight, operation))
+    if not sum(result.values()):
+        raise ValueError("the mix %r has no operation" % mix)
+    return result
+
+class LoadGenerator(object):
+    """
+    send a `mix` (a dict of weights by operation, see `DEFAULT_MIX`) of
+    operations on random documents among `documents` (bound documents, ie:
+    `con.document(BlogPost)`) at `rate` operations per second (None for as
+    fast as possible) from `concurrency` threads during `duration` seconds.
+
+    `prefill` documents of each class are inserted before the run so the
+    finds, updates and deletes have targets (they are replaced by inserts
+    while there is none, and an update or a delete whose target was taken
+    by another thread is counted as skipped). The finds return up to
+    `find_limit` documents.
+
+    With a `rate`, the operations are scheduled at fixed times and their
+    latency is measured from the time they were scheduled: an operation
+    delayed by the previous ones (the server can't keep up) counts the
+    time it waited.
+    """
+
+    def __init__(self, documents, mix=None, rate=None, duration=10, concurrency=4,
+      prefill=100, find_limit=10, ensure_indexes=False, seed=None):
+        if not documents:
+            raise ValueError("no document to load")
+        self.mix = dict(mix or DEFAULT_MIX)
+        self.rate = rate
+        self.duration = duration
+        self.concurrency = concurrency
+        self.prefill = prefill
+        self.find_limit = find_limit
+        self.ensure_indexes = ensure_indexes
+        self.random = random.Random(seed)
+        self.targets = [_Target(document, DocumentFactory(document._obj_class,
+          seed=self.random.random())) for document in documents]
+        self._operations = [operation for operation in OPERATIONS if self.mix.get(operation)]
+        self._weights = [self.mix[operation] for operation in self._operations]
+        self._lock = threading.Lock()
+
+    def _choose(self):
+        with self._lock:
+            target = self.random.choice(self.targets)
+            point = self.random.uniform(0, sum(self._weights))
+        for operation, weight in zip(self._operations, self._weights):
+            point -= weight
+            if point <= 0:
+                return target, operation
+        return target, self._operations[-1]
+
+    def insert(self, target):
+        doc = target.document(target.factory.make())
+        doc.save()
+        target.add(doc)
+
+    def find(self, target):
+        for doc in target.document.find(target.query()).limit(self.find_limit):
+            pass
+
+    def update(self, target):
+        _id = target.random_id()
+        if _id is None:
+            return False
+        target.collection.update({'_id': _id}, target.factory.make_update())
+
+    def delete(self, target):
+        _id = target.pop_id()
+        if _id is None:
+            return False
+        target.collection.remove({'_id': _id})
+
+    def _worker(self, report, schedule, end):
+        while True:
+            if schedule is not None:
+                with self._lock:
+                    slot = schedule[0]
+                    schedule[0] += 1.0 / self.rate
+                if slot >= end:
+                    return
+                delay = slot - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            elif time.time() >= end:
+                return
+            target, operation = self._choose()
+            if not target.ids:
+                # nothing to find, update or delete yet
+                operation = 'insert'
+            if schedule is not None:
+                # the latency includes the time waited since the slot
+                start = slot
+            else:
+                start = time.time()
+            error = False
+            try:
+                done = getattr(self, operation)(target)
+            except Exception:
+                done = None
+                error = True
+            latency = time.time() - start
+            with self._lock:
+                stats = report.operations.get(operation)
+                if stats is None:
+                    stats = report.operations[operation] = OperationStats()
+                if done is False:
+                    # another thread took the last id
+                    stats.skipped += 1
+                else:
+                    stats.record(latency, error)
+
+    def run(self):
+        """
+        prefill the collections, run the load and return a LoadReport
+        """
+        for target in self.targets:
+            if self.ensure_indexes:
+                target.document().generate_indexes()
+            for i in xrange(self.prefill):
+                self.insert(target)
+        report = LoadReport(self._operations)
+        start = time.time()
+        end = start + self.duration
+        schedule = None
+        if self.rate:
+            schedule = [start]
+        threads = [threading.Thread(target=self._worker, args=(report, schedule, end))
+          for i in xrange(self.concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report.seconds = time.time() - start
+        return report
+
+def load_documents(names):
+    """
+    return the Document classes named `module:Document` or all the
+    documents with a `__collection__` defined in `module`
+    """
+    documents = []
+    for name in names:
+        module_name, sep, class_name = name.partition(':')
+        __import__(module_name)
+        module = sys.modules[module_name]
+        if sep:
+            documents.append(getattr(module, class_name))
+            continue
+        for value in vars(module).values():
+            if isinstance(value, type) and issubclass(value, Document) and\
+              value.__module__ == module_name and getattr(value, '__collection__', None):
+                documents.append(value)
+    return documents
+
+def main(argv=None):
+    parser = OptionParser(prog="python -m mongolite.loadgen",
+      usage="%prog [options] module[:Document] ...")
+    parser.add_option('--host', default='localhost')
+    parser.add_option('--port', type='int', default=27017)
+    parser.add_option('--database', help="database of the documents without __database__")
+    parser.add_option('--mix', default='insert=1,find=4,update=2,delete=1',
+      help="weights of the operations [%default]")
+    parser.add_option('--rate', type='float', default=0,
+      help="target operations per second, 0 for as fast as possible [%default]")
+    parser.add_option('--duration', type='float', default=10, help="in seconds [%default]")
+    parser.add_option('--concurrency', type='int', default=4, help="threads [%default]")
+    parser.add_option('--prefill', type='int', default=100,
+      help="documents inserted per class before the run [%default]")
+    parser.add_option('--find-limit', type='int', default=10, help="[%default]")
+    parser.add_option('--ensure-indexes', action='store_true', default=False,
+      help="create the declared indexes before the run")
+    parser.add_option('--seed', type='int')
+    parser.add_option('--json', metavar='FILE', help="also write the report as json to FILE")
+    options, names = parser.parse_args(argv)
+    if not names:
+        parser.error("no document given")
+    try:
+        mix = parse_mix(options.mix)
+    except ValueError, e:
+        parser.error(str(e))
+    document_classes = load_documents(names)
+    if not document_classes:
+        parser.error("no document found in %s" % ', '.join(names))
+    # acknowledged writes, their latency is meaningless otherwise
+    con = MongoClient(options.host, options.port, w=1)
+    con.register(document_classes)
+    documents = []
+    for document_class in document_classes:
+        database = getattr(document_class, '__database__', None) or options.database
+        try:
+            documents.append(con.document(document_class, database=database))
+        except AttributeError, e:
+            parser.error(str(e))
+    report = LoadGenerator(documents, mix=mix, rate=options.rate or None,
+      duration=options.duration, concurrency=options.concurrency,
+      prefill=options.prefill, find_limit=options.find_limit,
+      ensure_indexes=options.ensure_indexes, seed=options.seed).run()
+    print report.format()
+    if options.json:
+        with open(options.json, 'w') as fp:
+            json.dump(report.as_dict(), fp, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -4,20 +4,191 @@ Andreas Jung, info@zopyx.com
 (same license as Mongokit)
 """
 
+import Queue
+import collections
+import random
+import struct
+import threading
+import time
+import weakref
+
 from pymongo.master_slave_connection import MasterSlaveConnection as PymongoMasterSlaveConnection
+from pymongo.errors import AutoReconnect, OperationFailure
 
+# pymongo's MasterSlaveConnection only accepts Connection instances
 try:
-    from pymongo import MongoClient as PymongoConnection
-except ImportError:
     from pymongo import Connection as PymongoConnection
+except ImportError:
+    from pymongo import MongoClient as PymongoConnection
 
 from mongolite.database import Database
-from mongolite.connection import CallableMixin, _iterables
+from mongolite.connection import CallableMixin, _iterables,\
+    _clear_registered_documents
+
+class NodeStats(object):
+    """
+    latency and health of a node of a MasterSlaveConnection. `latency` is a
+    moving average of the response times in seconds (None until the node
+    answered once)
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.latency = None
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.open_until = 0
+        self.synced_to = None
+
+    def record_success(self, latency, alpha):
+        self.requests += 1
+        self.consecutive_failures = 0
+        self.open_until = 0
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += alpha * (latency - self.latency)
+
+    def record_failure(self, now, failure_threshold, retry_delay):
+        self.requests += 1
+        self.errors += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= failure_threshold:
+            self.open_until = now + retry_delay
+
+    def is_available(self, now):
+        """
+        return False while the circuit breaker of the node is open
+        """
+        return self.open_until <= now
+
+    def as_dict(self, now=None):
+        if now is None:
+            now = time.time()
+        return {
+            'node': self.name,
+            'latency_ms': self.latency * 1000 if self.latency is not None else None,
+            'requests': self.requests,
+            'errors': self.errors,
+            'consecutive_failures': self.consecutive_failures,
+            'available': self.is_available(now),
+            'synced_to': self.synced_to,
+        }
+
+def _node_name(connection):
+    return "%s:%s" % (connection.host, connection.port)
+
+_WRITE_OPCODES = frozenset([2001, 2002, 2006]) # update, insert, delete
+
+# the commands writing to the collection they are given (lowercase)
+_WRITE_COMMANDS = frozenset(['findandmodify', 'insert', 'update', 'delete',
+  'create', 'drop', 'dropindexes', 'deleteindexes'])
+
+def _message_opcode(message):
+    return struct.unpack("<i", message[1][12:16])[0]
+
+def _message_namespace(message):
+    # writes and queries start with a 32 bits int and the full collection
+    # name after the header
+    data = message[1]
+    return data[20:data.index('\x00', 20)]
+
+def _command_namespace(message):
+    """
+    return the namespace written by the command query `message` or None if
+    `message` is not a known write command
+    """
+    data = message[1]
+    end = data.index('\x00', 20)
+    if data[end - 5:end] != '.$cmd':
+        return None
+    # the command document follows the skip and the limit of the query,
+    # its first element is the command
+    position = end + 13
+    key_end = data.index('\x00', position + 1)
+    if data[position + 1:key_end].lower() not in _WRITE_COMMANDS:
+        return None
+    database = data[20:end - 5]
+    if data[position] != '\x02':
+        return database
+    length = struct.unpack("<i", data[key_end + 1:key_end + 5])[0]
+    return "%s.%s" % (database, data[key_end + 5:key_end + 4 + length])
+
+def _optime(timestamp):
+    return (timestamp.time, timestamp.inc)
+
+def _probe_loop(connection_ref, interval):
+    # holds the connection only while probing so it can be garbage collected
+    while True:
+        time.sleep(interval)
+        connection = connection_ref()
+        if connection is None or connection._probe_stopped:
+            return
+        connection.probe()
+        del connection
+
+class _ReadPool(object):
+    """
+    bounded pool of daemon threads running the hedged reads. The threads are
+    started on demand, up to `size`, and run until `stop()` is called
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.tasks = Queue.Queue()
+        self.threads = 0
+        self.idle = 0
+        self.lock = threading.Lock()
+
+    def try_submit(self, func, *args):
+        """
+        run `func(*args)` in a thread of the pool. Return False (and don't
+        run it) if all the threads are busy
+        """
+        with self.lock:
+            if self.idle:
+                self.idle -= 1
+            elif self.threads < self.size:
+                self.threads += 1
+                thread = threading.Thread(target=self._work, name='mongolite-hedge')
+                thread.daemon = True
+                thread.start()
+            else:
+                return False
+        self.tasks.put((func, args))
+        return True
+
+    def stop(self):
+        """
+        stop the threads once they have run the pending tasks
+        """
+        with self.lock:
+            for i in range(self.threads):
+                self.tasks.put((None, ()))
+            self.threads = 0
+            self.idle = 0
+
+    def _work(self):
+        while True:
+            func, args = self.tasks.get()
+            if func is None:
+                return
+            try:
+                func(*args)
+            except Exception:
+                # the tasks report their errors themselves
+                pass
+            with self.lock:
+                self.idle += 1
 
 class MasterSlaveConnection(PymongoMasterSlaveConnection):
     """ Master-Slave support for MongoLite """
 
-    def __init__(self, master, slaves=[]):
+    def __init__(self, master, slaves=[], probe_interval=None, failure_threshold=3,
+      retry_delay=30, latency_alpha=0.3, hedge_percentile=None, hedge_delay=0.01,
+      hedge_window=1000, hedge_threads=4, read_your_writes=None,
+      read_your_writes_scope='session'):
         """ The MasterSlaveConnection is a wrapper around the
             pymongo.master_slave_connection implementation. The constructor accepts
             the connection parameter for the master MongoDB server and a non-empty
@@ -33,6 +204,35 @@ class MasterSlaveConnection(PymongoMasterSlaveConnection):
             server(s) will be used for read and write will be made to the
             master (and re-synced to the slave automatically as part of the
             master-slave setup).
+
+            Reads are routed to the slaves by latency: a slave is picked at
+            random with a weight inversely proportional to its average
+            response time, measured on each read and, if `probe_interval` is
+            set, by pinging every slave each `probe_interval` seconds from a
+            background thread (stopped by `disconnect()`).
+            A slave that fails `failure_threshold` times in a row (errors and
+            network timeouts) is left out for `retry_delay` seconds. When no
+            slave answers, the read falls back to the master. See
+            `get_node_stats()`.
+
+            Hedged reads are enabled by setting `hedge_percentile` (ie: 95):
+            when the first slave didn't answer a query after the
+            `hedge_percentile` of the last `hedge_window` read latencies, the
+            query is sent to a second slave and the first response wins. The
+            losing response is dropped and its cursor closed. `hedge_delay`
+            (in seconds) is used until enough latencies are known. The
+            hedged reads run in a pool of at most `hedge_threads` threads
+            (stopped by `disconnect()`), reads are sent without hedging while
+            all of them are busy. See `get_hedge_stats()`.
+
+            With `read_your_writes` (in seconds), the reads following a
+            write (or a write command like findAndModify) are sent to the
+            master during this window so they see the write.
+            `read_your_writes_scope` is 'session' (the reads of the
+            thread which wrote) or 'collection' (the reads of the written
+            collection from any thread). With safe writes, the reads may go
+            to the slaves which reported (while probed) they have replicated
+            the write.
         """
 
         self._databases = {}
@@ -41,7 +241,7 @@ class MasterSlaveConnection(PymongoMasterSlaveConnection):
         # I am the master
         if not isinstance(master, dict):
             raise TypeError('"master" must be a dict  containing pymongo.Connection parameters')
-        master_connection = PyMongoConnection(**master)
+        master_connection = PymongoConnection(**master)
 
         # You are my dirty slaves
         if not slaves:
@@ -52,10 +252,328 @@ class MasterSlaveConnection(PymongoMasterSlaveConnection):
             if not isinstance(slave, dict):
                 raise TypeError('"slaves" must be list of dicts containing pymongo.Connection parameters')
             slave['slave_okay'] = True
-            slave_connections.append(PyMongoConnection(**slave))
+            slave_connections.append(PymongoConnection(**slave))
 
         super(MasterSlaveConnection, self).__init__(master_connection, slave_connections)
 
+        self.failure_threshold = failure_threshold
+        self.retry_delay = retry_delay
+        self.latency_alpha = latency_alpha
+        self.master_stats = NodeStats(_node_name(master_connection))
+        self.slave_stats = [NodeStats(_node_name(slave)) for slave in slave_connections]
+        self._stats_lock = threading.Lock()
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self._read_latencies = collections.deque(maxlen=hedge_window)
+        self._hedge_delay_cache = (0, hedge_delay)
+        self.hedge_stats = {'reads': 0, 'hedged': 0, 'hedge_wins': 0, 'cancelled': 0}
+        self._hedge_pool = _ReadPool(hedge_threads)
+        if read_your_writes_scope not in ('session', 'collection'):
+            raise ValueError('"read_your_writes_scope" must be "session" or "collection"')
+        self.read_your_writes = read_your_writes
+        self.read_your_writes_scope = read_your_writes_scope
+        self._session = threading.local()
+        self._collection_writes = {}
+        self._in_request = False
+        self._probe_stopped = False
+        if probe_interval:
+            thread = threading.Thread(target=_probe_loop,
+              args=(weakref.ref(self), probe_interval), name='mongolite-probe')
+            thread.daemon = True
+            thread.start()
+
+    def stop_probing(self):
+        """
+        stop the thread probing the latency of the slaves
+        """
+        self._probe_stopped = True
+
+    def disconnect(self):
+        self.stop_probing()
+        self._hedge_pool.stop()
+        super(MasterSlaveConnection, self).disconnect()
+    disconnect.__doc__ = PymongoMasterSlaveConnection.disconnect.__doc__
+
+    def start_request(self):
+        super(MasterSlaveConnection, self).start_request()
+        self._in_request = True
+    start_request.__doc__ = PymongoMasterSlaveConnection.start_request.__doc__
+
+    def end_request(self):
+        self._in_request = False
+        super(MasterSlaveConnection, self).end_request()
+    end_request.__doc__ = PymongoMasterSlaveConnection.end_request.__doc__
+
+    def _record_success(self, stats, latency):
+        with self._stats_lock:
+            stats.record_success(latency, self.latency_alpha)
+
+    def _record_failure(self, stats):
+        with self._stats_lock:
+            stats.record_failure(time.time(), self.failure_threshold, self.retry_delay)
+
+    def _count_hedge(self, key):
+        with self._stats_lock:
+            self.hedge_stats[key] += 1
+
+    def _get_hedge_delay(self):
+        """
+        return the delay before hedging a read: the `hedge_percentile` of
+        the recent read latencies. It is recomputed every 50 reads
+        """
+        count, delay = self._hedge_delay_cache
+        latencies = self._read_latencies
+        # the deque doesn't count the appended items once full
+        total = self.hedge_stats['reads']
+        if len(latencies) >= 20 and total - count >= 50:
+            ordered = sorted(latencies)
+            position = int(len(ordered) * self.hedge_percentile / 100.0)
+            delay = ordered[min(position, len(ordered) - 1)]
+            self._hedge_delay_cache = (total, delay)
+        return delay
+
+    def get_hedge_stats(self):
+        """
+        return the hedged reads counters: `reads` (reads sent to slaves),
+        `hedged` (reads sent to a second slave), `hedge_wins` (the second
+        slave answered first) and `cancelled` (late responses dropped) and
+        the current hedge delay in milliseconds
+        """
+        with self._stats_lock:
+            stats = dict(self.hedge_stats)
+        stats['delay_ms'] = self._hedge_delay_cache[1] * 1000
+        return stats
+
+    def probe(self):
+        """
+        ping every slave and update its latency and health. A slave that
+        answers is available again even if its circuit breaker is open.
+        With `read_your_writes`, the replication state of the slaves is read
+        too
+        """
+        for slave, stats in zip(self.slaves, self.slave_stats):
+            start = time.time()
+            try:
+                slave.admin.command('ping')
+            except AutoReconnect:
+                self._record_failure(stats)
+                continue
+            self._record_success(stats, time.time() - start)
+            if self.read_your_writes:
+                try:
+                    source = slave.local.sources.find_one()
+                except (AutoReconnect, OperationFailure):
+                    continue
+                if source and source.get('syncedTo') is not None:
+                    stats.synced_to = _optime(source['syncedTo'])
+
+    def get_node_stats(self):
+        """
+        return the stats of the master (reads which fell back to it) and of
+        each slave as a list of dicts
+        """
+        now = time.time()
+        stats = [self.master_stats.as_dict(now)]
+        stats[0]['role'] = 'master'
+        for slave_stats in self.slave_stats:
+            stats.append(slave_stats.as_dict(now))
+            stats[-1]['role'] = 'slave'
+        return stats
+
+    def _ordered_slaves(self, synced_to=None):
+        """
+        return the indexes of the available slaves in the order they should
+        be tried: a weighted random order favoring the fastest slaves. If
+        `synced_to` is set, only the slaves which replicated this optime are
+        returned
+        """
+        now = time.time()
+        candidates = [(index, stats.latency) for index, stats in enumerate(self.slave_stats)
+          if stats.is_available(now) and (synced_to is None or
+            (stats.synced_to is not None and stats.synced_to >= synced_to))]
+        known = [latency for index, latency in candidates if latency is not None]
+        # slaves without measure yet are given the best known latency
+        default = min(known) if known else 1.0
+        weights = [(index, 1.0 / max(latency if latency is not None else default, 1e-4))
+          for index, latency in candidates]
+        ordered = []
+        while weights:
+            point = random.random() * sum(weight for index, weight in weights)
+            for position, (index, weight) in enumerate(weights):
+                point -= weight
+                if point < 0:
+                    break
+            ordered.append(index)
+            del weights[position]
+        return ordered
+
+    def _send_message_with_response(self, message, _connection_to_use=None,
+                                    _must_use_master=False, **kwargs):
+        if _connection_to_use is not None or _must_use_master or self._in_request:
+            result = super(MasterSlaveConnection, self)._send_message_with_response(
+              message, _connection_to_use, _must_use_master, **kwargs)
+            if self.read_your_writes:
+                # findAndModify and the other write commands are queries
+                namespace = _command_namespace(message)
+                if namespace is not None:
+                    self._record_write(namespace, None)
+            return result
+        last_op = None
+        if self.read_your_writes:
+            write = self._pending_write(message)
+            if write is not None:
+                last_op = write[1]
+                if last_op is None:
+                    return self._read_from_master(message, kwargs)
+        candidates = self._ordered_slaves(last_op)
+        if self.hedge_percentile is not None and len(candidates) > 1:
+            tried, result = self._hedged_read(candidates, message, kwargs)
+            if result is not None:
+                return result
+            candidates = candidates[tried:]
+        for index in candidates:
+            response = self._read_from_slave(index, message, kwargs)
+            if response is not None:
+                return index, response
+        # no slave available: fall back to the master
+        return self._read_from_master(message, kwargs)
+
+    def _read_from_master(self, message, kwargs):
+        start = time.time()
+        try:
+            response = self.master._send_message_with_response(message, **kwargs)
+        except AutoReconnect:
+            self._record_failure(self.master_stats)
+            raise
+        self._record_success(self.master_stats, time.time() - start)
+        return -1, response
+
+    def _send_message(self, message, with_last_error=False, _connection_to_use=None):
+        result = super(MasterSlaveConnection, self)._send_message(
+          message, with_last_error, _connection_to_use)
+        if self.read_your_writes and _message_opcode(message) in _WRITE_OPCODES:
+            last_op = None
+            if isinstance(result, dict) and result.get('lastOp') is not None:
+                last_op = _optime(result['lastOp'])
+            self._record_write(_message_namespace(message), last_op)
+        return result
+
+    def _record_write(self, namespace, last_op):
+        """
+        send the next reads of the session or of the collection `namespace`
+        to the master (or to the slaves synced to `last_op`)
+        """
+        write = (time.time() + self.read_your_writes, last_op)
+        if self.read_your_writes_scope == 'session':
+            self._session.write = write
+        else:
+            self._collection_writes[namespace] = write
+            # for the commands on the database
+            self._collection_writes[namespace.split('.', 1)[0]] = write
+
+    def _pending_write(self, message):
+        """
+        return the (deadline, last_op) of the write the read `message` must
+        see or None if it can be sent to any slave
+        """
+        if self.read_your_writes_scope == 'session':
+            write = getattr(self._session, 'write', None)
+        else:
+            namespace = _message_namespace(message)
+            if namespace.endswith('.$cmd'):
+                namespace = namespace[:-5]
+            write = self._collection_writes.get(namespace)
+        if write is None or write[0] <= time.time():
+            return None
+        return write
+
+    def _read_from_slave(self, index, message, kwargs):
+        """
+        send the query to the slave `index` and record its latency. Return
+        None if the slave failed
+        """
+        stats = self.slave_stats[index]
+        start = time.time()
+        try:
+            response = self.slaves[index]._send_message_with_response(message, **kwargs)
+        except AutoReconnect:
+            self._record_failure(stats)
+            return None
+        latency = time.time() - start
+        self._record_success(stats, latency)
+        self._read_latencies.append(latency)
+        self._count_hedge('reads')
+        return response
+
+    def _hedged_read(self, candidates, message, kwargs):
+        """
+        send the query to the first slave of `candidates` and, if it didn't
+        answer within the hedge delay, to the second one. Return the number
+        of slaves tried and the first (index, response) or None if they
+        failed.
+
+        pymongo sends a query and reads its response in one blocking call:
+        the reads run in the threads of the pool so that the first response
+        can be returned while the other slave is still answering. No slave
+        is tried if the pool is busy.
+        """
+        results = Queue.Queue()
+        winner = []
+        lock = threading.Lock()
+        def read(index):
+            response = None
+            try:
+                response = self._read_from_slave(index, message, kwargs)
+            finally:
+                # unexpected errors are reported as a failed slave
+                if response is None:
+                    results.put((index, None))
+            if response is not None:
+                with lock:
+                    won = not winner
+                    winner.append(index)
+                if not won:
+                    self._cancel_response(index, response)
+                    return
+                results.put((index, response))
+        pool = self._hedge_pool
+        if not pool.try_submit(read, candidates[0]):
+            return 0, None
+        try:
+            index, response = results.get(timeout=self._get_hedge_delay())
+        except Queue.Empty:
+            if not pool.try_submit(read, candidates[1]):
+                index, response = results.get()
+                if response is None:
+                    return 1, None
+                return 1, (index, response)
+            self._count_hedge('hedged')
+            index, response = results.get()
+            if response is None:
+                # one slave failed, wait for the other one
+                index, response = results.get()
+            if response is None:
+                return 2, None
+            if index == candidates[1]:
+                self._count_hedge('hedge_wins')
+            return 2, (index, response)
+        if response is None:
+            return 1, None
+        return 1, (index, response)
+
+    def _cancel_response(self, index, response):
+        """
+        drop the response of a losing hedged read and close its cursor
+        """
+        self._count_hedge('cancelled')
+        # the reply starts with the response flags then the cursor id
+        cursor_id = struct.unpack("<q", response[4:12])[0]
+        if cursor_id:
+            try:
+                self.slaves[index].close_cursor(cursor_id)
+            except AutoReconnect:
+                pass
+
     def register(self, obj_list):
         decorator = None
         if not isinstance(obj_list, _iterables):
@@ -65,13 +583,7 @@ class MasterSlaveConnection(PymongoMasterSlaveConnection):
             decorator = obj_list
             obj_list = [obj_list]
         # cleanup
-        for dbname, db in self._databases.items():
-            for colname, col in db._collections.items():
-                for docname, doc in col._documents.items():
-                    del col._documents[docname]
-                for obj_name in [obj.__name__ for obj in obj_list]:
-                    if obj_name in col._registered_documents:
-                        del col._registered_documents[obj_name]
+        _clear_registered_documents(self, obj_list)
         # register
         for obj in obj_list:
             CallableDocument = type(
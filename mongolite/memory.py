@@ -0,0 +1,1532 @@
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+In-process storage engine. A MemoryConnection is used like a Connection but
+answers the messages of pymongo from memory instead of a mongod, so the
+registered documents, their queries, cursors, saves and find_and_modify work
+unchanged in unit tests and offline tools:
+
+>>> from mongolite.memory import MemoryConnection
+>>> con = MemoryConnection()
+>>> con.register([BlogPost])
+>>> con.BlogPost.find({'tags': u'mongo'}).sort('date', -1)
+
+The connections share the process wide `default_storage` (like clients of
+the same server) unless a MemoryStorage is given.
+
+Supported subset:
+
+ * queries: equality on (dotted) fields and arrays, `$gt`, `$gte`, `$lt`,
+   `$lte`, `$ne`, `$in`, `$nin`, `$exists`, `$all`, `$size`, `$elemMatch`,
+   `$not`, `$mod`, `$regex`, `$type`, `$and`, `$or`, `$nor` (`$where` is
+   rejected, there is no javascript engine)
+ * updates: replacements, `$set`, `$unset`, `$inc`, `$push`, `$pushAll`,
+   `$addToSet` (with `$each`), `$pop`, `$pull`, `$pullAll`, `$rename`,
+   `$setOnInsert` and the positional `$`, upserts and multi updates
+ * sort, skip, limit, batches and getmores, projections (with `$slice`)
+   and explain
+ * the commands count, distinct, findAndModify, drop, dropDatabase, create,
+   deleteIndexes, renameCollection, filemd5 (GridFS), collStats,
+   listDatabases and getLastError
+
+The indexes (`ensure_index()`, `Document.generate_indexes()`) are real: each
+one keeps a hash table of its keys, used by equality queries on all its
+fields and to enforce `unique`, and a sorted list of the values of its first
+field, used by equalities, `$in` and ranges on that field.
+"""
+
+import bisect
+import copy
+import hashlib
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import bson
+from bson.binary import Binary
+from bson.code import Code
+from bson.dbref import DBRef
+from bson.max_key import MaxKey
+from bson.min_key import MinKey
+from bson.objectid import ObjectId
+from bson.son import SON
+from bson.timestamp import Timestamp
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from uuid import UUID
+import datetime
+
+from mongolite.connection import Connection
+
+OP_REPLY = 1
+OP_UPDATE = 2001
+OP_INSERT = 2002
+OP_QUERY = 2004
+OP_GET_MORE = 2005
+OP_DELETE = 2006
+OP_KILL_CURSORS = 2007
+
+_FLAG_CURSOR_NOT_FOUND = 1
+_FLAG_QUERY_FAILURE = 2
+
+# number of documents of a first batch when the client doesn't tell
+_DEFAULT_BATCH_SIZE = 101
+
+_INFINITY = float('inf')
+_NUMBER_TYPES = frozenset([int, long, float])
+
+class _QueryError(Exception):
+    """
+    error of a query or of a write, reported to the client with `code`
+    """
+
+    def __init__(self, message, code=None):
+        Exception.__init__(self, message)
+        self.code = code
+
+#
+# values
+#
+
+def _type_rank(value):
+    """
+    return the rank of the type of `value` in the bson sort order
+    """
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, long, float)):
+        return 2
+    if isinstance(value, (Binary, UUID)):
+        return 6
+    if isinstance(value, basestring):
+        return 3
+    if isinstance(value, (dict, DBRef)):
+        return 4
+    if isinstance(value, (list, tuple)):
+        return 5
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime.datetime):
+        return 9
+    if isinstance(value, Timestamp):
+        return 10
+    if isinstance(value, bson.RE_TYPE):
+        return 11
+    if isinstance(value, MinKey):
+        return 0
+    if isinstance(value, MaxKey):
+        return 12
+    return 13
+
+def _key(value, sort_dicts=False):
+    """
+    return a comparable (and hashable) key of `value` following the bson
+    order: the values of different types are ordered by type. The fields
+    of the subdocuments are ordered when `sort_dicts` is True (for the hash
+    keys which must not depend on the order of the fields)
+    """
+    rank = _type_rank(value)
+    if rank == 2 or rank == 3 or rank == 8 or rank == 9:
+        return (rank, value)
+    if rank == 4:
+        if isinstance(value, DBRef):
+            value = value.as_doc()
+        items = [(name, _key(item, sort_dicts)) for name, item in value.iteritems()]
+        if sort_dicts:
+            items.sort()
+        return (rank, tuple(items))
+    if rank == 5:
+        return (rank, tuple(_key(item, sort_dicts) for item in value))
+    if rank == 6:
+        if isinstance(value, UUID):
+            return (rank, 16, 3, value.bytes)
+        return (rank, len(value), value.subtype, str(value))
+    if rank == 7:
+        return (rank, value.binary)
+    if rank == 10:
+        return (rank, value.time, value.inc)
+    if rank == 11:
+        return (rank, value.pattern, value.flags)
+    if rank == 13:
+        return (rank, repr(value))
+    return (rank,)
+
+def _hash_key(value):
+    return _key(value, True)
+
+def _equal(first, second):
+    """
+    mongodb equality: the numbers are compared by value, the types are not
+    mixed (True != 1) and the order of the fields doesn't matter
+    """
+    rank = _type_rank(first)
+    if rank != _type_rank(second):
+        return False
+    if rank == 4:
+        if isinstance(first, DBRef):
+            first = first.as_doc()
+        if isinstance(second, DBRef):
+            second = second.as_doc()
+        if len(first) != len(second):
+            return False
+        for name, item in first.iteritems():
+            if name not in second or not _equal(item, second[name]):
+                return False
+        return True
+    if rank == 5:
+        if len(first) != len(second):
+            return False
+        for item, other in zip(first, second):
+            if not _equal(item, other):
+                return False
+        return True
+    return first == second
+
+def _is_regex(value):
+    return isinstance(value, bson.RE_TYPE)
+
+def _is_operator_dict(value):
+    if not isinstance(value, dict) or not value:
+        return False
+    for key in value:
+        if not isinstance(key, basestring) or key[:1] != '$':
+            return False
+    return True
+
+def _resolve(value, parts):
+    """
+    return the values found at the path `parts` in `value`. The arrays met
+    on the way are traversed: 'comments.author' returns the author of each
+    comment. An empty list means that the field is missing
+    """
+    if not parts:
+        return [value]
+    part = parts[0]
+    if isinstance(value, dict):
+        if part in value:
+            return _resolve(value[part], parts[1:])
+        return []
+    if isinstance(value, list):
+        result = []
+        if part.isdigit():
+            index = int(part)
+            if index < len(value):
+                result.extend(_resolve(value[index], parts[1:]))
+        for item in value:
+            if isinstance(item, dict):
+                result.extend(_resolve(item, parts))
+        return result
+    return []
+
+def _expand(values):
+    """
+    yield the values and the items of the array values
+    """
+    for value in values:
+        yield value
+        if isinstance(value, list):
+            for item in value:
+                yield item
+
+#
+# queries
+#
+
+_BSON_TYPES = [
+    (1, lambda value: isinstance(value, float)),
+    (2, lambda value: isinstance(value, basestring) and not isinstance(value, (Binary, Code))),
+    (3, lambda value: isinstance(value, dict)),
+    (4, lambda value: isinstance(value, list)),
+    (5, lambda value: isinstance(value, (Binary, UUID))),
+    (7, lambda value: isinstance(value, ObjectId)),
+    (8, lambda value: isinstance(value, bool)),
+    (9, lambda value: isinstance(value, datetime.datetime)),
+    (10, lambda value: value is None),
+    (11, _is_regex),
+    (13, lambda value: isinstance(value, Code)),
+    (16, lambda value: isinstance(value, int) and not isinstance(value, bool)),
+    (17, lambda value: isinstance(value, Timestamp)),
+    (18, lambda value: isinstance(value, long)),
+]
+
+def _match_equal(values, target):
+    if not values:
+        return target is None
+    for value in _expand(values):
+        if _equal(value, target):
+            return True
+    return False
+
+def _match_regex(values, regex):
+    for value in _expand(values):
+        if isinstance(value, basestring) and regex.search(value):
+            return True
+    return False
+
+def _compare(values, operand, test):
+    rank = _type_rank(operand)
+    operand_key = _key(operand)
+    for value in _expand(values):
+        if _type_rank(value) == rank and test(_key(value), operand_key):
+            return True
+    return False
+
+def _match_in(values, operand):
+    for item in operand:
+        if _is_regex(item):
+            if _match_regex(values, item):
+                return True
+        elif _match_equal(values, item):
+            return True
+    return False
+
+def _match_elem(values, operand):
+    for value in values:
+        if not isinstance(value, list):
+            continue
+        for item in value:
+            if _is_operator_dict(operand):
+                if _match_condition([item], operand):
+                    return True
+            elif isinstance(item, dict) and _match(item, operand):
+                return True
+    return False
+
+def _match_type(values, operand):
+    for code, test in _BSON_TYPES:
+        if code == operand:
+            for value in _expand(values):
+                if test(value):
+                    return True
+    return False
+
+def _match_mod(values, operand):
+    divisor, remainder = operand
+    for value in _expand(values):
+        if _type_rank(value) == 2 and int(value) % divisor == remainder:
+            return True
+    return False
+
+def _match_regex_operator(values, operand, condition):
+    if not _is_regex(operand):
+        flags = 0
+        for option in condition.get('$options', ''):
+            flags |= {'i': re.I, 'm': re.M, 'x': re.X, 's': re.S}.get(option, 0)
+        operand = re.compile(operand, flags)
+    return _match_regex(values, operand)
+
+_OPERATORS = {
+    '$eq': lambda values, operand, condition: _match_equal(values, operand),
+    '$ne': lambda values, operand, condition: not _match_equal(values, operand),
+    '$gt': lambda values, operand, condition: _compare(values, operand, lambda a, b: a > b),
+    '$gte': lambda values, operand, condition: _compare(values, operand, lambda a, b: a >= b),
+    '$lt': lambda values, operand, condition: _compare(values, operand, lambda a, b: a < b),
+    '$lte': lambda values, operand, condition: _compare(values, operand, lambda a, b: a <= b),
+    '$in': lambda values, operand, condition: _match_in(values, operand),
+    '$nin': lambda values, operand, condition: not _match_in(values, operand),
+    '$exists': lambda values, operand, condition: bool(values) == bool(operand),
+    '$all': lambda values, operand, condition: bool(operand) and all(
+      _match_regex(values, item) if _is_regex(item) else _match_equal(values, item)
+      for item in operand),
+    '$size': lambda values, operand, condition: any(
+      isinstance(value, list) and len(value) == operand for value in values),
+    '$elemMatch': lambda values, operand, condition: _match_elem(values, operand),
+    '$not': lambda values, operand, condition: not _match_condition(values, operand),
+    '$mod': lambda values, operand, condition: _match_mod(values, operand),
+    '$regex': _match_regex_operator,
+    '$options': lambda values, operand, condition: True,
+    '$type': lambda values, operand, condition: _match_type(values, operand),
+}
+
+def _match_condition(values, condition):
+    """
+    return True if the values of a field match `condition`
+    """
+    if _is_regex(condition):
+        return _match_regex(values, condition)
+    if _is_operator_dict(condition):
+        for operator, operand in condition.iteritems():
+            if operator not in _OPERATORS:
+                raise _QueryError("invalid operator: %s" % operator)
+            if not _OPERATORS[operator](values, operand, condition):
+                return False
+        return True
+    return _match_equal(values, condition)
+
+def _match(doc, spec):
+    """
+    return True if `doc` matches the query `spec`
+    """
+    for key, condition in spec.iteritems():
+        if key == '$and':
+            if not all(_match(doc, item) for item in condition):
+                return False
+        elif key == '$or':
+            if not any(_match(doc, item) for item in condition):
+                return False
+        elif key == '$nor':
+            if any(_match(doc, item) for item in condition):
+                return False
+        elif key == '$where':
+            raise _QueryError("$where needs a javascript engine")
+        elif key in ('$comment', '$isolated', '$atomic'):
+            continue
+        elif key[:1] == '$':
+            raise _QueryError("unsupported operator: %s" % key)
+        elif not _match_condition(_resolve(doc, key.split('.')), condition):
+            return False
+    return True
+
+def _sort_documents(docs, orderby):
+    """
+    sort `docs` in place by the (field, direction) pairs of `orderby`. An
+    array is sorted by its smallest item (largest when descending)
+    """
+    for field, direction in reversed(list(orderby.items())):
+        descending = direction < 0
+        if field == '$natural':
+            if descending:
+                docs.reverse()
+            continue
+        parts = field.split('.')
+        if len(parts) == 1:
+            values = [doc.get(field) for doc in docs]
+            if all(type(value) in _NUMBER_TYPES and value == value for value in values):
+                # numbers compare like their sort keys
+                order = sorted(xrange(len(docs)), key=values.__getitem__, reverse=descending)
+                docs[:] = [docs[position] for position in order]
+                continue
+        def sort_key(doc, parts=parts, descending=descending):
+            if len(parts) == 1:
+                value = doc.get(parts[0])
+                if not isinstance(value, list):
+                    return _key(value)
+            values = _resolve(doc, parts)
+            if not values:
+                return (1,)
+            keys = [_key(value) for value in _expand(values)
+              if not isinstance(value, list) or not value]
+            if not keys:
+                keys = [_key(values[0])]
+            return max(keys) if descending else min(keys)
+        docs.sort(key=sort_key, reverse=descending)
+
+#
+# projections
+#
+
+def _include(source, target, parts):
+    part = parts[0]
+    if isinstance(source, list):
+        if not isinstance(target, list):
+            return
+        for item, target_item in zip(source, target):
+            if isinstance(item, dict):
+                _include(item, target_item, parts)
+        return
+    if not isinstance(source, dict) or part not in source:
+        return
+    if len(parts) == 1:
+        target[part] = source[part]
+        return
+    value = source[part]
+    if isinstance(value, dict):
+        target.setdefault(part, {})
+    elif isinstance(value, list):
+        if part not in target:
+            target[part] = [{} for item in value if isinstance(item, dict)]
+            value = [item for item in value if isinstance(item, dict)]
+    else:
+        return
+    _include(value, target[part], parts[1:])
+
+def _exclude(doc, parts):
+    """
+    return a copy of `doc` without the field at `parts` (only the
+    containers on the path are copied)
+    """
+    if isinstance(doc, list):
+        return [_exclude(item, parts) if isinstance(item, dict) else item for item in doc]
+    if not isinstance(doc, dict) or parts[0] not in doc:
+        return doc
+    doc = dict(doc)
+    if len(parts) == 1:
+        del doc[parts[0]]
+    else:
+        doc[parts[0]] = _exclude(doc[parts[0]], parts[1:])
+    return doc
+
+def _slice(doc, parts, operand):
+    if not isinstance(doc, dict) or parts[0] not in doc:
+        return doc
+    doc = dict(doc)
+    if len(parts) > 1:
+        doc[parts[0]] = _slice(doc[parts[0]], parts[1:], operand)
+        return doc
+    value = doc[parts[0]]
+    if isinstance(value, list):
+        if isinstance(operand, list):
+            skip, limit = operand
+            if skip < 0:
+                skip = max(len(value) + skip, 0)
+            value = value[skip:skip + limit]
+        elif operand < 0:
+            value = value[operand:]
+        else:
+            value = value[:operand]
+        doc[parts[0]] = value
+    return doc
+
+def _project(doc, fields):
+    """
+    return `doc` reduced to the projection `fields`
+    """
+    if not fields:
+        return doc
+    slices = []
+    included = []
+    excluded = []
+    for field, value in fields.iteritems():
+        if isinstance(value, dict):
+            if '$slice' not in value:
+                raise _QueryError("unsupported projection: %s" % field)
+            slices.append((field, value['$slice']))
+        elif value:
+            included.append(field)
+        else:
+            excluded.append(field)
+    if included:
+        if [field for field in excluded if field != '_id']:
+            raise _QueryError("You cannot currently mix including and excluding fields")
+        result = {}
+        if '_id' in doc and '_id' not in excluded:
+            result['_id'] = doc['_id']
+        for field in included:
+            _include(doc, result, field.split('.'))
+        for field, operand in slices:
+            _include(doc, result, field.split('.'))
+    else:
+        result = doc
+        for field in excluded:
+            result = _exclude(result, field.split('.'))
+    for field, operand in slices:
+        result = _slice(result, field.split('.'), operand)
+    return result
+
+#
+# updates
+#
+
+def _container(doc, path, create):
+    """
+    return the container of the last part of `path` and that part (an int
+    for the arrays). Return (None, None) if it doesn't exist and `create`
+    is False
+    """
+    parts = path.split('.')
+    current = doc
+    for part in parts[:-1]:
+        if isinstance(current, list):
+            if not part.isdigit():
+                raise _QueryError("can't append to array using string field name [%s]" % part)
+            index = int(part)
+            if index >= len(current):
+                if not create:
+                    return None, None
+                current.extend([None] * (index + 1 - len(current)))
+            if current[index] is None:
+                if not create:
+                    return None, None
+                current[index] = {}
+            current = current[index]
+        elif isinstance(current, dict):
+            if part not in current or current[part] is None:
+                if not create:
+                    return None, None
+                current[part] = {}
+            current = current[part]
+        else:
+            raise _QueryError("cannot set field %r of %r" % (path, current))
+    last = parts[-1]
+    if isinstance(current, list):
+        if not last.isdigit():
+            raise _QueryError("can't append to array using string field name [%s]" % last)
+        last = int(last)
+        if last >= len(current):
+            if not create:
+                return None, None
+            current.extend([None] * (last + 1 - len(current)))
+    elif not isinstance(current, dict):
+        raise _QueryError("cannot set field %r of %r" % (path, current))
+    return current, last
+
+def _get(doc, path):
+    container, last = _container(doc, path, False)
+    if container is None:
+        return False, None
+    if isinstance(container, list):
+        return True, container[last]
+    if last in container:
+        return True, container[last]
+    return False, None
+
+def _set(doc, path, value):
+    container, last = _container(doc, path, True)
+    container[last] = value
+
+def _unset(doc, path):
+    container, last = _container(doc, path, False)
+    if container is None:
+        return
+    if isinstance(container, list):
+        container[last] = None
+    else:
+        container.pop(last, None)
+
+def _get_array(doc, path, operator):
+    exists, value = _get(doc, path)
+    if not exists:
+        return None
+    if not isinstance(value, list):
+        raise _QueryError("Cannot apply %s modifier to non-array" % operator)
+    return value
+
+def _each(value):
+    if isinstance(value, dict) and '$each' in value:
+        return list(value['$each'])
+    return [value]
+
+def _matches_item(item, condition):
+    if isinstance(condition, dict) and not _is_operator_dict(condition):
+        return isinstance(item, dict) and _match(item, condition)
+    return _match_condition([item], condition)
+
+def _update_inc(doc, path, value, inserting):
+    exists, current = _get(doc, path)
+    if _type_rank(value) != 2 or isinstance(value, bool):
+        raise _QueryError("Modifier $inc allowed for numbers only")
+    if not exists:
+        _set(doc, path, value)
+    elif _type_rank(current) != 2 or isinstance(current, bool):
+        raise _QueryError("Cannot apply $inc modifier to non-number")
+    else:
+        _set(doc, path, current + value)
+
+def _update_push(doc, path, value, inserting, many=False):
+    array = _get_array(doc, path, '$push')
+    items = value if many else _each(value)
+    if array is None:
+        _set(doc, path, list(items))
+    else:
+        array.extend(items)
+
+def _update_add_to_set(doc, path, value, inserting):
+    array = _get_array(doc, path, '$addToSet')
+    if array is None:
+        array = []
+        _set(doc, path, array)
+    for item in _each(value):
+        if not any(_equal(item, existing) for existing in array):
+            array.append(item)
+
+def _update_pop(doc, path, value, inserting):
+    array = _get_array(doc, path, '$pop')
+    if array:
+        if value < 0:
+            del array[0]
+        else:
+            del array[-1]
+
+def _update_pull(doc, path, value, inserting):
+    array = _get_array(doc, path, '$pull')
+    if array:
+        array[:] = [item for item in array if not _matches_item(item, value)]
+
+def _update_pull_all(doc, path, value, inserting):
+    array = _get_array(doc, path, '$pullAll')
+    if array:
+        array[:] = [item for item in array
+          if not any(_equal(item, other) for other in value)]
+
+def _update_rename(doc, path, value, inserting):
+    exists, current = _get(doc, path)
+    if exists:
+        _unset(doc, path)
+        _set(doc, value, current)
+
+def _update_set_on_insert(doc, path, value, inserting):
+    if inserting:
+        _set(doc, path, value)
+
+_MODIFIERS = {
+    '$set': lambda doc, path, value, inserting: _set(doc, path, value),
+    '$unset': lambda doc, path, value, inserting: _unset(doc, path),
+    '$inc': _update_inc,
+    '$push': _update_push,
+    '$pushAll': lambda doc, path, value, inserting: _update_push(
+      doc, path, value, inserting, many=True),
+    '$addToSet': _update_add_to_set,
+    '$pop': _update_pop,
+    '$pull': _update_pull,
+    '$pullAll': _update_pull_all,
+    '$rename': _update_rename,
+    '$setOnInsert': _update_set_on_insert,
+}
+
+def _positional_index(doc, spec, prefix):
+    """
+    return the index of the first item of the array at `prefix` matched by
+    the query `spec` (for the positional `$` operator)
+    """
+    exists, array = _get(doc, prefix)
+    conditions = [(key[len(prefix) + 1:], condition) for key, condition in spec.iteritems()
+      if key == prefix or key.startswith(prefix + '.')]
+    if not exists or not isinstance(array, list) or not conditions:
+        raise _QueryError("The positional operator did not find the match needed from the query.")
+    for index, item in enumerate(array):
+        for subkey, condition in conditions:
+            if subkey:
+                values = _resolve(item, subkey.split('.'))
+            else:
+                values = [item]
+            if not _match_condition(values, condition):
+                break
+        else:
+            return index
+    raise _QueryError("The positional operator did not find the match needed from the query.")
+
+def _apply_update(doc, update, spec, inserting=False):
+    """
+    return the new version of `doc` after `update`. `doc` is not modified
+    """
+    if not _is_operator_dict(update):
+        if [key for key in update if key[:1] == '$']:
+            raise _QueryError("can't mix modifiers and fields in an update")
+        new_doc = dict(update)
+        if '_id' in doc:
+            if '_id' in new_doc and not _equal(new_doc['_id'], doc['_id']):
+                raise _QueryError("cannot change _id of a document old:%s new:%s" % (
+                  doc['_id'], new_doc['_id']))
+            new_doc['_id'] = doc['_id']
+        return new_doc
+    new_doc = copy.deepcopy(doc)
+    for operator, fields in update.iteritems():
+        if operator not in _MODIFIERS:
+            raise _QueryError("Invalid modifier specified: %s" % operator)
+        for path, value in fields.iteritems():
+            if path == '_id' or path.startswith('_id.'):
+                if operator != '$setOnInsert' and not (inserting and operator == '$set'):
+                    raise _QueryError("Mod on _id not allowed")
+            if '.$' in path or path.endswith('$'):
+                prefix, sep, rest = path.partition('.$')
+                path = prefix + '.%s' % _positional_index(doc, spec, prefix) + rest
+            _MODIFIERS[operator](new_doc, path, value, inserting)
+    return new_doc
+
+def _upsert_document(spec):
+    """
+    return the document created by an upsert from the equalities of `spec`
+    """
+    doc = {}
+    for key, condition in spec.iteritems():
+        if key[:1] == '$' or _is_operator_dict(condition) or _is_regex(condition):
+            continue
+        _set(doc, key, copy.deepcopy(condition))
+    return doc
+
+#
+# storage
+#
+
+class _Index(object):
+    """
+    an index of a collection: a hash table of the keys (tuples of the values
+    of the fields) to the ids of the documents and a sorted list of
+    (value of the first field, sequence number, id) tuples. The arrays are
+    indexed by item
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.name = spec['name']
+        self.fields = [field for field, direction in spec['key'].items()]
+        self.parts = [field.split('.') for field in self.fields]
+        # geo and text indexes are stored but not used by the queries
+        self.usable = all(isinstance(direction, (int, long, float))
+          for direction in spec['key'].values())
+        self.unique = bool(spec.get('unique'))
+        self.sparse = bool(spec.get('sparse'))
+        self.hash = {}
+        self.sorted = []
+
+    def _field_values(self, doc, parts):
+        values = _resolve(doc, parts)
+        if not values:
+            return [None]
+        result = []
+        for value in values:
+            if isinstance(value, list) and value:
+                result.extend(value)
+            else:
+                result.append(value)
+        return result
+
+    def keys(self, doc):
+        """
+        return the hash keys of `doc`
+        """
+        if self.sparse and not any(_resolve(doc, parts) for parts in self.parts):
+            return []
+        keys = [()]
+        for parts in self.parts:
+            values = [_hash_key(value) for value in self._field_values(doc, parts)]
+            keys = [key + (value,) for key in keys for value in values]
+        return set(keys)
+
+    def first_keys(self, doc):
+        if self.sparse and not _resolve(doc, self.parts[0]):
+            return []
+        return set(_key(value) for value in self._field_values(doc, self.parts[0]))
+
+    def check(self, doc, id_key, ns):
+        if not self.unique:
+            return
+        for key in self.keys(doc):
+            ids = self.hash.get(key)
+            if ids and (len(ids) > 1 or id_key not in ids):
+                raise _QueryError("E11000 duplicate key error index: %s.$%s  dup key: { : %r }" % (
+                  ns, self.name, _resolve(doc, self.parts[0])), 11000)
+
+    def add(self, doc, id_key, seq):
+        for key in self.keys(doc):
+            self.hash.setdefault(key, set()).add(id_key)
+        for key in self.first_keys(doc):
+            bisect.insort(self.sorted, (key, seq, id_key))
+
+    def remove(self, doc, id_key, seq):
+        for key in self.keys(doc):
+            ids = self.hash.get(key)
+            if ids is not None:
+                ids.discard(id_key)
+                if not ids:
+                    del self.hash[key]
+        for key in self.first_keys(doc):
+            position = bisect.bisect_left(self.sorted, (key, seq))
+            if position < len(self.sorted) and self.sorted[position][:2] == (key, seq):
+                del self.sorted[position]
+
+    def range(self, lower, lower_inclusive, upper, upper_inclusive):
+        """
+        return the ids whose first field is between the keys `lower` and
+        `upper` in the order of the index
+        """
+        if lower_inclusive:
+            start = bisect.bisect_left(self.sorted, (lower,))
+        else:
+            start = bisect.bisect_right(self.sorted, (lower, _INFINITY))
+        if upper_inclusive:
+            end = bisect.bisect_right(self.sorted, (upper, _INFINITY))
+        else:
+            end = bisect.bisect_left(self.sorted, (upper,))
+        return [entry[2] for entry in self.sorted[start:end]]
+
+def _is_indexable_equality(condition):
+    return not (_is_operator_dict(condition) or _is_regex(condition) or
+      isinstance(condition, (list, dict)))
+
+class _StoredDocument(dict):
+    """
+    a document of a collection. The stored documents are never modified
+    (the updates replace them) so their BSON is encoded once
+    """
+    __slots__ = ('encoded',)
+
+    def bson(self):
+        try:
+            return self.encoded
+        except AttributeError:
+            self.encoded = bson.BSON.encode(self)
+            return self.encoded
+
+    def __deepcopy__(self, memo):
+        # the copy is modified, it doesn't keep the encoded BSON
+        return copy.deepcopy(dict(self), memo)
+
+class _Collection(object):
+    """
+    the documents of a collection by `_id` (in insertion order) and its
+    indexes
+    """
+
+    def __init__(self, ns, options=None):
+        self.ns = ns
+        self.options = options or {}
+        self.documents = OrderedDict()
+        self.seqs = {}
+        self.indexes = OrderedDict()
+        self._seq = 0
+
+    def index_specs(self):
+        specs = [SON([('v', 1), ('key', SON([('_id', 1)])), ('ns', self.ns), ('name', '_id_')])]
+        specs.extend(index.spec for index in self.indexes.itervalues())
+        return specs
+
+    def create_index(self, spec):
+        if spec['name'] == '_id_' or spec['name'] in self.indexes:
+            return
+        index = _Index(spec)
+        drop = []
+        for id_key, doc in self.documents.iteritems():
+            try:
+                index.check(doc, id_key, self.ns)
+            except _QueryError:
+                if not spec.get('dropDups'):
+                    raise
+                drop.append(id_key)
+                continue
+            index.add(doc, id_key, self.seqs[id_key])
+        for id_key in drop:
+            self.remove(id_key)
+        self.indexes[spec['name']] = index
+
+    def insert(self, doc):
+        if '_id' not in doc:
+            doc['_id'] = ObjectId()
+        doc = _StoredDocument(doc)
+        id_key = _hash_key(doc['_id'])
+        if id_key in self.documents:
+            raise _QueryError("E11000 duplicate key error index: %s.$_id_  dup key: { : %r }" % (
+              self.ns, doc['_id']), 11000)
+        for index in self.indexes.itervalues():
+            index.check(doc, id_key, self.ns)
+        self._seq += 1
+        self.documents[id_key] = doc
+        self.seqs[id_key] = self._seq
+        for index in self.indexes.itervalues():
+            index.add(doc, id_key, self._seq)
+
+    def replace(self, id_key, new_doc):
+        new_doc = _StoredDocument(new_doc)
+        old_doc = self.documents[id_key]
+        seq = self.seqs[id_key]
+        for index in self.indexes.itervalues():
+            index.remove(old_doc, id_key, seq)
+        try:
+            for index in self.indexes.itervalues():
+                index.check(new_doc, id_key, self.ns)
+        except _QueryError:
+            for index in self.indexes.itervalues():
+                index.add(old_doc, id_key, seq)
+            raise
+        self.documents[id_key] = new_doc
+        for index in self.indexes.itervalues():
+            index.add(new_doc, id_key, seq)
+
+    def remove(self, id_key):
+        doc = self.documents.pop(id_key)
+        seq = self.seqs.pop(id_key)
+        for index in self.indexes.itervalues():
+            index.remove(doc, id_key, seq)
+
+    def _candidate_ids(self, spec):
+        """
+        return the ids of the documents which can match `spec` in the order
+        of the index used and the name of the index, or None for a
+        collection scan
+        """
+        if '_id' in spec:
+            condition = spec['_id']
+            if _is_indexable_equality(condition) or isinstance(condition, dict) and\
+              not _is_operator_dict(condition):
+                return [_hash_key(condition)], '_id_'
+            if _is_operator_dict(condition) and condition.keys() == ['$in']:
+                return sorted(set(_hash_key(value) for value in condition['$in'])), '_id_'
+        usable = [index for index in self.indexes.itervalues() if index.usable]
+        # the hash of the index with the most fields is the most selective
+        for index in sorted(usable, key=lambda index: -len(index.fields)):
+            if all(field in spec and _is_indexable_equality(spec[field])
+              for field in index.fields):
+                if index.sparse and any(spec[field] is None for field in index.fields):
+                    continue
+                key = tuple(_hash_key(spec[field]) for field in index.fields)
+                return sorted(index.hash.get(key, ()), key=self.seqs.get), index.name
+        for index in usable:
+            condition = spec.get(index.fields[0], _INFINITY)
+            if condition is _INFINITY or (index.sparse and condition is None):
+                continue
+            if _is_indexable_equality(condition):
+                key = _key(condition)
+                return index.range(key, True, key, True), index.name
+            if not _is_operator_dict(condition):
+                continue
+            if condition.keys() == ['$in'] and all(_is_indexable_equality(value)
+              for value in condition['$in']):
+                ids = []
+                for key in sorted(set(_key(value) for value in condition['$in'])):
+                    ids.extend(index.range(key, True, key, True))
+                return ids, index.name
+            bounds = [(operator, operand) for operator, operand in condition.iteritems()
+              if operator in ('$gt', '$gte', '$lt', '$lte')]
+            if not bounds or len(bounds) != len(condition):
+                continue
+            rank = _type_rank(bounds[0][1])
+            if rank == 5 or any(_type_rank(operand) != rank for operator, operand in bounds):
+                continue
+            lower, lower_inclusive = (rank,), True
+            upper, upper_inclusive = (rank + 1,), False
+            for operator, operand in bounds:
+                if operator in ('$gt', '$gte'):
+                    key = _key(operand)
+                    if key >= lower:
+                        lower, lower_inclusive = key, operator == '$gte'
+                else:
+                    key = _key(operand)
+                    if key <= upper:
+                        upper, upper_inclusive = key, operator == '$lte'
+            return index.range(lower, lower_inclusive, upper, upper_inclusive), index.name
+        return None
+
+    def find(self, spec):
+        """
+        return the documents matching `spec` (in the order of the index used
+        or in natural order), the name of the index used (None for a
+        collection scan) and the number of documents scanned
+        """
+        candidates = self._candidate_ids(spec)
+        if candidates is None:
+            docs = self.documents.values()
+            index_name = None
+        else:
+            ids, index_name = candidates
+            seen = set()
+            docs = []
+            for id_key in ids:
+                # the arrays are indexed by item
+                if id_key not in seen and id_key in self.documents:
+                    seen.add(id_key)
+                    docs.append(self.documents[id_key])
+        if not spec:
+            return list(docs), index_name, len(docs)
+        return [doc for doc in docs if _match(doc, spec)], index_name, len(docs)
+
+class _Cursor(object):
+
+    def __init__(self, ns, docs, fields):
+        self.ns = ns
+        self.docs = docs
+        self.fields = fields
+        self.position = 0
+
+class MemoryStorage(object):
+    """
+    the databases of a MemoryConnection. It answers the messages of the
+    wire protocol sent by pymongo
+    """
+
+    def __init__(self):
+        self.databases = {}
+        self._cursors = {}
+        self._cursor_ids = 0
+        self._lock = threading.RLock()
+        self._last_error = threading.local()
+
+    def reset(self):
+        """
+        drop all the databases
+        """
+        with self._lock:
+            self.databases.clear()
+            self._cursors.clear()
+
+    def get_collection(self, ns, create=False):
+        """
+        return the _Collection of the full name `ns` (None if it doesn't
+        exist and `create` is False)
+        """
+        dbname, sep, name = ns.partition('.')
+        database = self.databases.get(dbname)
+        if database is None:
+            if not create:
+                return None
+            database = self.databases[dbname] = OrderedDict()
+        collection = database.get(name)
+        if collection is None and create:
+            if not name or '$' in name or name.startswith('system.'):
+                raise _QueryError("invalid ns: %s" % ns)
+            collection = database[name] = _Collection(ns)
+        return collection
+
+    #
+    # messages
+    #
+
+    def handle(self, data):
+        """
+        handle the messages of `data` (it can hold a write followed by a
+        getLastError) and return the reply of the last query or getmore,
+        or the lastError document of the last write
+        """
+        with self._lock:
+            reply = None
+            error = None
+            offset = 0
+            while offset < len(data):
+                length, request_id, response_to, opcode = struct.unpack(
+                  "<iiii", data[offset:offset + 16])
+                body = data[offset + 16:offset + length]
+                offset += length
+                if opcode in (OP_INSERT, OP_UPDATE, OP_DELETE):
+                    error = self._write(opcode, body)
+                    self._last_error.value = error
+                elif opcode == OP_QUERY:
+                    # a query after a write is its getLastError
+                    if error is None:
+                        reply = self._query(body)
+                elif opcode == OP_GET_MORE:
+                    reply = self._get_more(body)
+                elif opcode == OP_KILL_CURSORS:
+                    count = struct.unpack("<i", body[4:8])[0]
+                    for cursor_id in struct.unpack("<%sq" % count, body[8:8 + 8 * count]):
+                        self._cursors.pop(cursor_id, None)
+            return reply, error
+
+    def _write(self, opcode, body):
+        ns_end = body.index('\x00', 4)
+        ns = body[4:ns_end].decode('utf-8')
+        try:
+            if opcode == OP_INSERT:
+                flags = struct.unpack("<i", body[:4])[0]
+                as_class = SON if ns.endswith('.system.indexes') else dict
+                docs = bson.decode_all(body[ns_end + 1:], as_class, False)
+                return self._insert(ns, docs, continue_on_error=flags & 1)
+            flags = struct.unpack("<i", body[ns_end + 1:ns_end + 5])[0]
+            docs = bson.decode_all(body[ns_end + 5:], SON, False)
+            if opcode == OP_UPDATE:
+                return self._update(ns, docs[0], docs[1], upsert=flags & 1, multi=flags & 2)
+            return self._remove(ns, docs[0], single=flags & 1)
+        except _QueryError, e:
+            return self._error(e)
+
+    def _error(self, error, **kwargs):
+        result = {'err': str(error), 'n': 0, 'ok': 1.0}
+        if error.code is not None:
+            result['code'] = error.code
+        result.update(kwargs)
+        return result
+
+    def _insert(self, ns, docs, continue_on_error=False):
+        if ns.endswith('.system.indexes'):
+            for spec in docs:
+                self.get_collection(spec['ns'], create=True).create_index(spec)
+            return {'err': None, 'n': 0, 'ok': 1.0}
+        collection = self.get_collection(ns, create=True)
+        error = None
+        for doc in docs:
+            try:
+                collection.insert(doc)
+            except _QueryError, e:
+                if not continue_on_error:
+                    raise
+                error = e
+        if error is not None:
+            raise error
+        return {'err': None, 'n': 0, 'ok': 1.0}
+
+    def _update(self, ns, spec, update, upsert=False, multi=False):
+        collection = self.get_collection(ns, create=upsert)
+        if collection is not None:
+            docs = collection.find(spec)[0]
+            if not multi:
+                docs = docs[:1]
+            if docs:
+                if multi and not _is_operator_dict(update):
+                    raise _QueryError("multi update only works with $ operators")
+                for doc in docs:
+                    collection.replace(_hash_key(doc['_id']), _apply_update(doc, update, spec))
+                return {'err': None, 'n': len(docs), 'updatedExisting': True, 'ok': 1.0}
+        if not upsert:
+            return {'err': None, 'n': 0, 'updatedExisting': False, 'ok': 1.0}
+        doc = self._upsert(collection, spec, update)
+        return {'err': None, 'n': 1, 'updatedExisting': False, 'upserted': doc['_id'], 'ok': 1.0}
+
+    def _upsert(self, collection, spec, update):
+        if _is_operator_dict(update):
+            doc = _apply_update(_upsert_document(spec), update, spec, inserting=True)
+        else:
+            doc = _apply_update({}, update, spec, inserting=True)
+            if '_id' not in doc and '_id' in spec and _is_indexable_equality(spec['_id']):
+                doc['_id'] = spec['_id']
+        collection.insert(doc)
+        return doc
+
+    def _remove(self, ns, spec, single=False):
+        collection = self.get_collection(ns)
+        count = 0
+        if collection is not None:
+            docs = collection.find(spec)[0]
+            if single:
+                docs = docs[:1]
+            for doc in docs:
+                collection.remove(_hash_key(doc['_id']))
+            count = len(docs)
+        return {'err': None, 'n': count, 'ok': 1.0}
+
+    def _reply(self, docs, cursor_id=0, starting_from=0, flags=0):
+        body = ''.join(doc.bson() if type(doc) is _StoredDocument else bson.BSON.encode(doc)
+          for doc in docs)
+        return struct.pack("<iqii", flags, cursor_id, starting_from, len(docs)) + body
+
+    def _query(self, body):
+        ns_end = body.index('\x00', 4)
+        ns = body[4:ns_end].decode('utf-8')
+        skip, limit = struct.unpack("<ii", body[ns_end + 1:ns_end + 9])
+        docs = bson.decode_all(body[ns_end + 9:], SON, False)
+        spec = docs[0]
+        fields = None
+        if len(docs) > 1:
+            fields = docs[1]
+        try:
+            if ns.endswith('.$cmd'):
+                if '$query' in spec:
+                    spec = spec['$query']
+                return self._reply([self.command(ns[:-5], spec)])
+            return self._find(ns, spec, fields, skip, limit)
+        except _QueryError, e:
+            return self._reply([{'$err': str(e), 'code': e.code}], flags=_FLAG_QUERY_FAILURE)
+
+    def _find(self, ns, spec, fields, skip, limit):
+        orderby = None
+        explain = False
+        if '$query' in spec:
+            orderby = spec.get('$orderby')
+            explain = spec.get('$explain', False)
+            spec = spec['$query']
+        start = time.time()
+        dbname, sep, name = ns.partition('.')
+        index_name = None
+        if name == 'system.indexes':
+            docs = []
+            for collection in self.databases.get(dbname, {}).itervalues():
+                docs.extend(collection.index_specs())
+            docs = [doc for doc in docs if _match(doc, spec)]
+            scanned = len(docs)
+        elif name == 'system.namespaces':
+            docs = [{'name': ns} for ns in self._namespaces(dbname)]
+            docs = [doc for doc in docs if _match(doc, spec)]
+            scanned = len(docs)
+        else:
+            collection = self.get_collection(ns)
+            if collection is None:
+                docs, scanned = [], 0
+            else:
+                docs, index_name, scanned = collection.find(spec)
+        if orderby:
+            _sort_documents(docs, orderby)
+        docs = docs[skip:]
+        if explain:
+            if limit:
+                docs = docs[:abs(limit)]
+            cursor = 'BasicCursor'
+            if index_name is not None:
+                cursor = 'BtreeCursor %s' % index_name
+            return self._reply([{
+                'cursor': cursor,
+                'isMultiKey': False,
+                'n': len(docs),
+                'nscannedObjects': scanned,
+                'nscanned': scanned,
+                'scanAndOrder': bool(orderby),
+                'indexOnly': False,
+                'nYields': 0,
+                'nChunkSkips': 0,
+                'millis': int((time.time() - start) * 1000),
+                'indexBounds': {},
+                'allPlans': [{'cursor': cursor, 'indexBounds': {}}],
+                'server': 'memory',
+            }])
+        return self._batch(_Cursor(ns, docs, fields), limit, first=True)
+
+    def _batch(self, cursor, limit, first=False, cursor_id=0):
+        """
+        return the reply of the next batch of `cursor`. A negative `limit`
+        closes the cursor after the batch, 0 means the default batch size
+        """
+        if limit == 1 and first:
+            limit = -1
+        size = abs(limit)
+        if not size:
+            size = _DEFAULT_BATCH_SIZE if first else len(cursor.docs)
+        start = cursor.position
+        docs = cursor.docs[start:start + size]
+        cursor.position += len(docs)
+        if limit < 0 or cursor.position >= len(cursor.docs):
+            self._cursors.pop(cursor_id, None)
+            cursor_id = 0
+        elif not cursor_id:
+            self._cursor_ids += 1
+            cursor_id = self._cursor_ids
+            self._cursors[cursor_id] = cursor
+        try:
+            docs = [_project(doc, cursor.fields) for doc in docs]
+        except _QueryError, e:
+            self._cursors.pop(cursor_id, None)
+            return self._reply([{'$err': str(e)}], flags=_FLAG_QUERY_FAILURE)
+        return self._reply(docs, cursor_id, start)
+
+    def _get_more(self, body):
+        ns_end = body.index('\x00', 4)
+        limit, cursor_id = struct.unpack("<iq", body[ns_end + 1:ns_end + 13])
+        cursor = self._cursors.get(cursor_id)
+        if cursor is None:
+            return self._reply([], flags=_FLAG_CURSOR_NOT_FOUND)
+        return self._batch(cursor, limit, cursor_id=cursor_id)
+
+    def _namespaces(self, dbname):
+        database = self.databases.get(dbname)
+        if not database:
+            return []
+        names = ['%s.system.indexes' % dbname]
+        names.extend(collection.ns for collection in database.itervalues())
+        return names
+
+    #
+    # commands
+    #
+
+    def command(self, dbname, spec):
+        """
+        run the command `spec` on the database `dbname` and return its
+        response
+        """
+        name = spec.keys()[0]
+        method = getattr(self, '_command_%s' % name.lower(), None)
+        if method is None:
+            return {'ok': 0.0, 'errmsg': 'no such cmd: %s' % name, 'bad cmd': spec}
+        try:
+            result = method(dbname, spec[name], spec)
+        except _QueryError, e:
+            result = {'ok': 0.0, 'errmsg': str(e)}
+            if e.code is not None:
+                result['code'] = e.code
+        return result
+
+    def _command_ismaster(self, dbname, value, spec):
+        return {'ismaster': True, 'maxBsonObjectSize': 16 * 1024 * 1024, 'ok': 1.0}
+
+    def _command_ping(self, dbname, value, spec):
+        return {'ok': 1.0}
+
+    def _command_buildinfo(self, dbname, value, spec):
+        return {'version': '2.2.0', 'versionArray': [2, 2, 0, 0], 'bits': 64,
+          'maxBsonObjectSize': 16 * 1024 * 1024, 'ok': 1.0}
+
+    def _command_getlasterror(self, dbname, value, spec):
+        error = getattr(self._last_error, 'value', None)
+        if error is None:
+            return {'err': None, 'n': 0, 'ok': 1.0}
+        return error
+
+    def _command_getnonce(self, dbname, value, spec):
+        return {'nonce': '2375531c32080ae8', 'ok': 1.0}
+
+    def _command_authenticate(self, dbname, value, spec):
+        return {'ok': 1.0}
+
+    def _command_logout(self, dbname, value, spec):
+        return {'ok': 1.0}
+
+    def _command_count(self, dbname, value, spec):
+        collection = self.get_collection('%s.%s' % (dbname, value))
+        if collection is None:
+            return {'ok': 0.0, 'errmsg': 'ns missing'}
+        docs = collection.find(spec.get('query') or {})[0]
+        docs = docs[spec.get('skip') or 0:]
+        if spec.get('limit'):
+            docs = docs[:abs(spec['limit'])]
+        return {'n': float(len(docs)), 'ok': 1.0}
+
+    def _command_distinct(self, dbname, value, spec):
+        collection = self.get_collection('%s.%s' % (dbname, value))
+        values = []
+        if collection is not None:
+            parts = spec['key'].split('.')
+            for doc in collection.find(spec.get('query') or {})[0]:
+                for item in _expand(_resolve(doc, parts)):
+                    if isinstance(item, list):
+                        continue
+                    if not any(_equal(item, other) for other in values):
+                        values.append(item)
+        return {'values': values, 'ok': 1.0}
+
+    def _command_findandmodify(self, dbname, value, spec):
+        ns = '%s.%s' % (dbname, value)
+        query = spec.get('query') or {}
+        update = spec.get('update')
+        remove = spec.get('remove', False)
+        upsert = spec.get('upsert', False)
+        if not remove and update is None:
+            raise _QueryError("need remove or update")
+        collection = self.get_collection(ns, create=upsert)
+        docs = []
+        if collection is not None:
+            docs = collection.find(query)[0]
+            if spec.get('sort'):
+                _sort_documents(docs, spec['sort'])
+        if not docs:
+            if not upsert or remove:
+                return {'ok': 0.0, 'errmsg': 'No matching object found'}
+            doc = self._upsert(collection, query, update)
+            result = None
+            if spec.get('new'):
+                result = doc
+            return {'value': result and _project(result, spec.get('fields')),
+              'lastErrorObject': {'updatedExisting': False, 'n': 1, 'upserted': doc['_id']},
+              'ok': 1.0}
+        doc = docs[0]
+        id_key = _hash_key(doc['_id'])
+        if remove:
+            collection.remove(id_key)
+            result = doc
+        else:
+            new_doc = _apply_update(doc, update, query)
+            collection.replace(id_key, new_doc)
+            result = new_doc if spec.get('new') else doc
+        return {'value': _project(result, spec.get('fields')),
+          'lastErrorObject': {'updatedExisting': not remove, 'n': 1}, 'ok': 1.0}
+
+    def _command_drop(self, dbname, value, spec):
+        database = self.databases.get(dbname, {})
+        if value not in database:
+            return {'ok': 0.0, 'errmsg': 'ns not found'}
+        collection = database.pop(value)
+        return {'ns': collection.ns, 'nIndexesWas': len(collection.indexes) + 1, 'ok': 1.0}
+
+    def _command_dropdatabase(self, dbname, value, spec):
+        self.databases.pop(dbname, None)
+        return {'dropped': dbname, 'ok': 1.0}
+
+    def _command_create(self, dbname, value, spec):
+        ns = '%s.%s' % (dbname, value)
+        if self.get_collection(ns) is not None:
+            return {'ok': 0.0, 'errmsg': 'collection already exists'}
+        self.get_collection(ns, create=True).options = dict(spec)
+        return {'ok': 1.0}
+
+    def _command_deleteindexes(self, dbname, value, spec):
+        collection = self.get_collection('%s.%s' % (dbname, value))
+        if collection is None:
+            return {'ok': 0.0, 'errmsg': 'ns not found'}
+        count = len(collection.indexes) + 1
+        name = spec['index']
+        if name == '*':
+            collection.indexes.clear()
+        elif name in collection.indexes:
+            del collection.indexes[name]
+        else:
+            return {'ok': 0.0, 'errmsg': 'index not found', 'nIndexesWas': count}
+        return {'nIndexesWas': count, 'ok': 1.0}
+
+    _command_dropindexes = _command_deleteindexes
+
+    def _command_listdatabases(self, dbname, value, spec):
+        return {'databases': [{'name': name, 'sizeOnDisk': 1.0, 'empty': False}
+          for name in sorted(self.databases)], 'totalSize': 1.0, 'ok': 1.0}
+
+    def _command_renamecollection(self, dbname, value, spec):
+        source_db, sep, source = value.partition('.')
+        target_db, sep, target = spec['to'].partition('.')
+        collection = self.databases.get(source_db, {}).get(source)
+        if collection is None:
+            return {'ok': 0.0, 'errmsg': 'source namespace does not exist'}
+        if self.get_collection(spec['to']) is not None:
+            if not spec.get('dropTarget'):
+                return {'ok': 0.0, 'errmsg': 'target namespace exists'}
+            del self.databases[target_db][target]
+        del self.databases[source_db][source]
+        collection.ns = spec['to']
+        for index in collection.indexes.itervalues():
+            index.spec['ns'] = spec['to']
+        self.databases.setdefault(target_db, OrderedDict())[target] = collection
+        return {'ok': 1.0}
+
+    def _command_filemd5(self, dbname, value, spec):
+        ns = '%s.%s.chunks' % (dbname, spec.get('root', 'fs'))
+        collection = self.get_collection(ns)
+        chunks = []
+        if collection is not None:
+            chunks = collection.find({'files_id': value})[0]
+            _sort_documents(chunks, SON([('n', 1)]))
+        md5 = hashlib.md5()
+        for chunk in chunks:
+            md5.update(chunk['data'])
+        return {'md5': md5.hexdigest(), 'numChunks': len(chunks), 'ok': 1.0}
+
+    def _command_collstats(self, dbname, value, spec):
+        collection = self.get_collection('%s.%s' % (dbname, value))
+        if collection is None:
+            return {'ok': 0.0, 'errmsg': 'ns not found'}
+        size = sum(len(bson.BSON.encode(doc)) for doc in collection.documents.itervalues())
+        count = len(collection.documents)
+        return {'ns': collection.ns, 'count': count, 'size': size,
+          'avgObjSize': float(size) / count if count else 0.0,
+          'nindexes': len(collection.indexes) + 1, 'ok': 1.0}
+
+# the storage shared by the MemoryConnections created without `storage`
+default_storage = MemoryStorage()
+
+class MemoryConnection(Connection):
+    """
+    a Connection which stores the databases in memory (in `storage`, a
+    MemoryStorage which defaults to the process wide `default_storage`).
+    The host and the port are ignored
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.storage = kwargs.pop('storage', None)
+        if self.storage is None:
+            self.storage = default_storage
+        kwargs['_connect'] = False
+        super(MemoryConnection, self).__init__(*args, **kwargs)
+
+    def _send_message(self, message, with_last_error=False, *args, **kwargs):
+        reply, error = self.storage.handle(message[1])
+        if not with_last_error or error is None:
+            return None
+        if error.get('err'):
+            if error.get('code') in (11000, 11001):
+                raise DuplicateKeyError(error['err'])
+            raise OperationFailure(error['err'], error.get('code'))
+        return error
+
+    def _send_message_with_response(self, message, *args, **kwargs):
+        reply, error = self.storage.handle(message[1])
+        return reply
+
+    def alive(self):
+        return True
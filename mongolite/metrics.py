@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Optional in-process metrics of the operations sent by mongolite. The
+metrics are disabled by default and cost a global lookup per operation;
+call `enable()` to start recording:
+
+>>> from mongolite import metrics
+>>> registry = metrics.enable()
+>>> con.BlogPost.find_one()
+>>> registry.snapshot()
+[{'collection': u'test.blogposts', 'document': 'BlogPost', 'operation': 'find_one',
+  'count': 1, 'errors': 0, 'documents': 1, 'bytes': 187, 'seconds': 0.0004, ...}]
+"""
+
+import bisect
+import threading
+import time
+
+# upper bounds of the latency buckets (in seconds)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+  1.0, 2.5, 5.0, 10.0)
+
+# the active registry, None when the metrics are disabled
+registry = None
+
+class Histogram(object):
+    """
+    latency histogram with the fixed `BUCKETS`. The last bucket counts the
+    values above the last bound
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+
+    def percentile(self, percent):
+        """
+        return the upper bound of the bucket holding the `percent`
+        percentile (None if it is above the last bound or if the histogram
+        is empty)
+        """
+        total = sum(self.counts)
+        if not total:
+            return None
+        rank = total * percent / 100.0
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+class OperationMetrics(object):
+    """
+    the metrics of one operation on a collection for a document class
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.documents = 0
+        self.bytes = 0
+        self.histogram = Histogram()
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'seconds': self.seconds,
+            'documents': self.documents,
+            'bytes': self.bytes,
+            'p50': self.histogram.percentile(50),
+            'p99': self.histogram.percentile(99),
+            'buckets': list(self.histogram.counts),
+        }
+
+class MetricsRegistry(object):
+    """
+    the metrics of the operations labeled by collection, document class
+    name (None for raw dicts) and operation (`find`, `find_one`, `getmore`,
+    `find_and_modify`, `save`, `remove`)
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def record(self, collection, document, operation, seconds, documents=0,
+      bytes=0, error=False):
+        key = (collection, document, operation)
+        with self._lock:
+            metrics = self._metrics.get(key)
+            if metrics is None:
+                metrics = self._metrics[key] = OperationMetrics()
+            metrics.count += 1
+            metrics.seconds += seconds
+            metrics.documents += documents
+            metrics.bytes += bytes
+            if error:
+                metrics.errors += 1
+            metrics.histogram.observe(seconds)
+
+    def get(self, collection, document, operation):
+        """
+        return the OperationMetrics of the labels or None
+        """
+        return self._metrics.get((collection, document, operation))
+
+    def snapshot(self):
+        """
+        return the metrics as a list of dicts sorted by labels
+        """
+        with self._lock:
+            items = sorted(self._metrics.items())
+            result = []
+            for (collection, document, operation), metrics in items:
+                entry = metrics.as_dict()
+                entry['collection'] = collection
+                entry['document'] = document
+                entry['operation'] = operation
+                result.append(entry)
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def to_prometheus(self, prefix='mongolite'):
+        """
+        return the metrics in the prometheus text format
+        """
+        lines = [
+          '# TYPE %s_operation_seconds histogram' % prefix,
+        ]
+        counters = []
+        for entry in self.snapshot():
+            labels = 'collection="%s",document="%s",operation="%s"' % (
+              entry['collection'], entry['document'] or '', entry['operation'])
+            cumulated = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), entry['buckets']):
+                cumulated += count
+                lines.append('%s_operation_seconds_bucket{%s,le="%s"} %s' % (
+                  prefix, labels, bound, cumulated))
+            lines.append('%s_operation_seconds_sum{%s} %r' % (prefix, labels, entry['seconds']))
+            lines.append('%s_operation_seconds_count{%s} %s' % (prefix, labels, entry['count']))
+            for name in ('errors', 'documents', 'bytes'):
+                counters.append((name, '%s_operation_%s_total{%s} %s' % (
+                  prefix, name, labels, entry[name])))
+        for name in ('errors', 'documents', 'bytes'):
+            lines.append('# TYPE %s_operation_%s_total counter' % (prefix, name))
+            lines.extend(line for counter, line in counters if counter == name)
+        return '\n'.join(lines) + '\n'
+
+def enable(metrics_registry=None):
+    """
+    start recording the operations in `metrics_registry` (a new registry by
+    default) and return it
+    """
+    global registry
+    if metrics_registry is None:
+        metrics_registry = MetricsRegistry()
+    registry = metrics_registry
+    return registry
+
+def disable():
+    """
+    stop recording the operations
+    """
+    global registry
+    registry = None
+
+def document_name(obj):
+    """
+    return the label of a document instance or class: the name of its class
+    (None for None and the raw dicts)
+    """
+    if obj is None:
+        return None
+    if not isinstance(obj, type):
+        obj = type(obj)
+    if obj is dict:
+        return None
+    return obj.__name__
+
+def call(collection, document, operation, func, *args, **kwargs):
+    """
+    call `func` and record its duration in the active registry
+    """
+    active = registry
+    start = time.time()
+    try:
+        result = func(*args, **kwargs)
+    except Exception:
+        active.record(collection, document, operation, time.time() - start, error=True)
+        raise
+    active.record(collection, document, operation, time.time() - start)
+    return result
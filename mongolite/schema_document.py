@@ -33,15 +33,161 @@ log = logging.getLogger(__name__)
 
 from mongo_exceptions import StructureError, BadKeyError, AuthorizedTypeError
 
-from helpers import DotCollapsedDict
-
 # field wich does not need to be declared into the skeleton
 STRUCTURE_KEYWORDS = []
 
+def _compile_template(template):
+    """
+    compile a generated skeleton into a (immutables, containers) tuple.
+    `immutables` holds the values which can be shared by all the documents
+    (None) and `containers` is a list of (key, factory, compiled_children)
+    for the lists and dicts which must be created for each new document.
+    """
+    immutables = {}
+    containers = []
+    for key, value in template.iteritems():
+        if isinstance(value, dict):
+            containers.append((key, type(value), _compile_template(value)))
+        elif isinstance(value, list):
+            if value:
+                factory = lambda items=tuple(value), list_type=type(value): list_type(items)
+            else:
+                factory = type(value)
+            containers.append((key, factory, None))
+        else:
+            immutables[key] = value
+    return immutables, containers
+
+# actions of the compiled default values
+_ASSIGN, _CALL, _DEEPCOPY, _COPY_LIST, _EXTEND = range(5)
+
+def _default_value_action(value):
+    """
+    return the (action, value) tuple used to set the default value `value`
+    """
+    if callable(value):
+        return _CALL, value
+    elif isinstance(value, dict):
+        return _DEEPCOPY, value
+    elif isinstance(value, list):
+        return _COPY_LIST, value
+    return _ASSIGN, value
+
+def _get_default_value(action, value):
+    if action == _ASSIGN:
+        return value
+    elif action == _CALL:
+        return value()
+    elif action == _DEEPCOPY:
+        return deepcopy(value)
+    return value[:]
+
+def _apply_default_values(doc, plan):
+    """
+    set the default values compiled by `_compile_default_values` into `doc`
+    """
+    for parents, key, action, value in plan:
+        target = doc
+        for parent in parents:
+            target = target[parent]
+        if action == _ASSIGN:
+            target[key] = value
+        elif action == _EXTEND:
+            target[key].extend([_get_default_value(*item) for item in value])
+        else:
+            target[key] = _get_default_value(action, value)
+
+def _fill_template(doc, compiled_template):
+    """
+    fill `doc` with a new copy of a template compiled by `_compile_template`
+    """
+    immutables, containers = compiled_template
+    doc.update(immutables)
+    for key, factory, children in containers:
+        value = factory()
+        if children is not None:
+            _fill_template(value, children)
+        doc[key] = value
+
+class _ClassCache(object):
+    """
+    placeholder set in the dict of each class which computes the value of
+    the attribute with the `method` classmethod on first access and replace
+    itself by the result
+    """
+    def __init__(self, name, method):
+        self.name = name
+        self.method = method
+
+    def __get__(self, obj, objtype=None):
+        value = getattr(objtype, self.method)()
+        setattr(objtype, self.name, value)
+        return value
+
+class _ClassDoc(object):
+    """
+    `__doc__` of the classes with a skeleton: the docstring followed by the
+    required and optional fields, generated on first access (from the class
+    or from an instance)
+    """
+    def __init__(self, doc, skeleton, optional):
+        self.doc = doc
+        self.skeleton = skeleton
+        self.optional = optional
+        self.generated = None
+
+    def __get__(self, obj, objtype=None):
+        if self.generated is None:
+            skel_doc = ""
+            for k, v in (self.skeleton or {}).iteritems():
+                skel_doc += " "*8+k+" : "+str(v)+"\n"
+            opt_doc = ""
+            for k, v in (self.optional or {}).iteritems():
+                opt_doc += " "*8+k+" : "+str(v)+"\n"
+            self.generated = (self.doc or '')+"""
+    required fields: {
+%s    }
+    optional fields: {
+%s    }
+""" % (skel_doc, opt_doc)
+        return self.generated
+
+# the class attributes the compiled attributes are built from
+_SCHEMA_ATTRIBUTES = frozenset(['skeleton', 'optional', 'default_values'])
+
+# classes whose skeleton is not validated
+_UNCHECKED_CLASS_NAMES = frozenset(["SchemaDocument", "Document"])
+
+def _mro_field_names(klass):
+    """
+    return the set of the names defined in the classes of `klass.__mro__`
+    """
+    if isinstance(klass, SchemaProperties):
+        # _protected_field_names already holds the names of bases[0].__mro__
+        names = set(klass._protected_field_names)
+        names.update(klass.__dict__)
+        for base in klass.__bases__[1:]:
+            names.update(_mro_field_names(base))
+        return names
+    names = set()
+    for mro in klass.__mro__:
+        names.update(mro.__dict__)
+    return names
+
+def _is_checked(klass):
+    """
+    return True if the skeleton and the optional fields of `klass` were
+    validated at its creation
+    """
+    if not (getattr(klass, 'skeleton', None) or getattr(klass, 'optional', None)):
+        return True
+    return isinstance(klass, SchemaProperties) and\
+      klass.__name__ not in _UNCHECKED_CLASS_NAMES
+
 class SchemaProperties(type):
     def __new__(cls, name, bases, attrs):
-        attrs['_protected_field_names'] = set(
-            ['_protected_field_names', '_namespaces', '_required_namespace'])
+        own_skeleton = attrs.get('skeleton')
+        own_optional = attrs.get('optional')
         for base in bases:
             parent = base.__mro__[0]
             if hasattr(parent, 'skeleton'):
@@ -70,48 +216,93 @@ class SchemaProperties(type):
             if hasattr(parent, 'skeleton') or hasattr(parent, 'optional'):
                 if attrs.get('authorized_types'):
                     attrs['authorized_types'] = list(set(parent.authorized_types).union(set(attrs['authorized_types'])))
-        for mro in bases[0].__mro__:
-            attrs['_protected_field_names'] = attrs['_protected_field_names'].union(list(mro.__dict__))
-        attrs['_protected_field_names'] = list(attrs['_protected_field_names'])
+        protected_field_names = _mro_field_names(bases[0])
+        protected_field_names.update(
+            ['_protected_field_names', '_namespaces', '_required_namespace'])
+        attrs['_protected_field_names'] = frozenset(protected_field_names)
         attrs['_namespaces'] = []
-        attrs['_collapsed_struct'] = {}
-        if (attrs.get('skeleton') or attrs.get('optional')) and name not in ["SchemaDocument", "Document"]:
+        if (attrs.get('skeleton') or attrs.get('optional')) and name not in _UNCHECKED_CLASS_NAMES:
             base = bases[0]
             if not attrs.get('authorized_types'):
                 attrs['authorized_types'] = base.authorized_types
+            # the fields inherited from validated classes are not checked again
+            inherited_checked = all(_is_checked(b) for b in bases)
             if attrs.get('skeleton'):
-                base._validate_skeleton(attrs['skeleton'], name, attrs.get('authorized_types'))
-                attrs['_namespaces'].extend(list(base._SchemaDocument__walk_dict(attrs['skeleton'])))
-                attrs['_collapsed_struct'].update(DotCollapsedDict(attrs['skeleton'], remove_under_type=True))
+                if not inherited_checked:
+                    base._validate_skeleton(attrs['skeleton'], name, attrs.get('authorized_types'))
+                elif own_skeleton is not None:
+                    base._validate_skeleton(own_skeleton, name, attrs.get('authorized_types'))
             if attrs.get('optional'):
-                base._validate_skeleton(attrs['optional'], name, attrs.get('authorized_types'))
-                attrs['_namespaces'].extend(list(base._SchemaDocument__walk_dict(attrs['optional'])))
-                attrs['_collapsed_struct'].update(DotCollapsedDict(attrs['optional'], remove_under_type=True))
+                if not inherited_checked:
+                    base._validate_skeleton(attrs['optional'], name, attrs.get('authorized_types'))
+                elif own_optional is not None:
+                    base._validate_skeleton(own_optional, name, attrs.get('authorized_types'))
+            if _is_checked(base) and base.__name__ not in _UNCHECKED_CLASS_NAMES and\
+              attrs.get('skeleton') is base.skeleton and attrs.get('optional') is base.optional:
+                # same fields than the base class (ie: the class only adds methods)
+                attrs['_namespaces'] = list(base._namespaces)
+                attrs['_namespaces_set'] = base._namespaces_set
+            else:
+                if attrs.get('skeleton'):
+                    base._SchemaDocument__walk_dict(attrs['skeleton'], namespaces=attrs['_namespaces'])
+                if attrs.get('optional'):
+                    base._SchemaDocument__walk_dict(attrs['optional'], namespaces=attrs['_namespaces'])
+                attrs['_namespaces_set'] = frozenset(attrs['_namespaces'])
             cls._validate_descriptors(attrs)
-        if (attrs.get('skeleton') or attrs.get('optional')):
-            skel_doc = ""
-            for k, v in attrs.get('skeleton', {}).iteritems():
-                skel_doc += " "*8+k+" : "+str(v)+"\n"
-            opt_doc = ""
-            for k, v in attrs.get('optional', {}).iteritems():
-                opt_doc += " "*8+k+" : "+str(v)+"\n"
-            attrs['__doc__'] = attrs.get('__doc__', '')+"""
-    required fields: {
-%s    }
-    optional fields: {
-%s    }
-""" % (skel_doc, opt_doc)
-        return type.__new__(cls, name, bases, attrs)        
+        else:
+            attrs['_namespaces_set'] = frozenset()
+        if attrs.get('skeleton') or attrs.get('optional'):
+            attrs['__doc__'] = _ClassDoc(attrs.get('__doc__'),
+              attrs.get('skeleton'), attrs.get('optional'))
+        return type.__new__(cls, name, bases, attrs)
+
+    def __init__(cls, name, bases, attrs):
+        super(SchemaProperties, cls).__init__(name, bases, attrs)
+        base = bases[0]
+        template = plan = None
+        if isinstance(base, SchemaProperties):
+            added = cls._added_fields(base)
+            if added is not None:
+                template = cls._compile_inherited_skeleton(base, added)
+                plan = cls._compile_inherited_default_values(base, added)
+        if template is None:
+            template = cls._compile_skeleton()
+        if plan is None:
+            plan = cls._compile_default_values()
+        type.__setattr__(cls, '_compiled_skeleton', template)
+        type.__setattr__(cls, '_default_values_plan', plan)
+
+    def __setattr__(cls, name, value):
+        type.__setattr__(cls, name, value)
+        if name in _SCHEMA_ATTRIBUTES:
+            cls._schema_changed(name)
+
+    def _schema_changed(cls, name):
+        """
+        rebuild the attributes compiled from the fields after the class
+        attribute `name` was reassigned. The subclasses which inherit
+        `name` are rebuilt too.
+        """
+        type.__setattr__(cls, '_compiled_skeleton', cls._compile_skeleton())
+        type.__setattr__(cls, '_default_values_plan', cls._compile_default_values())
+        doc = vars(cls).get('__doc__')
+        if isinstance(doc, _ClassDoc):
+            type.__setattr__(cls, '__doc__', _ClassDoc(doc.doc, cls.skeleton, cls.optional))
+        for subclass in cls.__subclasses__():
+            if name not in vars(subclass):
+                subclass._schema_changed(name)
 
     @classmethod
     def _validate_descriptors(cls, attrs):
         for dv in attrs.get('default_values', {}):
-            if not dv in attrs['_namespaces']:
+            if not dv in attrs['_namespaces_set']:
                 raise ValueError("Error in default_values: can't find %s in skeleton" % dv )
 
 class SchemaDocument(dict):
     __metaclass__ = SchemaProperties
-    
+
+    __slots__ = ()
+
     skeleton = None
     optional = None
     default_values = {}
@@ -148,12 +339,9 @@ class SchemaDocument(dict):
                 self[k] = v
             gen_skel = False
         if gen_skel:
-            self.generate_skeleton()
-            if self.default_values:
-                if self.skeleton:
-                    self._set_default_fields(self, self.skeleton)
-                if self.optional:
-                    self._set_default_fields(self, self.optional)
+            _fill_template(self, self._compiled_skeleton)
+            if self._default_values_plan:
+                _apply_default_values(self, self._default_values_plan)
 
     def generate_skeleton(self):
         """
@@ -168,65 +356,124 @@ class SchemaDocument(dict):
     #
     # Public API end
     #
- 
+
+    @classmethod
+    def _compile_skeleton(cls):
+        """
+        generate the skeleton once and compile it so new documents can be
+        built without walking the skeleton and the optional fields
+        """
+        template = {}
+        if cls.skeleton:
+            cls.__generate_skeleton(template, cls.skeleton)
+        if cls.optional:
+            cls.__generate_skeleton(template, cls.optional)
+        return _compile_template(template)
+
+    @classmethod
+    def _added_fields(cls, base):
+        """
+        return the (skeleton, optional) fields the class adds to the fields
+        of `base` when it only adds new fields (the common case of a class
+        hierarchy), or None
+        """
+        parent_keys = set()
+        added = []
+        for struct, parent in ((cls.skeleton, base.skeleton), (cls.optional, base.optional)):
+            struct = struct or {}
+            parent = parent or {}
+            new_fields = {}
+            for key, value in struct.iteritems():
+                if key not in parent:
+                    new_fields[key] = value
+                elif parent[key] is not value:
+                    return None
+            if len(struct) - len(new_fields) != len(parent):
+                return None
+            parent_keys.update(parent)
+            added.append(new_fields)
+        skeleton, optional = added
+        if not parent_keys.isdisjoint(skeleton) or not parent_keys.isdisjoint(optional):
+            # the new fields are merged into the fields of base
+            return None
+        return skeleton, optional
+
     @classmethod
-    def __walk_dict(cls, dic):
+    def _compile_inherited_skeleton(cls, base, added):
+        """
+        return the compiled template of the class built from the one of
+        `base` and the `added` fields (see `_added_fields()`)
+        """
+        skeleton, optional = added
+        if not skeleton and not optional:
+            return base._compiled_skeleton
+        template = {}
+        cls.__generate_skeleton(template, skeleton)
+        cls.__generate_skeleton(template, optional)
+        immutables, containers = _compile_template(template)
+        base_immutables, base_containers = base._compiled_skeleton
+        immutables.update(base_immutables)
+        return immutables, base_containers + containers
+
+    @classmethod
+    def _compile_inherited_default_values(cls, base, added):
+        """
+        return the default values plan of the class built from the one of
+        `base` and the `added` fields (see `_added_fields()`) or None if the
+        class changes the default values of the fields of `base`
+        """
+        skeleton, optional = added
+        # the values compiled for base (its default_values may have been
+        # modified since)
+        base_values = dict((".".join(parents + (key,)), value)
+          for parents, key, action, value in base._default_values_plan)
+        inherited = 0
+        for key, value in (cls.default_values or {}).iteritems():
+            root = key.split('.', 1)[0]
+            if root in skeleton or root in optional:
+                continue
+            if base_values.get(key, base_values) is not value:
+                return None
+            inherited += 1
+        if inherited != len(base_values):
+            return None
+        if inherited == len(cls.default_values or ()):
+            return base._default_values_plan
+        plan = list(base._default_values_plan)
+        cls.__compile_default_fields(plan, skeleton)
+        cls.__compile_default_fields(plan, optional)
+        return plan
+
+    @classmethod
+    def __walk_dict(cls, dic, prefix="", namespaces=None):
+        """
+        return the list of the dotted namespaces of `dic`. Type keys are
+        written `$typename`.
+        """
         # thanks jean_b for the patch
+        if namespaces is None:
+            namespaces = []
         for key, value in dic.items():
-            if isinstance(value, dict) and len(value):
-                if type(key) is type:
-                    yield '$%s' % key.__name__
-                else:
-                    yield key
-                for child_key in cls.__walk_dict(value):
-                    if type(key) is type:
-                        new_key = "$%s" % key.__name__
-                    else:
-                        new_key = key
-                    #if type(child_key) is type:
-                    #    new_child_key = "$%s" % child_key.__name__
-                    #else:
-                    if type(child_key) is not type:
-                        new_child_key = child_key
-                    yield '%s.%s' % (new_key, new_child_key)
-            elif type(key) is type:
-                yield '$%s' % key.__name__
-#            elif isinstance(value, list) and len(value):
-#                if isinstance(value[0], dict):
-#                    for child_key in cls.__walk_dict(value[0]):
-#                        #if type(key) is type:
-#                        #    new_key = "$%s" % key.__name__
-#                        #else:
-#                        if type(key) is not type:
-#                            new_key = key
-#                        #if type(child_key) is type:
-#                        #    new_child_key = "$%s" % child_key.__name__
-#                        #else:
-#                        if type(child_key) is not type:
-#                            new_child_key = child_key
-#                        yield '%s.%s' % (new_key, new_child_key)
-#                else:
-#                    if type(key) is not type:
-#                        yield key
-#                    #else:
-#                    #    yield ""
+            if type(key) is type:
+                namespace = '%s$%s' % (prefix, key.__name__)
             else:
-                if type(key) is not type:
-                    yield key
-                #else:
-                #    yield ""
+                namespace = prefix + key
+            namespaces.append(namespace)
+            if isinstance(value, dict) and len(value):
+                cls.__walk_dict(value, namespace + '.', namespaces)
+        return namespaces
 
     @classmethod
     def _validate_skeleton(cls, skeleton, name, authorized_types):
         """
         validate if all fields in self.skeleton are in authorized types.
         """
+        authorized_types_set = frozenset(authorized_types)
         ##############
         def __validate_skeleton(struct, name,  authorized):
             if type(struct) is type:
-                if struct not in authorized_types:
-                    if struct not in authorized_types:
-                        raise StructureError("%s: %s is not an authorized type" % (name, struct))
+                if struct not in authorized_types_set:
+                    raise StructureError("%s: %s is not an authorized type" % (name, struct))
             elif isinstance(struct, dict):
                 for key in struct:
                     if isinstance(key, basestring):
@@ -291,97 +538,65 @@ class SchemaDocument(dict):
               "%s.skeleton must be a dict instance" % name)
         __validate_skeleton(skeleton, name, authorized_types)
 
-    def _set_default_fields(self, doc, struct, path = ""):
-        # TODO check this out, this method must be restructured
+    @classmethod
+    def _compile_default_values(cls):
+        """
+        compile the default_values into a flat list of
+        (parent_keys, key, action, value) so new documents get their default
+        values without walking the skeleton
+        """
+        plan = []
+        if cls.default_values:
+            if cls.skeleton:
+                cls.__compile_default_fields(plan, cls.skeleton)
+            if cls.optional:
+                cls.__compile_default_fields(plan, cls.optional)
+        return plan
+
+    @classmethod
+    def __compile_default_fields(cls, plan, struct, parents=()):
         for key in struct:
-            new_key = key
-            new_path = ".".join([path, new_key]).strip('.')
-            #
-            # default_values :
-            # if the value is None, check if a default value exist.
-            # if exists, and it is a function then call it otherwise,
-            # juste feed it
-            #
-            if type(key) is not type:
-                if doc[key] is None and new_path in self.default_values:
-                    new_value = self.default_values[new_path]
-                    if callable(new_value):
-                        new_value = new_value()
-                    elif isinstance(new_value, dict):
-                        new_value = deepcopy(new_value)
-                    elif isinstance(new_value, list):
-                        new_value = new_value[:]
-                    doc[key] = new_value
-            #
-            # if the value is a dict, we have a another skeleton to validate
-            #
-            if isinstance(struct[key], dict):
-                #
-                # if the dict is still empty into the document we build
-                # it with None values
-                #
-                if len(struct[key]) and\
-                  not [i for i in struct[key].keys() if type(i) is type]:
-                    self._set_default_fields(doc[key], struct[key], new_path)
+            if type(key) is type:
+                continue
+            new_path = ".".join(parents + (key,))
+            if isinstance(struct[key], dict) and len(struct[key]) and\
+              not [i for i in struct[key].keys() if type(i) is type]:
+                # another skeleton to walk
+                cls.__compile_default_fields(plan, struct[key], parents + (key,))
+            elif new_path in cls.default_values:
+                value = cls.default_values[new_path]
+                if isinstance(struct[key], list):
+                    plan.append((parents, key, _EXTEND,
+                      [_default_value_action(v) for v in value]))
                 else:
-                    if new_path in self.default_values:
-                        new_value = self.default_values[new_path]
-                        if callable(new_value):
-                            new_value = new_value()
-                        elif isinstance(new_value, dict):
-                            new_value = deepcopy(new_value)
-                        elif isinstance(new_value, list):
-                            new_value = new_value[:]
-                        doc[key] = new_value
-            elif isinstance(struct[key], list):
-                if new_path in self.default_values:
-                    for new_value in self.default_values[new_path]:
-                        if callable(new_value):
-                            new_value = new_value()
-                        elif isinstance(new_value, dict):
-                            new_value = deepcopy(new_value)
-                        elif isinstance(new_value, list):
-                            new_value = new_value[:]
-                        doc[key].append(new_value)  
-            else: # what else
-                if new_path in self.default_values:
-                    new_value = self.default_values[new_path]
-                    if callable(new_value):
-                        new_value = new_value()
-                    elif isinstance(new_value, dict):
-                        new_value = deepcopy(new_value)
-                    elif isinstance(new_value, list):
-                        new_value = new_value[:]
-                    doc[key] = new_value
-
-    def __generate_skeleton(self, doc, struct, path = ""):
-        for key in struct:
+                    plan.append((parents, key) + _default_value_action(value))
+
+    @classmethod
+    def __generate_skeleton(cls, doc, struct):
+        for key, value in struct.iteritems():
             if type(key) is type:
-                new_key = "$%s" % key.__name__
-            else:
-                new_key = key
-            new_path = ".".join([path, new_key]).strip('.')
+                continue
             #
             # Automatique generate the skeleton with NoneType
             #
-            if type(key) is not type and key not in doc:
-                if isinstance(struct[key], dict):
-                    if callable(struct[key]):
-                        doc[key] = struct[key]()
+            if key not in doc:
+                if isinstance(value, dict):
+                    if callable(value):
+                        doc[key] = value()
                     else:
-                        doc[key] = type(struct[key])()
-                elif struct[key] is dict:
+                        doc[key] = type(value)()
+                elif value is dict:
                     doc[key] = {}
-                elif isinstance(struct[key], list):
-                    doc[key] = type(struct[key])()
-                elif struct[key] is list:
+                elif isinstance(value, list):
+                    doc[key] = type(value)()
+                elif value is list:
                     doc[key] = []
-                elif isinstance(struct[key], tuple):
-                    doc[key] = [None for i in range(len(struct[key]))]
+                elif isinstance(value, tuple):
+                    doc[key] = [None] * len(value)
                 else:
                     doc[key] = None
             #
             # if the value is a dict, we have a another skeleton to validate
             #
-            if isinstance(struct[key], dict) and type(key) is not type:
-                self.__generate_skeleton(doc[key], struct[key], new_path)
+            if isinstance(value, dict):
+                cls.__generate_skeleton(doc[key], value)
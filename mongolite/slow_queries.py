@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Optional log of the slow queries. Once enabled, the queries whose first
+batch takes more than `threshold` seconds are logged with their document
+class, query shape (the values are replaced by '?'), sort and projection,
+and optionally their `explain()` output. The time of all the queries is
+aggregated by query shape to find the queries worth an index:
+
+>>> from mongolite import slow_queries
+>>> query_log = slow_queries.enable(threshold=0.05, explain=True)
+>>> ...
+>>> query_log.top(5)
+[{'collection': u'test.blogposts', 'document': 'BlogPost',
+  'shape': '{"author": "?", "date": {"$gt": "?"}}', 'sort': '[["date", -1]]',
+  'fields': None, 'count': 1200, 'seconds': 37.2, 'max_seconds': 0.4, 'slow': 210}]
+"""
+
+import collections
+import json
+import logging
+import threading
+log = logging.getLogger(__name__)
+
+# the active SlowQueryLog, None when disabled
+query_log = None
+
+_COMBINATORS = frozenset(['$and', '$or', '$nor'])
+
+def _is_operator_dict(value):
+    if not isinstance(value, dict) or not value:
+        return False
+    for key in value:
+        if not isinstance(key, basestring) or key[:1] != '$':
+            return False
+    return True
+
+def _value_shape(value):
+    if not _is_operator_dict(value):
+        return '?'
+    shape = {}
+    for operator, operand in value.iteritems():
+        if operator == '$elemMatch':
+            shape[operator] = query_shape(operand)
+        elif operator == '$not':
+            shape[operator] = _value_shape(operand)
+        else:
+            shape[operator] = '?'
+    return shape
+
+def query_shape(spec):
+    """
+    return the shape of the query `spec`: the field names and the operators
+    are kept, the values are replaced by '?'
+
+    >>> query_shape({'author': 'bob', 'date': {'$gt': yesterday}, '$or': [{'a': 1}, {'b': 2}]})
+    {'author': '?', 'date': {'$gt': '?'}, '$or': [{'a': '?'}, {'b': '?'}]}
+    """
+    if not isinstance(spec, dict):
+        return '?'
+    shape = {}
+    for key, value in spec.iteritems():
+        if key in _COMBINATORS and isinstance(value, list):
+            shape[key] = [query_shape(clause) for clause in value]
+        else:
+            shape[key] = _value_shape(value)
+    return shape
+
+def _key(value):
+    if value is None:
+        return None
+    return json.dumps(value, sort_keys=True, default=repr)
+
+class SlowQueryLog(object):
+    """
+    log the queries slower than `threshold` seconds (with the output of
+    `explain()` if `explain` is True) and aggregate the time of the queries
+    by collection, document class, query shape, sort and projection. At
+    most `max_shapes` shapes are kept: the cheapest one is dropped to make
+    room for a new one. The last `max_recent` slow queries are kept in
+    `recent`.
+    """
+
+    def __init__(self, threshold=0.1, explain=False, max_shapes=1000, max_recent=100,
+      logger=None):
+        self.threshold = threshold
+        self.explain = explain
+        self.max_shapes = max_shapes
+        self.logger = logger or log
+        self.recent = collections.deque(maxlen=max_recent)
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def record(self, collection, document, spec, sort, fields, seconds, explain=None):
+        """
+        record a query which took `seconds`. `explain` is a callable
+        returning the explain output of the query, it is only called if the
+        query is slow.
+        """
+        slow = seconds >= self.threshold
+        shape = _key(query_shape(spec))
+        if sort is not None:
+            sort = _key(list(sort.items()))
+        fields = _key(fields)
+        key = (collection, document, shape, sort, fields)
+        with self._lock:
+            stats = self._shapes.get(key)
+            if stats is None:
+                if len(self._shapes) >= self.max_shapes:
+                    cheapest = min(self._shapes, key=lambda k: self._shapes[k][1])
+                    del self._shapes[cheapest]
+                stats = self._shapes[key] = [0, 0.0, 0.0, 0]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+            if slow:
+                stats[3] += 1
+        if not slow:
+            return
+        entry = {
+            'collection': collection,
+            'document': document,
+            'shape': shape,
+            'sort': sort,
+            'fields': fields,
+            'seconds': seconds,
+            'explain': None,
+        }
+        if self.explain and explain is not None:
+            try:
+                entry['explain'] = explain()
+            except Exception, e:
+                entry['explain'] = {'error': str(e)}
+        self.recent.append(entry)
+        self.logger.warning("slow query (%.1f ms) on %s (%s): %s sort=%s fields=%s%s",
+          seconds * 1000, collection, document, shape, sort, fields,
+          " explain=%s" % (entry['explain'],) if entry['explain'] is not None else "")
+
+    def top(self, n=10):
+        """
+        return the `n` query shapes which took the most time
+        """
+        with self._lock:
+            items = sorted(self._shapes.iteritems(), key=lambda item: -item[1][1])[:n]
+        result = []
+        for (collection, document, shape, sort, fields), (count, seconds, max_seconds, slow) in items:
+            result.append({
+                'collection': collection,
+                'document': document,
+                'shape': shape,
+                'sort': sort,
+                'fields': fields,
+                'count': count,
+                'seconds': seconds,
+                'max_seconds': max_seconds,
+                'slow': slow,
+            })
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+        self.recent.clear()
+
+def enable(threshold=0.1, explain=False, **kwargs):
+    """
+    start logging the slow queries and return the new SlowQueryLog (see
+    its arguments)
+    """
+    global query_log
+    query_log = SlowQueryLog(threshold=threshold, explain=explain, **kwargs)
+    return query_log
+
+def disable():
+    """
+    stop logging the slow queries
+    """
+    global query_log
+    query_log = None
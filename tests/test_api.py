@@ -30,7 +30,9 @@ import unittest
 from mongolite import Document, Connection, DBRef,\
     ConnectionError, OperationFailure, ObjectId
 from mongolite.schema_document import SchemaDocument
+from mongolite.memory import MemoryConnection
 from pymongo import ReadPreference
+import pymongo
 
 class ApiTestCase(unittest.TestCase):
     def setUp(self):
@@ -80,6 +82,98 @@ class ApiTestCase(unittest.TestCase):
         mydoc["foo"] = 1
         self.assertRaises(ConnectionError, mydoc.save)
 
+    def test_connection_attributes_without_collection(self):
+        class MyDoc(Document):
+            skeleton = {
+                "foo":int,
+            }
+        mydoc = MyDoc()
+        for attr in ['collection', 'db', 'connection']:
+            self.assertRaises(ConnectionError, getattr, mydoc, attr)
+            self.assertFalse(hasattr(mydoc, attr))
+        self.assertEqual(mydoc.fs, None)
+        self.connection.register([MyDoc])
+        mydoc = self.col.MyDoc()
+        self.assertEqual(mydoc.collection, self.col)
+        self.assertEqual(mydoc.db, self.col.database)
+        self.assertEqual(mydoc.connection, self.connection)
+
+    def test_shared_document_context(self):
+        class MyDoc(Document):
+            skeleton = {
+                "foo":int,
+            }
+        self.connection.register([MyDoc])
+        mydoc = self.col.MyDoc()
+        otherdoc = self.col.MyDoc()
+        self.assertTrue(mydoc._context is otherdoc._context)
+        self.assertFalse('collection' in mydoc.__dict__)
+        self.assertFalse(hasattr(mydoc, '_authorized_types'))
+        mydoc.collection = self.connection.test.othercol
+        self.assertEqual(mydoc.collection.name, 'othercol')
+        self.assertEqual(otherdoc.collection, self.col)
+
+    def test_plain_pymongo_collection(self):
+        class MyDoc(Document):
+            skeleton = {
+                "foo":int,
+            }
+        self.connection.register([MyDoc])
+        col = pymongo.collection.Collection(self.connection.test, 'othercol')
+        for mydoc in [MyDoc(collection=col), self.col.MyDoc()]:
+            mydoc.collection = col
+            self.assertEqual(mydoc.collection, col)
+            self.assertEqual(mydoc.db, col.database)
+            self.assertEqual(mydoc.connection, self.connection)
+        mydoc.db = pymongo.database.Database(self.connection, 'otherdb')
+        self.assertEqual(mydoc.db.name, 'otherdb')
+        self.assertRaises(TypeError, setattr, mydoc, 'collection', 'othercol')
+
+    def test_slotted_document(self):
+        class MyDoc(Document):
+            use_slots = True
+        class MySubDoc(MyDoc):
+            skeleton = {
+                "foo":int,
+            }
+        self.connection.register([MyDoc, MySubDoc])
+        for doc in [self.col.MyDoc(), self.col.MySubDoc(), MySubDoc()]:
+            self.assertFalse(hasattr(doc, '__dict__'))
+            self.assertRaises(AttributeError, setattr, doc, 'bar', 1)
+        mydoc = self.col.MySubDoc()
+        self.assertEqual(mydoc, {'foo':None})
+        self.assertEqual(mydoc.collection, self.col)
+        self.assertEqual(mydoc.db, self.col.database)
+        self.assertEqual(self.col.MyDoc().skeleton, {})
+        mydoc['foo'] = 3
+        mydoc.save()
+        self.assertEqual(self.col.MySubDoc.find_one(), {'_id':mydoc['_id'], 'foo':3})
+
+    def test_deepcopy(self):
+        from copy import deepcopy
+        class MyDoc(Document):
+            skeleton = {
+                "foo":int,
+                "bar":{"spam":[unicode]},
+                "_id":ObjectId,
+            }
+        self.connection.register([MyDoc])
+        mydoc = self.col.MyDoc()
+        mydoc['_id'] = ObjectId()
+        mydoc['bar']['spam'].append(u'egg')
+        mydoc['foo'] = 3
+        copied = deepcopy(mydoc)
+        self.assertEqual(copied, mydoc)
+        self.assertTrue(isinstance(copied, MyDoc))
+        self.assertEqual(copied.collection, self.col)
+        self.assertTrue(copied['_id'] is mydoc['_id'])
+        self.assertFalse(copied['bar'] is mydoc['bar'])
+        self.assertFalse(copied['bar']['spam'] is mydoc['bar']['spam'])
+        copied['bar']['spam'].append(u'spam')
+        copied['bar']['foo'] = 1
+        self.assertEqual(mydoc['bar'], {'spam':[u'egg']})
+        self.assertEqual(deepcopy(MyDoc()), MyDoc())
+
     def test_delete(self):
         class MyDoc(Document):
             skeleton = {
@@ -166,8 +260,6 @@ class ApiTestCase(unittest.TestCase):
         # using limit/count
         assert self.col.MyDoc.find().count() == 10, self.col.MyDoc.find().count()
         assert self.col.MyDoc.find().limit(1).count() == 10, self.col.MyDoc.find().limit(1).count()
-        assert self.col.MyDoc.find().where('this.foo').count() == 9 #{'foo':0} is not taken
-        assert self.col.MyDoc.find().where('this.bar.bla').count() == 9 #{'foo':0} is not taken
         assert self.col.MyDoc.find().hint([('foo', 1)])
         assert [i['foo'] for i in self.col.MyDoc.find().sort('foo', -1)] == [9,8,7,6,5,4,3,2,1,0]
         allPlans = self.col.MyDoc.find().explain()['allPlans']
@@ -231,6 +323,23 @@ class ApiTestCase(unittest.TestCase):
         self.assertEqual(new_doc['title'], 'coucou')
         self.assertEqual(isinstance(doc, DocA), True)
 
+    def test_find_where(self):
+        if isinstance(self.connection, MemoryConnection):
+            self.skipTest('$where needs a javascript engine')
+        class MyDoc(Document):
+            skeleton = {
+                "foo":int,
+                "bar":{"bla":int},
+            }
+        self.connection.register([MyDoc])
+        for i in range(10):
+            mydoc = self.col.MyDoc()
+            mydoc["foo"] = i
+            mydoc["bar"]['bla'] = i
+            mydoc.save()
+        assert self.col.MyDoc.find().where('this.foo').count() == 9 #{'foo':0} is not taken
+        assert self.col.MyDoc.find().where('this.bar.bla').count() == 9 #{'foo':0} is not taken
+
     def test_find_random(self):
         class MyDoc(Document):
             skeleton = {
@@ -334,6 +443,45 @@ class ApiTestCase(unittest.TestCase):
         assert len(sects) == 2
         assert any(sects)
 
+    def test_bound_document(self):
+        @self.connection.register
+        class Section(Document):
+            __database__ = 'test'
+            __collection__ = 'section'
+            skeleton = {"section":int}
+
+        BoundSection = self.connection.document(Section)
+        assert BoundSection is self.connection.document(Section)
+        assert BoundSection is self.connection.test.section.Section
+        assert BoundSection is self.connection.Section
+        s = BoundSection()
+        s['section'] = 1
+        s.save()
+        assert s.collection.name == 'section' and s.db.name == 'test'
+
+        other = self.connection.document(Section, 'othertest', 'other_section')
+        assert other.collection.name == 'other_section'
+        assert other.db.name == 'othertest'
+        assert other.find().count() == 0
+        assert BoundSection.find().count() == 1
+
+    def test_bound_document_reregister(self):
+        class Section(Document):
+            skeleton = {"section":int}
+        self.assertRaises(TypeError, self.connection.document, Section, 'test', 'section')
+        self.connection.register([Section])
+        self.assertRaises(AttributeError, self.connection.document, Section)
+        old = self.connection.document(Section, 'test', 'section')
+        assert old is self.connection.test.section.Section
+
+        class Section(Document):
+            skeleton = {"other":int}
+        self.connection.register([Section])
+        new = self.connection.document(Section, 'test', 'section')
+        assert new is not old
+        assert new is self.connection.test.section.Section
+        assert new() == {'other':None}
+
     def test_get_collection_with_connection(self):
         class Section(Document):
             skeleton = {"section":int}
@@ -816,3 +964,34 @@ class ApiTestCase(unittest.TestCase):
         assert col.MyDoc.find()._Cursor__read_preference == ReadPreference.SECONDARY_PREFERRED
         assert col.MyDoc.find()._Cursor__secondary_acceptable_latency_ms == 16
         con.close()
+
+    def test_document_read_preference(self):
+        class MyDoc(Document):
+            __read_preference__ = ReadPreference.SECONDARY_PREFERRED
+            __tag_sets__ = [{'dc': 'ny'}, {}]
+            structure = {
+                "foo":int,
+            }
+        class OtherDoc(Document):
+            structure = {
+                "foo":int,
+            }
+        con = Connection(secondary_acceptable_latency_ms=16)
+        con.register([MyDoc, OtherDoc])
+        col = con['test']['mongokit']
+        cursor = col.MyDoc.find()
+        assert cursor._Cursor__read_preference == ReadPreference.SECONDARY_PREFERRED
+        assert cursor._Cursor__tag_sets == [{'dc': 'ny'}, {}]
+        assert cursor._Cursor__secondary_acceptable_latency_ms == 16
+        assert col.OtherDoc.find()._Cursor__read_preference == ReadPreference.PRIMARY
+        assert col.find()._Cursor__read_preference == ReadPreference.PRIMARY
+        # the arguments of find() have the priority
+        cursor = col.MyDoc.find(read_preference=ReadPreference.PRIMARY)
+        assert cursor._Cursor__read_preference == ReadPreference.PRIMARY
+        # the cached options follow the options of the collection
+        col.secondary_acceptable_latency_ms = 20
+        col.read_preference = ReadPreference.SECONDARY
+        assert col.MyDoc.find()._Cursor__secondary_acceptable_latency_ms == 20
+        assert col.MyDoc.find()._Cursor__read_preference == ReadPreference.SECONDARY_PREFERRED
+        assert col.OtherDoc.find()._Cursor__read_preference == ReadPreference.SECONDARY
+        con.close()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+import bson
+
+from mongolite import Connection, Document
+from mongolite.cursor import get_cursor_stats, reset_cursor_stats
+from wire_server import WireServer
+
+class CursorStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.documents = [{'_id': i, 'title': u'foo %s' % i} for i in range(3)]
+        self.server = WireServer(self.documents)
+        self.server.cursor_id = 42
+        self.server.more_documents = [{'_id': 3, 'title': u'bar'}]
+        self.connection = Connection(self.server.host, self.server.port)
+        @self.connection.register
+        class BlogPost(Document):
+            __database__ = 'test'
+            __collection__ = 'mongolite'
+            skeleton = {'title': unicode}
+        @self.connection.register
+        class ProfiledPost(Document):
+            __database__ = 'test'
+            __collection__ = 'mongolite'
+            __profile_cursors__ = True
+            skeleton = {'title': unicode}
+        reset_cursor_stats()
+
+    def tearDown(self):
+        reset_cursor_stats()
+        self.connection.disconnect()
+        self.server.stop()
+
+    def test_not_profiled(self):
+        cursor = self.connection.BlogPost.find()
+        assert len(list(cursor)) == 4
+        assert cursor.stats is None
+        assert get_cursor_stats() == {}
+
+    def test_profile(self):
+        self.server.delay = 0.02
+        cursor = self.connection.BlogPost.find().profile()
+        docs = list(cursor)
+        assert len(docs) == 4
+        stats = cursor.stats
+        assert stats.batches == 2 and stats.documents == 4, stats.as_dict()
+        size = sum(len(bson.BSON.encode(doc)) for doc in self.documents + self.server.more_documents)
+        assert stats.bytes == size, (stats.bytes, size)
+        assert stats.avg_document_size == size / 4.0
+        assert stats.wire_seconds >= 0.02, stats
+        assert 0 < stats.decode_seconds < stats.wire_seconds, stats
+        assert 0 < stats.wrap_seconds < stats.wire_seconds, stats
+        aggregated = get_cursor_stats()
+        assert aggregated.keys() == ['BlogPost'], aggregated
+        assert aggregated['BlogPost']['documents'] == 4
+        assert aggregated['BlogPost']['cursors'] == 1
+        # exhausting the cursor again doesn't count twice
+        self.assertRaises(StopIteration, cursor.next)
+        assert get_cursor_stats()['BlogPost']['documents'] == 4
+
+    def test_profile_document_class(self):
+        for i in range(2):
+            cursor = self.connection.ProfiledPost.find()
+            assert isinstance(cursor.next(), self.connection.ProfiledPost._obj_class)
+            assert cursor.stats.documents == 3
+            cursor.close()
+        assert self.connection.ProfiledPost.find_one()['title'] == u'foo 0'
+        stats = get_cursor_stats()['ProfiledPost']
+        assert stats['cursors'] == 3, stats
+        assert stats['documents'] == 9, stats
+        assert stats['batches'] == 3, stats
+        # profiling isn't a read option
+        collection = self.connection.test.mongolite
+        document_class = self.connection.ProfiledPost._obj_class
+        assert 'profile' not in collection.get_read_options(document_class)
+        assert self.connection.ProfiledPost.find(profile=False).stats is None
+
+    def test_profile_argument(self):
+        cursor = self.connection.test.mongolite.find(profile=True)
+        assert len(list(cursor)) == 4
+        assert cursor.stats.documents == 4
+        assert get_cursor_stats()[None]['documents'] == 4
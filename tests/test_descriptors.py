@@ -185,6 +185,53 @@ class DescriptorsTestCase(unittest.TestCase):
         mydoc = MyDoc()
         assert mydoc["foo"] == [42,3]
 
+    def test_default_values_not_shared(self):
+        calls = []
+        def get_truth():
+            calls.append(1)
+            return 42
+        class MyDoc(Document):
+            skeleton = {
+                "foo":int,
+                "bar":{"spam":[int], "eggs":{unicode:int}},
+                "bla":dict,
+            }
+            default_values = {"foo":get_truth, "bar.spam":[get_truth, 3],
+              "bar.eggs":{u"a":1}, "bla":{"b":[1]}}
+        mydoc = MyDoc()
+        self.assertEqual(mydoc, {"foo":42, "bar":{"spam":[42, 3], "eggs":{u"a":1}},
+          "bla":{"b":[1]}})
+        self.assertEqual(len(calls), 2)
+        mydoc["bar"]["spam"].append(1)
+        mydoc["bar"]["eggs"]["c"] = 2
+        mydoc["bla"]["b"].append(2)
+        self.assertEqual(MyDoc(), {"foo":42, "bar":{"spam":[42, 3], "eggs":{u"a":1}},
+          "bla":{"b":[1]}})
+        self.assertEqual(MyDoc.default_values["bla"], {"b":[1]})
+        self.assertEqual(len(calls), 4)
+
+    def test_default_values_reassigned(self):
+        class MyDoc(Document):
+            skeleton = {"foo":int, "bar":{"spam":unicode}}
+            default_values = {"foo":1}
+        class SubDoc(MyDoc):
+            skeleton = {"eggs":[int]}
+            default_values = {"eggs":[2]}
+        class OtherDoc(MyDoc):
+            pass
+        # the plan is compiled at class creation
+        self.assertTrue('_default_values_plan' in vars(MyDoc))
+        self.assertEqual(MyDoc(), {"foo":1, "bar":{"spam":None}})
+        self.assertEqual(SubDoc(), {"foo":1, "bar":{"spam":None}, "eggs":[2]})
+        MyDoc.default_values = {"foo":3, "bar.spam":u"egg"}
+        self.assertEqual(MyDoc(), {"foo":3, "bar":{"spam":u"egg"}})
+        # the subclasses keep the merged default values they were created with
+        self.assertEqual(SubDoc(), {"foo":1, "bar":{"spam":None}, "eggs":[2]})
+        self.assertEqual(OtherDoc(), {"foo":1, "bar":{"spam":None}})
+        MyDoc.skeleton = {"foo":int, "bar":{"spam":unicode}, "new":int}
+        MyDoc.default_values = {"new":4}
+        self.assertEqual(MyDoc(), {"foo":None, "bar":{"spam":None}, "new":4})
+
     def test_default_list_nested_values(self):
         class MyDoc(Document):
             skeleton = {
@@ -122,3 +122,133 @@ class GridFSTestCase(unittest.TestCase):
         doc.fs.delete(new_id)
         self.assertEqual(doc.fs.get_last_version('source').read(), 'Hello World')
          
+
+    def test_shared_lazy_gridfs(self):
+        @self.connection.register
+        class Doc(Document):
+            use_gridfs = True
+            skeleton = {
+                'title':unicode,
+            }
+        doc = self.col.Doc()
+        self.assertFalse('fs' in doc.__dict__)
+        self.assertTrue(doc.fs is self.col.Doc().fs)
+        self.assertTrue('fs' in doc.__dict__)
+        self.assertTrue(doc.fs is self.col.database.get_gridfs('mongolitefs'))
+        doc.save()
+        doc.fs.put("Hello World", filename="source")
+        for doc in self.col.Doc.find():
+            self.assertFalse('fs' in doc.__dict__)
+            self.assertEqual(doc.fs.get_last_version("source").read(), "Hello World")
+
+        other = self.connection.test.othercol.Doc()
+        self.assertEqual(other.fs._GridFS__collection.name, 'othercolfs')
+        self.assertFalse(other.fs is doc.fs)
+
+    def test_gridfs_not_used(self):
+        @self.connection.register
+        class Doc(Document):
+            skeleton = {
+                'title':unicode,
+            }
+        self.assertEqual(Doc().fs, None)
+        self.assertFalse(hasattr(self.col.Doc(), 'fs'))
+
+    def test_put_stream_and_open(self):
+        @self.connection.register
+        class Doc(Document):
+            use_gridfs = True
+            skeleton = {
+                'title':unicode,
+            }
+        doc = self.col.Doc()
+        doc['title'] = u'Hello'
+        doc.save()
+
+        from StringIO import StringIO
+        data = ''.join(chr(i % 256) for i in xrange(10000))
+        file_id = doc.fs.put_stream('video', StringIO(data), chunkSize=1024, doc_id=doc['_id'])
+        self.assertEqual(doc.fs.get(file_id).read(), data)
+        self.assertEqual(doc.fs._GridFS__collection.chunks.find({'files_id':file_id}).count(), 10)
+
+        f = doc.fs.open('video', doc_id=doc['_id'])
+        self.assertEqual(f._id, file_id)
+        self.assertEqual(f.name, 'video')
+        self.assertEqual(f.length, 10000)
+        self.assertEqual(f.read_range(1000, 3000), data[1000:3000])
+        self.assertEqual(f.tell(), 3000)
+        self.assertEqual(f.read(10), data[3000:3010])
+        f.seek(-100, 2)
+        self.assertEqual(f.read(), data[-100:])
+        self.assertEqual(f.read(), '')
+        f.seek(0)
+        self.assertEqual(''.join(f), data)
+
+        f = doc.fs.open('video', read_ahead=0)
+        f.seek(5000)
+        self.assertEqual(f.read(1), data[5000])
+        self.assertEqual(f._window.keys(), [4])
+        f = doc.fs.open('video', read_ahead=3)
+        f.seek(5000)
+        self.assertEqual(f.read(1), data[5000])
+        self.assertEqual(sorted(f._window.keys()), [4, 5, 6, 7])
+
+        from gridfs import NoFile
+        self.assertRaises(NoFile, doc.fs.open, 'unknown')
+
+    def test_gridfs_disk_cache(self):
+        import shutil
+        import tempfile
+        from mongolite import GridFSCache
+        path = tempfile.mkdtemp()
+        try:
+            cache = GridFSCache(path, max_size=25)
+
+            @self.connection.register
+            class Doc(Document):
+                use_gridfs = True
+                __gridfs_cache__ = cache
+                skeleton = {
+                    'title':unicode,
+                }
+            doc = self.col.Doc()
+            self.assertTrue(doc.fs.cache is cache)
+            id1 = doc.fs.put("Hello World", filename="hello")
+            id2 = doc.fs.put("Bye World", filename="bye")
+
+            f = doc.fs.get_cached(id1)
+            self.assertEqual(f.read(), "Hello World")
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+            f = doc.fs.open_cached("hello")
+            self.assertEqual(f.read_range(6, 11), "World")
+            self.assertEqual(f.name, "hello")
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            self.assertEqual(cache.size, 11)
+
+            self.assertEqual(doc.fs.open_cached("bye").read(), "Bye World")
+            self.assertEqual(cache.size, 20)
+            # a new version of the file is downloaded again
+            id3 = doc.fs.put("Hello World again", filename="hello")
+            self.assertEqual(doc.fs.open_cached("hello").read(), "Hello World again")
+            self.assertEqual((cache.hits, cache.misses), (1, 3))
+            # LRU eviction
+            self.assertEqual(cache.size, 17)
+            self.assertEqual(len(cache._entries), 1)
+            self.assertEqual(doc.fs.get_cached(id2).read(), "Bye World")
+            self.assertEqual(cache.size, 9)
+
+            # files bigger than the cache are not cached
+            big_id = doc.fs.put("x" * 30, filename="big")
+            self.assertEqual(doc.fs.get_cached(big_id).read(), "x" * 30)
+            self.assertEqual(cache.size, 9)
+
+            # files without version are not cached
+            doc.fs._root_collection.files.update({'_id':id2}, {'$unset':{'md5':1, 'uploadDate':1}})
+            self.assertEqual(doc.fs.get_cached(id2).read(), "Bye World")
+            self.assertEqual(doc.fs.get_cached(id2).read(), "Bye World")
+            self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+            # the cache index is rebuilt from the disk
+            self.assertEqual(GridFSCache(path, max_size=25).size, 9)
+        finally:
+            shutil.rmtree(path)
@@ -27,7 +27,14 @@
 
 import unittest
 
-from mongolite.helpers import DotExpandedDict, DotCollapsedDict, EvalException
+from mongolite.helpers import DotExpandedDict, DotCollapsedDict, EvalException,\
+    register_type_name, totimestamp, fromtimestamp, totimestamps, fromtimestamps
+import array
+import datetime
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class HelpersTestCase(unittest.TestCase):
         
@@ -50,6 +57,23 @@ class HelpersTestCase(unittest.TestCase):
         # Gotcha: Results are unpredictable if the dots are "uneven": 
         assert DotExpandedDict({'c.1': 2, 'c.2': 3, 'c': 1}) == {'c': 1} 
 
+    def test_DotExpandedDict_type_names(self):
+        # the $type segments are not evaluated
+        self.assertRaises(EvalException, DotExpandedDict, {'foo.$__import__': 1})
+        d = DotExpandedDict({'foo.$datetime': 1})
+        assert d == {'foo': {datetime.datetime: 1}}, d
+        class Custom(object):pass
+        self.assertRaises(EvalException, DotExpandedDict, {'foo.$Custom': 1})
+        register_type_name(Custom)
+        d = DotExpandedDict({'foo.$Custom': 1})
+        assert d == {'foo': {Custom: 1}}, d
+
+    def test_dotted_dicts_round_trip(self):
+        dic = {'a':{'b':{'c':{'d':{'e':1}}, 'f':[1]}, u'g':{}}, 'h':{unicode:{'i':2}}}
+        assert DotExpandedDict(DotCollapsedDict(dic)) == dic
+        d = DotExpandedDict({u'a.b': 1, 'a.c': 2})
+        assert [type(k) for k in sorted(d['a'])] == [unicode, str], d
+
     def test_DotCollapsedDict(self):
         dic = {'foo':{}}
         d = DotCollapsedDict(dic)
@@ -130,3 +154,49 @@ class HelpersTestCase(unittest.TestCase):
         dic = {'bla':{'foo':{unicode:['egg']}, 'bar':"egg"}}
         d = DotCollapsedDict(dic)
         assert d == {'bla.foo.$unicode': ['egg'], 'bla.bar': 'egg'}, d
+
+    def test_timestamps_round_trip(self):
+        dates = [
+          datetime.datetime(1970, 1, 1),
+          datetime.datetime(2012, 2, 29, 23, 59, 59, 999000),
+          datetime.datetime(1969, 12, 31, 23, 59, 59, 1000),
+          datetime.datetime(1800, 7, 14, 12, 30, 0, 123000),
+          datetime.datetime(9999, 12, 31, 23, 59, 59, 999000),
+        ]
+        millis = totimestamps(dates)
+        assert millis == [0, 1330559999999, -999, -5347855799877, 253402300799999], millis
+        assert fromtimestamps(millis) == dates
+        assert [totimestamp(date) for date in dates] == millis
+        assert [fromtimestamp(epoch_date) for epoch_date in millis] == dates
+        # sub-millisecond precision is truncated
+        assert totimestamps([datetime.datetime(2012, 1, 1, 0, 0, 0, 1999)]) == [1325376000001]
+        assert totimestamps([datetime.datetime(1969, 12, 31, 23, 59, 59, 999999)]) == [-1]
+        assert fromtimestamps(array.array('l', millis)) == dates
+        assert fromtimestamps(array.array('d', [1.5])) == [datetime.datetime(1970, 1, 1, 0, 0, 0, 1500)]
+        assert fromtimestamp("1350000000000") == datetime.datetime(2012, 10, 12, 0, 0)
+        assert fromtimestamps([u"-999", "1.5"]) == [dates[2], datetime.datetime(1970, 1, 1, 0, 0, 0, 1500)]
+
+    def test_timestamps_timezone_aware(self):
+        from bson.tz_util import FixedOffset
+        date = datetime.datetime(2012, 1, 1, 12, tzinfo=FixedOffset(120, 'UTC+2'))
+        assert totimestamp(date) == totimestamp(datetime.datetime(2012, 1, 1, 10))
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_timestamps_numpy(self):
+        dates = [datetime.datetime(1800, 7, 14, 12, 30, 0, 123000),
+          datetime.datetime(2012, 2, 29, 23, 59, 59, 999999)]
+        millis = totimestamps(numpy.array(dates, dtype=object))
+        assert millis.dtype == numpy.int64
+        assert millis.tolist() == [-5347855799877, 1330559999999], millis
+        assert totimestamps(numpy.array(dates, dtype='datetime64[us]')).tolist() == millis.tolist()
+        result = fromtimestamps(millis)
+        assert result.dtype == numpy.dtype('datetime64[ms]')
+        assert result.tolist() == fromtimestamps(millis.tolist())
+        assert fromtimestamps(numpy.array([1.5, -0.25])).tolist() == [
+          datetime.datetime(1970, 1, 1, 0, 0, 0, 1500),
+          datetime.datetime(1969, 12, 31, 23, 59, 59, 999750)]
+
+    def test_numpy_is_not_imported(self):
+        import subprocess, sys
+        code = "import sys, mongolite; sys.exit('numpy' in sys.modules)"
+        assert subprocess.call([sys.executable, '-c', code]) == 0
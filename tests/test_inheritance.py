@@ -104,6 +104,7 @@ class InheritanceTestCase(unittest.TestCase):
         optfoo : <type 'int'>
     }
 """)
+        self.assertEqual(B().__doc__, B.__doc__)
  
     def test_default_values_inheritance(self):
         class A(SchemaDocument):
@@ -27,7 +27,7 @@
 
 import unittest
 
-from mongolite import Document, Connection
+from mongolite import Document, Connection, ObjectId, ConnectionError
 from mongolite.helpers import json_util_default, json_util_object_hook
 import json
 import datetime
@@ -102,3 +102,90 @@ class JsonTestCase(unittest.TestCase):
         self.assertEqual(json_doc, '{"foo": "bla", "_id": {"$oid": "%s"}}' % mydoc['_id'])
         doc = json.loads(json_doc, object_hook=json_util_object_hook)
         self.assertEqual(doc, {u'foo': u'bla', u'_id': mydoc['_id']})
+
+    def test_document_to_json(self):
+        @self.connection.register
+        class MyDoc(Document):
+            skeleton = {
+                "bla":{
+                    "foo":unicode,
+                    "egg":datetime.datetime,
+                },
+                "spam":[],
+                "ref":ObjectId,
+            }
+        mydoc = self.col.MyDoc()
+        mydoc['_id'] = ObjectId()
+        mydoc['bla']['foo'] = u'bar'
+        mydoc['bla']['egg'] = datetime.datetime(2010, 1, 1, 10, 30, 12, 123456)
+        mydoc['spam'] = [datetime.datetime(1960, 1, 1), ObjectId(), 3]
+        # the keys may come in another order
+        self.assertEqual(json.loads(mydoc.to_json()),
+          json.loads(json.dumps(mydoc, default=json_util_default)))
+        newdoc = self.col.MyDoc.from_json(mydoc.to_json())
+        self.assertTrue(isinstance(newdoc, MyDoc))
+        self.assertEqual(newdoc.collection, self.col)
+        self.assertEqual(newdoc, json.loads(mydoc.to_json(), object_hook=json_util_object_hook))
+        self.assertEqual(newdoc['_id'], mydoc['_id'])
+        self.assertEqual(newdoc['spam'][1], mydoc['spam'][1])
+        # from the class and from an instance
+        unbound = MyDoc.from_json(mydoc.to_json())
+        self.assertTrue(type(unbound) is MyDoc)
+        self.assertEqual(unbound, newdoc)
+        self.assertRaises(ConnectionError, getattr, unbound, 'collection')
+        self.assertEqual(MyDoc.from_json(mydoc.to_json(), collection=self.col).collection, self.col)
+        self.assertEqual(mydoc.from_json(mydoc.to_json()).collection, self.col)
+
+    def test_json_plan(self):
+        @self.connection.register
+        class MyDoc(Document):
+            skeleton = {
+                "date":datetime.datetime,
+                "ref":ObjectId,
+                "name":unicode,
+                "hits":[{"date":datetime.datetime, "count":int}],
+                "meta":dict,
+            }
+        mydoc = self.col.MyDoc()
+        mydoc['_id'] = ObjectId()
+        mydoc['date'] = datetime.datetime(2010, 1, 1)
+        mydoc['ref'] = u'not an ObjectId'
+        mydoc['name'] = u'{"$oid": "4f0000000000000000000000"}'
+        mydoc['hits'] = [{'date':datetime.datetime(2011, 1, 1), 'count':1}, None]
+        mydoc['meta'] = {'ref':ObjectId()}
+        mydoc['extra'] = {'date':datetime.datetime(2012, 1, 1)}
+        json_doc = mydoc.to_json()
+        # the plan is compiled once per class
+        self.assertTrue(isinstance(vars(MyDoc)['_json_plan'], tuple))
+        self.assertEqual(json.loads(json_doc), json.loads(json.dumps(mydoc, default=json_util_default)))
+        # the document is not modified
+        self.assertEqual(mydoc['hits'][0]['date'], datetime.datetime(2011, 1, 1))
+        newdoc = self.col.MyDoc.from_json(json_doc)
+        self.assertEqual(newdoc, json.loads(json_doc, object_hook=json_util_object_hook))
+        self.assertEqual(newdoc['meta']['ref'], mydoc['meta']['ref'])
+        self.assertEqual(newdoc['extra']['date'].replace(tzinfo=None), datetime.datetime(2012, 1, 1))
+        self.assertEqual(newdoc['name'], mydoc['name'])
+        self.assertEqual(newdoc['ref'], u'not an ObjectId')
+        # undeclared keys in the declared dicts
+        newdoc = self.col.MyDoc.from_json('{"hits": [{"count": 1, "ref": {"$oid": "%s"}}]}' % mydoc['_id'])
+        self.assertEqual(newdoc['hits'][0]['ref'], mydoc['_id'])
+
+    def test_cursor_iter_json(self):
+        @self.connection.register
+        class MyDoc(Document):
+            skeleton = {
+                "foo":int,
+                "date":datetime.datetime,
+            }
+        for i in range(50):
+            mydoc = self.col.MyDoc()
+            mydoc['foo'] = i
+            mydoc['date'] = datetime.datetime(2010, 1, 1)
+            mydoc.save()
+        chunks = list(self.col.MyDoc.find().sort('foo', 1).iter_json(chunk_size=100))
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(all(isinstance(chunk, str) for chunk in chunks))
+        docs = json.loads(''.join(chunks), object_hook=json_util_object_hook)
+        self.assertEqual([doc['foo'] for doc in docs], range(50))
+        self.assertEqual(docs[0]['date'], datetime.datetime(2010, 1, 1, tzinfo=docs[0]['date'].tzinfo))
+        self.assertEqual(list(self.col.MyDoc.find({'foo':100}).iter_json()), ['[]'])
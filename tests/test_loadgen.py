@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+import unittest
+
+from mongolite import Connection, Document, ObjectId
+from mongolite.loadgen import DocumentFactory, LoadGenerator, OperationStats, parse_mix
+from wire_server import WireServer
+
+class Author(Document):
+    skeleton = {'name': unicode}
+
+class BlogPost(Document):
+    __database__ = 'test'
+    __collection__ = 'mongolite'
+    skeleton = {
+        '_type': unicode,
+        'title': unicode,
+        'rank': int,
+        'created_at': datetime.datetime,
+        'author': {'name': unicode, 'id': ObjectId},
+        'tags': [unicode],
+        'stats': {unicode: int},
+        'location': (float, float),
+        'editor': Author,
+    }
+    optional = {
+        'extra': {'scores': [float]},
+    }
+    indexes = [{'fields': [('title', 1), ('rank', -1)]}]
+
+class DocumentFactoryTestCase(unittest.TestCase):
+
+    def test_make(self):
+        factory = DocumentFactory(BlogPost, seed=1)
+        for i in range(20):
+            doc = factory.make()
+            assert '_id' not in doc
+            assert doc['_type'] == u'BlogPost'
+            assert isinstance(doc['title'], unicode) and doc['title']
+            assert isinstance(doc['rank'], int)
+            assert doc['created_at'].microsecond % 1000 == 0
+            assert isinstance(doc['author']['name'], unicode)
+            assert isinstance(doc['author']['id'], ObjectId)
+            assert all(isinstance(tag, unicode) for tag in doc['tags'])
+            assert len(doc['tags']) <= 5
+            assert doc['stats'] and all(isinstance(key, unicode) and isinstance(value, int)
+              for key, value in doc['stats'].iteritems())
+            assert [type(value) for value in doc['location']] == [float, float]
+            assert isinstance(doc['editor']['name'], unicode)
+            if 'extra' in doc:
+                assert all(isinstance(score, float) for score in doc['extra']['scores'])
+
+    def test_optional_ratio(self):
+        assert 'extra' in DocumentFactory(BlogPost, optional_ratio=1).make()
+        assert 'extra' not in DocumentFactory(BlogPost, optional_ratio=0).make()
+
+    def test_optional_merged(self):
+        class Post(Document):
+            skeleton = {'author': {'name': unicode, 'meta': {'rank': int}}}
+            optional = {'author': {'email': unicode, 'meta': {'age': int}}}
+        doc = DocumentFactory(Post, optional_ratio=1).make()
+        assert set(doc['author']) == set(['name', 'email', 'meta']), doc
+        assert set(doc['author']['meta']) == set(['rank', 'age']), doc
+
+    def test_seed(self):
+        docs = [DocumentFactory(BlogPost, seed=3).make() for i in range(2)]
+        for doc in docs:
+            del doc['author']['id']
+        assert docs[0] == docs[1]
+
+    def test_make_update(self):
+        factory = DocumentFactory(BlogPost)
+        paths = set(path for path, struct in factory.leaves)
+        assert paths == set(['title', 'rank', 'created_at', 'author.name', 'author.id',
+          'tags', 'stats', 'location', 'editor', 'extra.scores']), paths
+        update = factory.make_update()
+        assert update.keys() == ['$set'] and update['$set'].keys()[0] in paths
+
+class LoadGeneratorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = WireServer([{'_id': 1, 'title': u'foo'}])
+        self.connection = Connection(self.server.host, self.server.port, w=1)
+        self.connection.register([BlogPost])
+
+    def tearDown(self):
+        self.connection.disconnect()
+        self.server.stop()
+
+    def test_run(self):
+        generator = LoadGenerator([self.connection.BlogPost], prefill=5, duration=0.2,
+          concurrency=2, seed=1)
+        report = generator.run()
+        data = report.as_dict()
+        assert set(data['operations']) == set(['insert', 'find', 'update', 'delete'])
+        assert data['count'] == sum(stats['count'] for stats in data['operations'].values())
+        assert data['operations']['find']['count'] > 0, data
+        assert all(stats['errors'] == 0 for stats in data['operations'].values()), data
+        assert self.server.queries >= data['operations']['find']['count']
+        assert 'total' in report.format()
+
+    def test_bounded_ids(self):
+        generator = LoadGenerator([self.connection.BlogPost], seed=1)
+        target = generator.targets[0]
+        target.max_ids = 10
+        for i in range(1000):
+            target.add({'_id': i})
+        assert len(target.ids) == 10 and target.added == 1000
+        # a sample of all the ids, not the first ones
+        assert max(target.ids) >= 10, target.ids
+        assert target.pop_id() in range(1000) and len(target.ids) == 9
+
+    def test_rate(self):
+        generator = LoadGenerator([self.connection.BlogPost], mix={'find': 1}, rate=100,
+          duration=0.3, prefill=1)
+        report = generator.run()
+        assert report.operations.keys() == ['find']
+        assert 25 <= report.operations['find'].count <= 31, report.as_dict()
+
+    def test_errors(self):
+        generator = LoadGenerator([self.connection.BlogPost], mix={'insert': 1}, duration=0.1,
+          prefill=0, concurrency=1)
+        self.server.fail = True
+        report = generator.run()
+        stats = report.operations['insert']
+        assert stats.count and stats.errors == stats.count
+
+    def test_latency_from_schedule(self):
+        # the server answers in 50ms but the finds are scheduled every 10ms:
+        # the waiting time of the late operations is part of their latency
+        self.server.delay = 0.05
+        generator = LoadGenerator([self.connection.BlogPost], mix={'find': 1}, rate=100,
+          duration=0.1, prefill=1, concurrency=1)
+        report = generator.run()
+        stats = report.operations['find']
+        assert stats.count == 10, report.as_dict()
+        assert stats.max > 0.3 and stats.percentile(50) > 0.15, report.as_dict()
+
+    def test_skipped(self):
+        generator = LoadGenerator([self.connection.BlogPost], prefill=0)
+        target = generator.targets[0]
+        assert generator.update(target) is False
+        assert generator.delete(target) is False
+        assert self.server.writes == 0
+
+    def test_no_prefill(self):
+        generator = LoadGenerator([self.connection.BlogPost], mix={'delete': 1}, duration=0.1,
+          prefill=0, concurrency=1)
+        report = generator.run()
+        # every insert is followed by the delete of its document
+        inserts, deletes = report.operations['insert'].count, report.operations['delete'].count
+        assert inserts and deletes in (inserts, inserts - 1), report.as_dict()
+
+class HelpersTestCase(unittest.TestCase):
+
+    def test_parse_mix(self):
+        assert parse_mix('insert=1,find=4.5') == {'insert': 1, 'find': 4.5}
+        assert parse_mix('find') == {'find': 1}
+        self.assertRaises(ValueError, parse_mix, 'foo=1')
+        self.assertRaises(ValueError, parse_mix, 'find=x')
+        self.assertRaises(ValueError, parse_mix, 'find=0')
+
+    def test_percentile(self):
+        stats = OperationStats()
+        assert stats.percentile(50) is None
+        for i in range(100, 0, -1):
+            stats.record(i / 1000.0)
+        stats.record(0.2, error=True)
+        assert (stats.count, stats.errors, stats.max) == (101, 1, 0.2)
+        def near(value, expected):
+            return expected <= value <= expected * (1 + stats.precision)
+        assert near(stats.percentile(50), 0.051), stats.percentile(50)
+        assert near(stats.percentile(99), 0.1), stats.percentile(99)
+        assert stats.percentile(100) == 0.2
+        # the histogram doesn't grow with the number of latencies
+        buckets = len(stats.buckets)
+        for i in range(10000):
+            stats.record(0.05)
+        assert len(stats.buckets) == buckets
+
+
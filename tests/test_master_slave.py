@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+import threading
+import time
+
+from bson.timestamp import Timestamp
+
+from mongolite import Document
+from mongolite.master_slave_connection import MasterSlaveConnection
+from wire_server import WireServer
+
+class MasterSlaveRoutingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.master = WireServer([{'_id': 1, 'node': u'master'}])
+        self.slaves = [
+          WireServer([{'_id': 1, 'node': u'fast'}], ismaster=False),
+          WireServer([{'_id': 1, 'node': u'slow'}], delay=0.02, ismaster=False),
+        ]
+        self.connections = []
+
+    def tearDown(self):
+        for connection in self.connections:
+            connection.stop_probing()
+            connection.disconnect()
+        for server in [self.master] + self.slaves:
+            server.stop()
+
+    def connect(self, **kwargs):
+        connection = MasterSlaveConnection(
+          {'host': self.master.host, 'port': self.master.port},
+          [{'host': slave.host, 'port': slave.port, 'socketTimeoutMS': 200}
+            for slave in self.slaves],
+          **kwargs
+        )
+        self.connections.append(connection)
+        return connection
+
+    def test_reads_favor_fastest_slave(self):
+        connection = self.connect()
+        col = connection.test.mongolite
+        for i in range(50):
+            col.find_one()
+        fast, slow = self.slaves
+        assert fast.queries > 2 * slow.queries, (fast.queries, slow.queries)
+        assert self.master.queries == 0
+        stats = connection.get_node_stats()
+        assert [s['role'] for s in stats] == ['master', 'slave', 'slave']
+        assert stats[1]['latency_ms'] < stats[2]['latency_ms'], stats
+        assert stats[1]['requests'] + stats[2]['requests'] == 50
+        assert stats[2]['latency_ms'] >= 20
+
+    def test_documents_are_read_from_slaves(self):
+        connection = self.connect()
+        @connection.register
+        class MyDoc(Document):
+            __database__ = 'test'
+            __collection__ = 'mongolite'
+            skeleton = {'node': unicode}
+        doc = connection.test.mongolite.MyDoc.find_one()
+        assert isinstance(doc, MyDoc)
+        assert doc['node'] in (u'fast', u'slow'), doc
+
+    def test_circuit_breaker(self):
+        connection = self.connect(failure_threshold=2, retry_delay=60)
+        col = connection.test.mongolite
+        fast, slow = self.slaves
+        fast.fail = True
+        for i in range(40):
+            assert col.find_one()['node'] == u'slow'
+        stats = connection.get_node_stats()[1]
+        assert stats['errors'] == 2, stats
+        assert not stats['available']
+        # the slave is back after a successful probe
+        fast.fail = False
+        connection.probe()
+        stats = connection.get_node_stats()[1]
+        assert stats['available'] and stats['consecutive_failures'] == 0, stats
+
+    def test_timeouts_open_the_circuit_breaker(self):
+        connection = self.connect(failure_threshold=1, retry_delay=60)
+        col = connection.test.mongolite
+        fast, slow = self.slaves
+        slow.delay = 1
+        for i in range(20):
+            assert col.find_one()['node'] == u'fast'
+        stats = connection.get_node_stats()[2]
+        assert stats['errors'] <= 1 and slow.queries <= 1, stats
+
+    def test_fallback_to_master(self):
+        connection = self.connect(failure_threshold=1)
+        col = connection.test.mongolite
+        for slave in self.slaves:
+            slave.fail = True
+        assert col.find_one()['node'] == u'master'
+        assert col.find_one()['node'] == u'master'
+        stats = connection.get_node_stats()
+        assert stats[0]['requests'] == 2
+        assert [s['errors'] for s in stats[1:]] == [1, 1]
+
+    def test_probing_thread(self):
+        connection = self.connect(probe_interval=0.01)
+        for i in range(100):
+            if all(s['latency_ms'] is not None for s in connection.get_node_stats()[1:]):
+                break
+            time.sleep(0.01)
+        assert all(s['latency_ms'] is not None for s in connection.get_node_stats()[1:])
+        assert sum(slave.queries for slave in self.slaves) == 0
+
+    def test_probing_is_opt_in(self):
+        def probing_threads():
+            return len([thread for thread in threading.enumerate()
+              if thread.name == 'mongolite-probe'])
+        threads = probing_threads()
+        self.connect()
+        assert probing_threads() == threads
+        connection = self.connect(probe_interval=0.01)
+        assert probing_threads() == threads + 1
+        # disconnect() stops the probing thread
+        connection.disconnect()
+        for i in range(100):
+            if probing_threads() == threads:
+                break
+            time.sleep(0.01)
+        assert probing_threads() == threads
+
+    def test_requests_read_from_master(self):
+        connection = self.connect()
+        col = connection.test.mongolite
+        connection.start_request()
+        assert col.find_one()['node'] == u'master'
+        connection.end_request()
+        assert col.find_one()['node'] in (u'fast', u'slow')
+
+    def test_hedged_read(self):
+        connection = self.connect(hedge_percentile=90, hedge_delay=0.01)
+        col = connection.test.mongolite
+        fast, slow = self.slaves
+        slow.delay = 0.15
+        slow.cursor_id = 42
+        # the slow slave is asked first
+        connection._ordered_slaves = lambda synced_to=None: [1, 0]
+        start = time.time()
+        assert col.find_one()['node'] == u'fast'
+        assert time.time() - start < 0.12
+        for i in range(50):
+            if slow.killed_cursors:
+                break
+            time.sleep(0.01)
+        assert slow.killed_cursors == [42], slow.killed_cursors
+        stats = connection.get_hedge_stats()
+        assert stats['hedged'] == 1 and stats['hedge_wins'] == 1, stats
+        assert stats['cancelled'] == 1, stats
+
+    def test_hedged_reads_use_a_bounded_pool(self):
+        def hedge_threads():
+            return len([thread for thread in threading.enumerate()
+              if thread.name == 'mongolite-hedge'])
+        threads = hedge_threads()
+        connection = self.connect(hedge_percentile=90, hedge_delay=0.005,
+          hedge_threads=2)
+        col = connection.test.mongolite
+        for i in range(20):
+            assert col.find_one()['node'] in (u'fast', u'slow')
+        assert threads < hedge_threads() <= threads + 2
+        connection.disconnect()
+        for i in range(100):
+            if hedge_threads() == threads:
+                break
+            time.sleep(0.01)
+        assert hedge_threads() == threads
+        # without threads, the reads are sent without hedging
+        connection = self.connect(hedge_percentile=90, hedge_delay=0.005,
+          hedge_threads=0)
+        col = connection.test.mongolite
+        for i in range(5):
+            assert col.find_one()['node'] in (u'fast', u'slow')
+        stats = connection.get_hedge_stats()
+        assert stats['reads'] == 5 and stats['hedged'] == 0, stats
+        assert hedge_threads() == threads
+
+    def test_hedged_read_not_fired_for_fast_slave(self):
+        connection = self.connect(hedge_percentile=90, hedge_delay=0.1)
+        col = connection.test.mongolite
+        connection._ordered_slaves = lambda synced_to=None: [0, 1]
+        for i in range(5):
+            assert col.find_one()['node'] == u'fast'
+        stats = connection.get_hedge_stats()
+        assert stats['reads'] == 5 and stats['hedged'] == 0, stats
+        assert self.slaves[1].queries == 0
+
+    def test_hedged_read_with_failing_slave(self):
+        connection = self.connect(hedge_percentile=90, hedge_delay=0.05)
+        col = connection.test.mongolite
+        fast, slow = self.slaves
+        fast.fail = True
+        connection._ordered_slaves = lambda synced_to=None: [0, 1]
+        assert col.find_one()['node'] == u'slow'
+        assert connection.get_hedge_stats()['hedged'] == 0
+
+    def test_hedge_delay_follows_percentile(self):
+        connection = self.connect(hedge_percentile=50, hedge_delay=1)
+        col = connection.test.mongolite
+        connection._ordered_slaves = lambda synced_to=None: [0, 1]
+        for i in range(60):
+            col.find_one()
+        stats = connection.get_hedge_stats()
+        assert 0 < stats['delay_ms'] < 20, stats
+
+    def read_in_thread(self, col):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(col.find_one()))
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def test_read_your_writes_session(self):
+        connection = self.connect(read_your_writes=0.2)
+        @connection.register
+        class MyDoc(Document):
+            __database__ = 'test'
+            __collection__ = 'mongolite'
+            skeleton = {'node': unicode}
+        col = connection.test.mongolite
+        assert col.find_one()['node'] != u'master'
+        doc = col.MyDoc()
+        doc['node'] = u'foo'
+        doc.save()
+        assert col.find_one()['node'] == u'master'
+        # the insert was received before the query on the same socket
+        assert self.master.writes == 1
+        assert col.MyDoc.find_one()['node'] == u'master'
+        assert connection.test.other.find_one()['node'] == u'master'
+        # other sessions read from the slaves
+        assert self.read_in_thread(col)['node'] != u'master'
+        time.sleep(0.25)
+        assert col.find_one()['node'] != u'master'
+
+    def test_read_your_writes_collection(self):
+        connection = self.connect(read_your_writes=0.2, read_your_writes_scope='collection')
+        col = connection.test.mongolite
+        col.insert({'node': u'foo'})
+        assert col.find_one()['node'] == u'master'
+        assert self.read_in_thread(col)['node'] == u'master'
+        assert connection.test.other.find_one()['node'] != u'master'
+        time.sleep(0.25)
+        assert col.find_one()['node'] != u'master'
+
+    def test_read_your_writes_find_and_modify(self):
+        connection = self.connect(read_your_writes=0.2, read_your_writes_scope='collection')
+        col = connection.test.mongolite
+        col.find_and_modify({'node': u'foo'}, {'$set': {'node': u'bar'}})
+        # the command was sent as a query, not as a write
+        assert self.master.writes == 0
+        assert col.find_one()['node'] == u'master'
+        assert connection.test.other.find_one()['node'] != u'master'
+        # the read commands don't open the window
+        connection.test.command('count', 'other')
+        assert connection.test.other.find_one()['node'] != u'master'
+        time.sleep(0.25)
+        assert col.find_one()['node'] != u'master'
+
+    def test_read_your_writes_synced_slaves(self):
+        connection = self.connect(read_your_writes=60)
+        col = connection.test.mongolite
+        fast, slow = self.slaves
+        self.master.last_op = Timestamp(1000, 2)
+        fast.collections['local.sources'] = [{'syncedTo': Timestamp(1000, 2)}]
+        slow.collections['local.sources'] = [{'syncedTo': Timestamp(1000, 1)}]
+        col.insert({'node': u'foo'}, safe=True)
+        # the replication state of the slaves is unknown until probed
+        assert col.find_one()['node'] == u'master'
+        connection.probe()
+        assert [s['synced_to'] for s in connection.get_node_stats()[1:]] == [(1000, 2), (1000, 1)]
+        for i in range(10):
+            assert col.find_one()['node'] == u'fast'
+        col.insert({'node': u'foo'}, safe=True)
+        assert col.find_one()['node'] == u'fast'
+        self.master.last_op = Timestamp(1001, 1)
+        col.insert({'node': u'foo'}, safe=True)
+        assert col.find_one()['node'] == u'master'
+
+    def test_read_your_writes_bad_scope(self):
+        self.assertRaises(ValueError, self.connect, read_your_writes=1,
+          read_your_writes_scope='foo')
+
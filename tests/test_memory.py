@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+import re
+import unittest
+
+import pymongo
+from bson.code import Code
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from mongolite import Document, ObjectId, INDEX_DESCENDING
+from mongolite.memory import MemoryConnection, MemoryStorage, default_storage
+
+class MemoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.connection = MemoryConnection(storage=MemoryStorage())
+        self.col = self.connection['test']['mongolite']
+
+    def tearDown(self):
+        self.connection.drop_database('test')
+
+    def insert(self, *docs):
+        for doc in docs:
+            self.col.insert(doc, safe=True)
+
+    def find(self, spec, **kwargs):
+        return [doc['_id'] for doc in self.col.find(spec, **kwargs)]
+
+    def test_equality(self):
+        self.insert({'_id': 1, 'a': 1, 'b': {'c': u'x'}, 'tags': [u'foo', u'bar']},
+          {'_id': 2, 'a': 1.0, 'b': {'c': u'y'}, 'tags': [u'bar']},
+          {'_id': 3, 'a': True, 'comments': [{'author': u'me'}, {'author': u'you'}]},
+          {'_id': 4, 'a': None})
+        assert self.find({'a': 1}) == [1, 2]
+        assert self.find({'a': True}) == [3]
+        assert self.find({'b.c': u'y'}) == [2]
+        assert self.find({'b': {'c': u'x'}}) == [1]
+        assert self.find({'tags': u'bar'}) == [1, 2]
+        assert self.find({'tags': [u'bar']}) == [2]
+        assert self.find({'tags.0': u'foo'}) == [1]
+        assert self.find({'comments.author': u'you'}) == [3]
+        assert self.find({'a': None}) == [4]
+        assert self.find({'b': None}) == [3, 4]
+
+    def test_operators(self):
+        self.insert(*[{'_id': i, 'n': i, 'tags': [u'tag%s' % j for j in range(i)]}
+          for i in range(5)])
+        self.insert({'_id': 5, 'n': u'5'})
+        assert self.find({'n': {'$gt': 1, '$lte': 3}}) == [2, 3]
+        assert self.find({'n': {'$lt': 2}}) == [0, 1]
+        assert self.find({'n': {'$gte': u'0'}}) == [5]
+        assert self.find({'n': {'$ne': 2}}) == [0, 1, 3, 4, 5]
+        assert self.find({'n': {'$in': [1, 3, u'5']}}) == [1, 3, 5]
+        assert self.find({'n': {'$nin': [1, 3, u'5']}}) == [0, 2, 4]
+        assert self.find({'tags': {'$exists': False}}) == [5]
+        assert self.find({'tags': {'$size': 2}}) == [2]
+        assert self.find({'tags': {'$all': [u'tag0', u'tag2']}}) == [3, 4]
+        assert self.find({'tags': re.compile('^tag3')}) == [4]
+        assert self.find({'tags': {'$regex': 'TAG3', '$options': 'i'}}) == [4]
+        assert self.find({'n': {'$mod': [2, 1]}}) == [1, 3]
+        assert self.find({'n': {'$not': {'$gt': 1}}}) == [0, 1, 5]
+        assert self.find({'n': {'$type': 2}}) == [5]
+        assert self.find({'$or': [{'n': 0}, {'n': 4}]}) == [0, 4]
+        assert self.find({'$and': [{'n': {'$gt': 0}}, {'n': {'$lt': 2}}]}) == [1]
+        assert self.find({'$nor': [{'n': {'$gt': 0}}]}) == [0, 5]
+        self.assertRaises(OperationFailure, self.find, {'$where': 'this.n > 1'})
+        self.assertRaises(OperationFailure, self.find, {'$where': Code('function() { return this.tags; }')})
+
+    def test_elem_match(self):
+        self.insert({'_id': 1, 'comments': [{'author': u'me', 'votes': 1}, {'author': u'you', 'votes': 5}]},
+          {'_id': 2, 'comments': [{'author': u'me', 'votes': 5}]},
+          {'_id': 3, 'scores': [1, 8]})
+        assert self.find({'comments': {'$elemMatch': {'author': u'me', 'votes': 5}}}) == [2]
+        assert self.find({'comments.author': u'me', 'comments.votes': 5}) == [1, 2]
+        assert self.find({'scores': {'$elemMatch': {'$gt': 2, '$lt': 9}}}) == [3]
+
+    def test_sort_skip_limit(self):
+        self.insert(*[{'_id': i, 'n': i % 3, 'name': u'doc%s' % i} for i in range(10)])
+        self.insert({'_id': 10, 'name': u'nothing'})
+        assert self.find({}, sort=[('n', pymongo.DESCENDING), ('_id', 1)]) ==\
+          [2, 5, 8, 1, 4, 7, 0, 3, 6, 9, 10]
+        assert self.find({}, sort=[('n', 1), ('_id', -1)])[:4] == [10, 9, 6, 3]
+        assert self.find({}, sort=[('n', 1), ('_id', 1)], skip=2, limit=3) == [3, 6, 9]
+        assert self.find({}, sort=[('$natural', -1)], limit=2) == [10, 9]
+
+    def test_sort_numbers_and_mixed_types(self):
+        self.insert({'_id': 1, 'n': 2.5}, {'_id': 2, 'n': 1}, {'_id': 3, 'n': 10L},
+          {'_id': 4, 'n': 1})
+        assert [doc['_id'] for doc in self.col.find().sort('n', 1)] == [2, 4, 1, 3]
+        assert [doc['_id'] for doc in self.col.find().sort('n', -1)] == [3, 1, 2, 4]
+        # the strings sort after the numbers and the missing fields first
+        self.insert({'_id': 5, 'n': u'a'}, {'_id': 6})
+        assert [doc['_id'] for doc in self.col.find().sort('n', 1)] == [6, 2, 4, 1, 3, 5]
+
+    def test_encoded_documents(self):
+        self.insert({'_id': 1, 'n': 1})
+        assert self.col.find_one() == {'_id': 1, 'n': 1}
+        # the stored BSON follows the updates
+        self.col.update({'_id': 1}, {'$inc': {'n': 1}}, safe=True)
+        assert self.col.find_one() == {'_id': 1, 'n': 2}
+        assert self.col.find_and_modify({'_id': 1}, {'$inc': {'n': 1}}, new=True)['n'] == 3
+        self.col.update({'_id': 1}, {'n': 10}, safe=True)
+        assert list(self.col.find()) == [{'_id': 1, 'n': 10}]
+
+    def test_projection(self):
+        self.insert({'_id': 1, 'a': 1, 'b': {'c': 2, 'd': 3}, 'l': [{'x': 1, 'y': 2}, {'x': 3}],
+          'tags': range(10)})
+        assert self.col.find_one({}, ['a']) == {'_id': 1, 'a': 1}
+        assert self.col.find_one({}, {'b.c': 1, '_id': 0}) == {'b': {'c': 2}}
+        assert self.col.find_one({}, {'l.x': 1, '_id': 0}) == {'l': [{'x': 1}, {'x': 3}]}
+        assert self.col.find_one({}, {'b': 0, 'l': 0, 'tags': 0}) == {'_id': 1, 'a': 1}
+        assert self.col.find_one({}, {'tags': {'$slice': -2}})['tags'] == [8, 9]
+        assert self.col.find_one({}, {'tags': {'$slice': [2, 3]}, 'a': 1}) ==\
+          {'_id': 1, 'a': 1, 'tags': [2, 3, 4]}
+        # the stored document is not modified
+        assert self.col.find_one()['tags'] == range(10)
+
+    def test_batches(self):
+        self.insert(*[{'_id': i} for i in range(250)])
+        cursor = self.col.find()
+        assert len(list(cursor)) == 250
+        assert not self.connection.storage._cursors
+        assert len(list(self.col.find().batch_size(7))) == 250
+        assert len(list(self.col.find().limit(120))) == 120
+        cursor = self.col.find().batch_size(10)
+        cursor.next()
+        assert len(self.connection.storage._cursors) == 1
+        cursor.close()
+        assert not self.connection.storage._cursors
+        assert self.col.find().count() == 250
+        assert self.col.find().skip(200).limit(20).count(True) == 20
+
+    def test_update_modifiers(self):
+        self.insert({'_id': 1, 'n': 1, 'tags': [u'a', u'b'], 'sub': {'x': 1}})
+        def update(modifier):
+            self.col.update({'_id': 1}, modifier, safe=True)
+            return self.col.find_one({'_id': 1})
+        assert update({'$set': {'sub.y': 2, 'new.deep': 3}})['new'] == {'deep': 3}
+        assert update({'$unset': {'new': 1}}).get('new') is None
+        assert update({'$inc': {'n': 2, 'm': 1.5}})['n'] == 3
+        assert update({'$push': {'tags': u'c'}})['tags'] == [u'a', u'b', u'c']
+        assert update({'$pushAll': {'tags': [u'd', u'a']}})['tags'] == [u'a', u'b', u'c', u'd', u'a']
+        assert update({'$pull': {'tags': u'a'}})['tags'] == [u'b', u'c', u'd']
+        assert update({'$addToSet': {'tags': {'$each': [u'b', u'e']}}})['tags'] ==\
+          [u'b', u'c', u'd', u'e']
+        assert update({'$pop': {'tags': -1}})['tags'] == [u'c', u'd', u'e']
+        assert update({'$pullAll': {'tags': [u'c', u'e']}})['tags'] == [u'd']
+        assert update({'$rename': {'sub': u'renamed'}})['renamed'] == {'x': 1, 'y': 2}
+        assert update({'n': 42}) == {'_id': 1, 'n': 42}
+        self.assertRaises(OperationFailure, update, {'$inc': {'n': u'1'}})
+        self.assertRaises(OperationFailure, update, {'$set': {'_id': 2}})
+
+    def test_positional_update(self):
+        self.insert({'_id': 1, 'comments': [{'author': u'me', 'votes': 0}, {'author': u'you', 'votes': 0}]})
+        self.col.update({'comments.author': u'you'}, {'$inc': {'comments.$.votes': 1}}, safe=True)
+        assert [c['votes'] for c in self.col.find_one()['comments']] == [0, 1]
+
+    def test_multi_and_upsert(self):
+        self.insert(*[{'_id': i, 'n': i % 2} for i in range(4)])
+        result = self.col.update({'n': 1}, {'$set': {'odd': True}}, safe=True)
+        assert result['n'] == 1 and result['updatedExisting']
+        result = self.col.update({'n': 1}, {'$set': {'odd': True}}, multi=True, safe=True)
+        assert result['n'] == 2
+        assert self.find({'odd': True}) == [1, 3]
+        result = self.col.update({'name': u'new', 'n': {'$gt': 5}},
+          {'$inc': {'count': 1}, '$setOnInsert': {'created': True}}, upsert=True, safe=True)
+        assert not result['updatedExisting'] and result['upserted']
+        doc = self.col.find_one({'name': u'new'})
+        assert doc['count'] == 1 and doc['created'] and 'n' not in doc
+        self.col.update({'name': u'new'}, {'$inc': {'count': 1}, '$setOnInsert': {'created': False}},
+          upsert=True, safe=True)
+        assert self.col.find_one({'name': u'new'})['count'] == 2
+        assert self.col.find_one({'name': u'new'})['created']
+        assert self.col.remove({'n': 0}, safe=True)['n'] == 2
+        assert self.col.count() == 3
+
+    def test_find_and_modify(self):
+        self.insert(*[{'_id': i, 'n': i} for i in range(3)])
+        doc = self.col.find_and_modify({'n': {'$gte': 1}}, {'$inc': {'n': 10}}, sort={'n': -1})
+        assert doc == {'_id': 2, 'n': 2}
+        doc = self.col.find_and_modify({'_id': 1}, {'$inc': {'n': 10}}, new=True, fields=['n'])
+        assert doc == {'_id': 1, 'n': 11}
+        assert self.col.find_and_modify({'_id': 42}, {'$inc': {'n': 1}}) is None
+        doc = self.col.find_and_modify({'_id': 42}, {'$inc': {'n': 1}}, upsert=True, new=True)
+        assert doc == {'_id': 42, 'n': 1}
+        assert self.col.find_and_modify({'_id': 0}, remove=True) == {'_id': 0, 'n': 0}
+        assert self.find({}) == [1, 2, 42]
+
+    def test_indexes(self):
+        self.col.ensure_index([('n', 1)])
+        self.col.ensure_index([('name', 1), ('n', -1)], unique=True)
+        self.insert(*[{'_id': i, 'n': i % 10, 'name': u'doc%s' % i, 'tags': [i, i + 1]}
+          for i in range(100)])
+        assert sorted(self.col.index_information()) == ['_id_', 'n_1', 'name_1_n_-1']
+        explain = self.col.find({'n': {'$gt': 7}}).explain()
+        assert explain['cursor'] == 'BtreeCursor n_1' and explain['nscanned'] == 20, explain
+        assert explain['allPlans'] == [{'cursor': 'BtreeCursor n_1', 'indexBounds': {}}]
+        assert len(self.find({'n': {'$gt': 7}})) == 20
+        explain = self.col.find({'name': u'doc5', 'n': 5}).explain()
+        assert explain['cursor'] == 'BtreeCursor name_1_n_-1' and explain['nscanned'] == 1
+        assert self.find({'name': u'doc5', 'n': 5}) == [5]
+        assert self.find({'n': {'$in': [2, 3]}, 'name': {'$gt': u'doc8'}}) == [82, 92, 83, 93]
+        assert self.col.find({'_id': 5}).explain()['cursor'] == 'BtreeCursor _id_'
+        assert self.col.find({'name': re.compile('doc')}).explain()['cursor'] == 'BasicCursor'
+        # the indexes follow the updates and the removes
+        self.col.update({'_id': 5}, {'$set': {'n': 50}})
+        self.col.remove({'_id': 15})
+        assert self.find({'n': 5}) == [25, 35, 45, 55, 65, 75, 85, 95]
+        assert self.find({'n': 50}) == [5]
+        # multikey
+        self.col.ensure_index('tags')
+        assert self.find({'tags': 50}) == [49, 50]
+        assert self.col.find({'tags': 50}).explain()['cursor'] == 'BtreeCursor tags_1'
+        self.col.drop_index('tags_1')
+        assert self.col.find({'tags': 50}).explain()['cursor'] == 'BasicCursor'
+
+    def test_unique_index(self):
+        self.col.ensure_index('name', unique=True)
+        self.insert({'_id': 1, 'name': u'foo'}, {'_id': 2, 'name': u'bar'})
+        self.assertRaises(DuplicateKeyError, self.insert, {'_id': 3, 'name': u'foo'})
+        self.assertRaises(DuplicateKeyError, self.insert, {'_id': 1, 'name': u'egg'})
+        self.assertRaises(DuplicateKeyError, self.col.update, {'_id': 2},
+          {'$set': {'name': u'foo'}}, safe=True)
+        assert self.col.find_one({'_id': 2})['name'] == u'bar'
+        # unacknowledged writes don't raise
+        self.col.insert({'name': u'foo'})
+        assert self.col.count() == 2
+        error = self.connection.test.command('getlasterror')
+        assert error['code'] == 11000, error
+        self.assertRaises(OperationFailure, self.col.ensure_index, 'name2', unique=True)
+
+    def test_sparse_index(self):
+        self.col.ensure_index('name', unique=True, sparse=True)
+        self.insert({'_id': 1}, {'_id': 2}, {'_id': 3, 'name': u'foo'})
+        assert self.find({'name': None}) == [1, 2]
+        assert self.find({'name': u'foo'}) == [3]
+
+    def test_commands(self):
+        self.insert(*[{'_id': i, 'tags': [i % 3, 42]} for i in range(10)])
+        assert sorted(self.col.distinct('tags')) == [0, 1, 2, 42]
+        assert self.col.find({'tags': 1}).distinct('_id') == [1, 4, 7]
+        assert self.connection.test.collection_names() == [u'system.indexes', u'mongolite']
+        self.col.rename('renamed')
+        assert self.connection.test.collection_names() == [u'system.indexes', u'renamed']
+        assert self.connection.test.renamed.count() == 10
+        stats = self.connection.test.command('collstats', 'renamed')
+        assert stats['count'] == 10 and stats['size'] > 0
+        self.connection.test.drop_collection('renamed')
+        assert self.connection.test.renamed.count() == 0
+        assert self.connection.server_info()['version']
+        self.assertRaises(OperationFailure, self.connection.test.command, 'nocommand')
+
+    def test_documents(self):
+        @self.connection.register
+        class BlogPost(Document):
+            __database__ = 'test'
+            __collection__ = 'mongolite'
+            skeleton = {
+                '_type': unicode,
+                'title': unicode,
+                'date': datetime.datetime,
+                'rank': int,
+            }
+            indexes = [{'fields': [('rank', INDEX_DESCENDING)]}]
+
+        @self.connection.register
+        class Article(BlogPost):
+            skeleton = {'body': unicode}
+
+        self.connection.BlogPost().generate_indexes()
+        for i in range(5):
+            doc = self.connection.Article() if i % 2 else self.connection.BlogPost()
+            doc['title'] = u'post %s' % i
+            doc['date'] = datetime.datetime(2012, 1, i + 1)
+            doc['rank'] = i
+            doc.save()
+        posts = list(self.connection.BlogPost.find({'rank': {'$gte': 1}}).sort('rank', -1))
+        assert [type(post).__name__ for post in posts] == ['BlogPost', 'Article', 'BlogPost', 'Article']
+        assert posts[0]['date'] == datetime.datetime(2012, 1, 5)
+        assert isinstance(posts[0]['_id'], ObjectId)
+        post = self.connection.BlogPost.find_and_modify({'rank': 0}, {'$set': {'title': u'new'}}, new=True)
+        assert type(post).__name__ == 'BlogPost' and post['title'] == u'new'
+        post['rank'] = 10
+        post.save()
+        assert self.connection.BlogPost.find_one({'rank': 10})['title'] == u'new'
+        post.delete()
+        assert self.connection.BlogPost.find().count() == 4
+
+    def test_storage(self):
+        self.insert({'_id': 1})
+        other = MemoryConnection(storage=self.connection.storage)
+        assert other.test.mongolite.find_one() == {'_id': 1}
+        assert MemoryConnection().storage is default_storage
+        assert MemoryConnection().test.mongolite.find_one() is None
+        self.connection.storage.reset()
+        assert self.connection.database_names() == []
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+from mongolite import Connection, Document, metrics
+from wire_server import WireServer
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = WireServer([{'_id': 1, 'title': u'foo'}, {'_id': 2, 'title': u'bar'}])
+        self.connection = Connection(self.server.host, self.server.port)
+        @self.connection.register
+        class BlogPost(Document):
+            __database__ = 'test'
+            __collection__ = 'mongolite'
+            skeleton = {'title': unicode}
+        self.registry = metrics.enable()
+
+    def tearDown(self):
+        metrics.disable()
+        self.connection.disconnect()
+        self.server.stop()
+
+    def test_queries(self):
+        assert self.connection.BlogPost.find_one()['title'] == u'foo'
+        self.server.cursor_id = 42
+        self.server.more_documents = [{'_id': 3, 'title': u'egg'}]
+        assert len(list(self.connection.test.mongolite.find())) == 3
+        find_one = self.registry.get(u'test.mongolite', 'BlogPost', 'find_one')
+        assert find_one.count == 1 and find_one.documents == 2, find_one.as_dict()
+        assert find_one.bytes > 36, find_one.as_dict()
+        find = self.registry.get(u'test.mongolite', None, 'find')
+        assert find.count == 1 and find.documents == 2, find.as_dict()
+        getmore = self.registry.get(u'test.mongolite', None, 'getmore')
+        assert getmore.count == 1 and getmore.documents == 1, getmore.as_dict()
+        assert sum(getmore.histogram.counts) == 1
+
+    def test_writes(self):
+        doc = self.connection.BlogPost()
+        doc['title'] = u'foo'
+        doc.save()
+        self.connection.test.mongolite.remove({'title': u'foo'})
+        snapshot = self.registry.snapshot()
+        assert [(m['document'], m['operation'], m['count']) for m in snapshot] == [
+          (None, 'remove', 1), ('BlogPost', 'save', 1)], snapshot
+
+    def test_errors(self):
+        self.server.fail = True
+        self.assertRaises(Exception, self.connection.BlogPost.find_one)
+        metrics = self.registry.get(u'test.mongolite', 'BlogPost', 'find_one')
+        assert metrics.count == 1 and metrics.errors == 1, metrics.as_dict()
+
+    def test_disabled(self):
+        metrics.disable()
+        assert self.connection.BlogPost.find_one()['title'] == u'foo'
+        self.connection.BlogPost().save()
+        assert self.registry.snapshot() == []
+
+    def test_histogram(self):
+        histogram = metrics.Histogram()
+        for value in [0.0001] * 50 + [0.003] * 49 + [20]:
+            histogram.observe(value)
+        assert histogram.percentile(50) == 0.0005
+        assert histogram.percentile(99) == 0.005
+        assert histogram.percentile(100) is None
+        assert histogram.counts[-1] == 1
+
+    def test_prometheus(self):
+        self.connection.BlogPost.find_one()
+        text = self.registry.to_prometheus()
+        assert 'mongolite_operation_seconds_count{collection="test.mongolite",'\
+          'document="BlogPost",operation="find_one"} 1' in text, text
+        assert 'mongolite_operation_documents_total{collection="test.mongolite",'\
+          'document="BlogPost",operation="find_one"} 2' in text, text
+        assert 'le="+Inf"} 1' in text
@@ -28,7 +28,7 @@
 import unittest
 
 from mongolite import Document, Connection, DBRef,\
-    ConnectionError, OperationFailure, ObjectId, json_util
+    ConnectionError, OperationFailure, ObjectId, json_util, related_property
 from mongolite.schema_document import SchemaDocument
 
 import json
@@ -245,5 +245,129 @@ class SerializeTestCase(unittest.TestCase):
         self.assertEqual(json.dumps(mydoc.serialize(), default=json_util.default),
           '{"_id": {"$oid": "%s"}, "spam": {"foo": {"_id": {"$oid": "%s"}, "bar": 42}}}' % (mydoc['_id'], foo['_id']))
 
+    def test_serialize_plan(self):
+        class MyDoc(Document):
+            skeleton = {
+                "foo":int,
+                "spam":{
+                    "bar":int,
+                    "egg":{"ham":int},
+                    "empty":{},
+                },
+                "tags":[unicode],
+            }
+            serialize_mapping = {'spam.bar': 'bar'}
+
+            @property
+            def foo(self):
+                return self['foo'] * 2
+
+            @property
+            def bar(self):
+                return 'bar'
+
+            @property
+            def spam__egg__ham(self):
+                return 'ham'
+
+            @property
+            def extra__value(self):
+                return self['extra']['value'] + 1
+
+        mydoc = MyDoc()
+        mydoc['foo'] = 3
+        mydoc['tags'] = [u'a']
+        self.assertEqual(mydoc.serialize(), {'foo':6, 'spam':{'bar':'bar',
+          'egg':{'ham':'ham'}, 'empty':{}}, 'tags':[u'a']})
+        # keys which are not in the skeleton
+        mydoc['extra'] = {'value':1, 'other':2}
+        self.assertEqual(mydoc.serialize()['extra'], {'value':2, 'other':2})
+        self.assertEqual(mydoc, {'foo':3, 'spam':{'bar':None, 'egg':{'ham':None},
+          'empty':{}}, 'tags':[u'a'], 'extra':{'value':1, 'other':2}})
+
+    def test_serialize_plan_dynamic_keys(self):
+        class MyDoc(Document):
+            skeleton = {
+                "scores":dict,
+                "ranks":{unicode:int},
+            }
+
+            @property
+            def scores__a(self):
+                return 'a'
+
+        plan_size = len(MyDoc._serialize_plan)
+        for i in range(10):
+            mydoc = MyDoc()
+            mydoc['scores'] = {u'a':1, u'key%s' % i:i}
+            mydoc['ranks'] = {u'key%s' % i:i}
+            mydoc['key%s' % i] = {u'nested':i}
+            self.assertEqual(mydoc.serialize(), {'scores':{u'a':'a', u'key%s' % i:i},
+              'ranks':{u'key%s' % i:i}, 'key%s' % i:{u'nested':i}})
+        self.assertEqual(len(MyDoc._serialize_plan), plan_size)
+        self.assertEqual(MyDoc._serialize_plan['scores'][3], {})
+
+    def test_serialize_many(self):
+        @self.connection.register
+        class Foo(Document):
+            __database__ = 'test'
+            __collection__ = 'foos'
+            skeleton = {
+                "bar":int,
+                "mydoc":int,
+            }
+
+        queried = []
+
+        @self.connection.register
+        class MyDoc(Document):
+            __database__ = 'test'
+            __collection__ = 'mydocs'
+            skeleton = {
+                "_id":int,
+                "foo":ObjectId,
+                "foos":[ObjectId],
+                "children":None,
+            }
 
+            @related_property('Foo', 'foo')
+            def foo(self):
+                queried.append('foo')
+                return self.db.Foo.get_from_id(self['foo'])
+
+            @related_property('Foo', 'foos')
+            def foos(self):
+                queried.append('foos')
+                return self.db.Foo.find({'_id':{'$in':self['foos']}})
 
+            @related_property('Foo', '_id', foreign_key='mydoc', many=True)
+            def children(self):
+                queried.append('children')
+                return self.db.Foo.find({'mydoc':self['_id']})
+
+        foos = []
+        for i in range(4):
+            foo = self.connection.Foo()
+            foo['bar'] = i
+            foo['mydoc'] = i % 2
+            foo.save()
+            foos.append(foo)
+        for i in range(3):
+            mydoc = self.connection.MyDoc()
+            mydoc['_id'] = i
+            mydoc['foo'] = foos[i]['_id']
+            mydoc['foos'] = [foos[3]['_id'], foos[i]['_id'], foos[i]['_id']]
+            mydoc.save()
+
+        mydocs = self.connection.MyDoc.find().sort('_id', 1)
+        serialized = self.connection.MyDoc.serialize_many(mydocs)
+        self.assertEqual(queried, [])
+        self.assertEqual(serialized, [mydoc.serialize() for mydoc in
+          self.connection.MyDoc.find().sort('_id', 1)])
+        self.assertEqual(serialized[0]['foo'], foos[0])
+        # the related documents are listed once, in the order of the $in
+        # query (the _id index) and not in the order of the list
+        self.assertEqual(serialized[1]['foos'], [foos[1], foos[3]])
+        self.assertFalse(serialized[0]['foos'][1] is serialized[1]['foos'][1])
+        self.assertEqual(serialized[1]['children'], [foos[1], foos[3]])
+        self.assertEqual(serialized[2]['children'], [])
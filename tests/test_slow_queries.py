@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+import datetime
+import logging
+
+from mongolite import Connection, Document, slow_queries
+from mongolite.slow_queries import query_shape, SlowQueryLog
+from wire_server import WireServer
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class SlowQueriesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = WireServer([{'_id': 1, 'title': u'foo'}])
+        self.connection = Connection(self.server.host, self.server.port)
+        @self.connection.register
+        class BlogPost(Document):
+            __database__ = 'test'
+            __collection__ = 'mongolite'
+            skeleton = {'title': unicode, 'author': unicode}
+        self.handler = _ListHandler()
+        self.logger = logging.getLogger('mongolite.tests.slow_queries')
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        slow_queries.disable()
+        self.logger.removeHandler(self.handler)
+        self.connection.disconnect()
+        self.server.stop()
+
+    def test_query_shape(self):
+        assert query_shape({'author': u'bob', 'date': {'$gt': datetime.datetime.now()}}) == {
+          'author': '?', 'date': {'$gt': '?'}}
+        assert query_shape({'$or': [{'a': 1}, {'b': {'$in': [1, 2, 3]}}]}) == {
+          '$or': [{'a': '?'}, {'b': {'$in': '?'}}]}
+        assert query_shape({'tags': {'$elemMatch': {'name': u'foo', 'n': {'$gte': 2}}}}) == {
+          'tags': {'$elemMatch': {'name': '?', 'n': {'$gte': '?'}}}}
+        assert query_shape({'a': {'$not': {'$lt': 3}}, 'b': {'c': 1}}) == {
+          'a': {'$not': {'$lt': '?'}}, 'b': '?'}
+        assert query_shape(None) == '?'
+        assert query_shape({}) == {}
+
+    def test_slow_query_is_logged_with_explain(self):
+        query_log = slow_queries.enable(threshold=0.02, explain=True, logger=self.logger)
+        self.server.delay = 0.03
+        BlogPost = self.connection.BlogPost
+        assert BlogPost.find_one({'author': u'bob'})['title'] == u'foo'
+        assert len(query_log.recent) == 1
+        entry = query_log.recent[0]
+        assert entry['document'] == 'BlogPost'
+        assert entry['shape'] == '{"author": "?"}', entry
+        assert entry['explain'] == {u'_id': 1, u'title': u'foo'}, entry
+        assert entry['seconds'] >= 0.03
+        assert len(self.handler.messages) == 1
+        assert 'slow query' in self.handler.messages[0]
+        assert 'BlogPost' in self.handler.messages[0]
+        assert 'bob' not in self.handler.messages[0]
+
+    def test_fast_queries_are_aggregated(self):
+        query_log = slow_queries.enable(threshold=1, logger=self.logger)
+        self.server.delay = 0.005
+        col = self.connection.test.mongolite
+        for author in [u'bob', u'alice', u'eve']:
+            list(col.find({'author': author}).sort('title', -1))
+        list(col.find({'title': u'foo'}, fields=['title']))
+        assert not self.handler.messages and not query_log.recent
+        top = query_log.top()
+        assert len(top) == 2, top
+        assert top[0]['count'] == 3 and top[0]['shape'] == '{"author": "?"}', top
+        assert top[0]['sort'] == '[["title", -1]]', top
+        assert top[0]['document'] is None
+        assert top[1]['fields'] == '{"title": 1}', top
+        assert top[0]['slow'] == 0
+        assert len(query_log.top(1)) == 1
+        query_log.reset()
+        assert query_log.top() == []
+
+    def test_cheapest_shape_is_dropped(self):
+        query_log = SlowQueryLog(threshold=10, max_shapes=2)
+        query_log.record(u'test.a', None, {'a': 1}, None, None, 3)
+        query_log.record(u'test.a', None, {'b': 1}, None, None, 1)
+        query_log.record(u'test.a', None, {'c': 1}, None, None, 2)
+        assert [entry['shape'] for entry in query_log.top()] == ['{"a": "?"}', '{"c": "?"}']
+
+    def test_disabled(self):
+        query_log = slow_queries.enable(threshold=0, logger=self.logger)
+        slow_queries.disable()
+        self.connection.BlogPost.find_one()
+        assert query_log.top() == []
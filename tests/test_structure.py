@@ -137,6 +137,61 @@ class StructureTestCase(unittest.TestCase):
         self.assertEqual(mydoc._namespaces, ['1', '1.2', '1.2.3', '1.2.3.4', '1.2.3.4.5', '1.2.3.4.5.6', '1.2.3.4.5.6.8', '1.2.3.4.5.6.8.$unicode', '1.2.3.4.5.6.8.$unicode.$int', '1.2.3.4.5.6.7'])
         self.assertEqual(mydoc, {'1': {'2': {'3': {'4': {'5': {'6': {'8': {}, '7': None}}}}}}})
  
+    def test_skeleton_template(self):
+        class MyDoc(SchemaDocument):
+            skeleton = {
+                "foo":{"bar":[int], "spam":{"eggs":unicode}},
+                "bla":{unicode:int},
+                "pos":(float, float),
+                "dic":dict,
+            }
+            optional = {
+                "foo":{"opt":int},
+                "tags":[unicode],
+            }
+        mydoc = MyDoc()
+        generated = MyDoc(gen_skel=False)
+        generated.generate_skeleton()
+        self.assertEqual(mydoc, generated)
+        self.assertEqual(mydoc, {"foo":{"bar":[], "spam":{"eggs":None}, "opt":None},
+          "bla":{}, "pos":[None, None], "dic":{}, "tags":[]})
+        mydoc["foo"]["bar"].append(3)
+        mydoc["foo"]["spam"]["eggs"] = u"bla"
+        mydoc["pos"][0] = 1.5
+        mydoc["dic"]["a"] = 1
+        mydoc["tags"].append(u"tag")
+        self.assertEqual(MyDoc(), generated)
+
+    def test_skeleton_template_reassigned(self):
+        class MyDoc(Document):
+            skeleton = {"foo":{"bar":int}}
+        class SubDoc(MyDoc):
+            pass
+        class OtherDoc(MyDoc):
+            skeleton = {"other":int}
+        class MergedDoc(MyDoc):
+            optional = {"foo":{"opt":[int]}}
+        # the template is compiled at class creation
+        self.assertTrue('_compiled_skeleton' in vars(MyDoc))
+        for klass in [SubDoc, OtherDoc, MergedDoc]:
+            generated = klass(gen_skel=False)
+            generated.generate_skeleton()
+            self.assertEqual(klass(), generated)
+        self.assertEqual(MergedDoc(), {"foo":{"bar":None, "opt":[]}})
+        self.assertEqual(MyDoc(), {"foo":{"bar":None}})
+        self.assertEqual(MyDoc().serialize(), {"foo":{"bar":None}})
+        MyDoc.skeleton = {"foo":{"spam":unicode}, "eggs":[int]}
+        self.assertEqual(MyDoc(), {"foo":{"spam":None}, "eggs":[]})
+        self.assertEqual(MyDoc().serialize(), {"foo":{"spam":None}, "eggs":[]})
+        self.assertTrue("eggs" in MyDoc.__doc__)
+        MyDoc.optional = {"opt":int}
+        self.assertEqual(MyDoc(), {"foo":{"spam":None}, "eggs":[], "opt":None})
+        # the subclasses keep the merged skeleton they were created with and
+        # follow the attributes they inherit
+        self.assertEqual(SubDoc.skeleton, {"foo":{"bar":int}})
+        self.assertEqual(SubDoc(), {"foo":{"bar":None}, "opt":None})
+        self.assertEqual(OtherDoc(), {"foo":{"bar":None}, "other":None, "opt":None})
+
     def test_big_nested_skeleton_mongo_document(self):
         class MyDoc(Document):
             skeleton = {
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009-2011, Nicolas Clairon
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the University of California, Berkeley nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE REGENTS AND CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+A minimal stand-in for mongod speaking the wire protocol. It answers the
+commands pymongo sends while connecting (`ismaster`, `ping`...) and returns
+`documents` to every query, optionally after a delay. Used to test the
+routing of MasterSlaveConnection without a replica set.
+"""
+
+import socket
+import struct
+import threading
+import time
+import SocketServer
+
+import bson
+
+OP_REPLY = 1
+OP_QUERY = 2004
+OP_GET_MORE = 2005
+OP_KILL_CURSORS = 2007
+
+class _Handler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        server = self.server.wire_server
+        server._sockets.append(self.request)
+        while True:
+            header = self._receive(16)
+            if header is None:
+                return
+            length, request_id, response_to, opcode = struct.unpack("<iiii", header)
+            data = self._receive(length - 16)
+            if data is None:
+                return
+            if opcode == OP_KILL_CURSORS:
+                count = struct.unpack("<i", data[4:8])[0]
+                server.killed_cursors.extend(struct.unpack("<%sq" % count, data[8:8 + 8 * count]))
+                continue
+            if opcode == OP_GET_MORE:
+                server.get_mores += 1
+                self._reply(request_id, server.more_documents, 0, len(server.documents))
+                continue
+            if opcode != OP_QUERY:
+                # inserts, updates and deletes have no reply
+                server.writes += 1
+                continue
+            collection_end = data.index('\x00', 4)
+            collection = data[4:collection_end]
+            query = bson.decode_all(data[collection_end + 9:collection_end + 9 +
+              struct.unpack("<i", data[collection_end + 9:collection_end + 13])[0]])[0]
+            if server.fail:
+                return
+            cursor_id = 0
+            if collection.endswith('.$cmd'):
+                documents = [server.command(query)]
+            elif collection in server.collections:
+                documents = server.collections[collection]
+            else:
+                cursor_id = server.cursor_id
+                server.queries += 1
+                if server.delay:
+                    time.sleep(server.delay)
+                documents = server.documents
+            self._reply(request_id, documents, cursor_id)
+
+    def _receive(self, length):
+        message = ''
+        while len(message) < length:
+            try:
+                chunk = self.request.recv(length - len(message))
+            except socket.error:
+                return None
+            if not chunk:
+                return None
+            message += chunk
+        return message
+
+    def _reply(self, request_id, documents, cursor_id=0, starting_from=0):
+        body = ''.join(bson.BSON.encode(document) for document in documents)
+        reply = struct.pack("<iqii", 0, cursor_id, starting_from, len(documents)) + body
+        header = struct.pack("<iiii", 16 + len(reply), 0, request_id, OP_REPLY)
+        try:
+            self.request.sendall(header + reply)
+        except socket.error:
+            pass
+
+class _ThreadingServer(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class WireServer(object):
+    """
+    a server listening on a free local port. `delay` (in seconds) is added
+    before answering the queries and `fail` closes every connection. The
+    commands are never delayed. The queries return the cursor `cursor_id`,
+    the ids of the killed cursors are stored in `killed_cursors` and a
+    getmore on it returns `more_documents`.
+    `collections` maps full collection names to the documents returned
+    instead of `documents` (not counted in `queries`) and getlasterror
+    returns `last_op` if set
+    """
+
+    def __init__(self, documents=None, delay=0, ismaster=True):
+        self.documents = documents or []
+        self.delay = delay
+        self.fail = False
+        self.ismaster = ismaster
+        self.queries = 0
+        self.cursor_id = 0
+        self.killed_cursors = []
+        self.more_documents = []
+        self.get_mores = 0
+        self.collections = {}
+        self.writes = 0
+        self.last_op = None
+        self._sockets = []
+        self._server = _ThreadingServer(('localhost', 0), _Handler)
+        self._server.wire_server = self
+        self.host, self.port = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.01,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def command(self, query):
+        if 'ismaster' in query or 'isMaster' in query:
+            return {'ismaster': self.ismaster, 'maxBsonObjectSize': 16 * 1024 * 1024, 'ok': 1.0}
+        if 'getlasterror' in query or 'getLastError' in query:
+            response = {'err': None, 'n': 0, 'ok': 1.0}
+            if self.last_op is not None:
+                response['lastOp'] = self.last_op
+            return response
+        return {'ok': 1.0}
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        for sock in self._sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass